@@ -0,0 +1,134 @@
+##################################################################
+# anomalies.py
+#
+# Overview: Unusual ridership days across the CTA L network
+#   scan_anomalies scores every station's every day against a robust
+#   baseline: the rolling median of the same station's nearest days of
+#   the same Type_of_Day (weekdays against weekdays, Saturdays against
+#   Saturdays), with the median absolute deviation (MAD) as the spread.
+#   The score is how many MAD-based standard deviations a day sits
+#   from its baseline, so holidays, closures and events stand out
+#   without being skewed by each other. All stations are scored in one
+#   vectorized NumPy pass over the columnar snapshot of Ridership (see
+#   columnar.py), a few seconds over the full history, and the highest
+#   scoring days network-wide are returned. NumPy is required.
+##################################################################
+
+from dataclasses import dataclass
+
+import columnar
+import queries
+import station_resolver
+
+#same-type days in each baseline, odd so the median is one of them
+WINDOW = 15
+
+#rows scored at a time, bounding the (rows x WINDOW) working arrays
+CHUNK_ROWS = 250_000
+
+#MAD of a normal distribution is this fraction of its standard deviation
+MAD_SCALE = 1.4826
+
+#spread used when a baseline's MAD is smaller, in riders, so a flat
+#baseline doesn't turn every small change into an outlier
+MIN_SPREAD = 10
+
+DAY_TYPE_LETTERS = {code: letter for letter, code in columnar.DAY_TYPES.items()}
+
+@dataclass(frozen=True, slots=True)
+class Anomaly:
+    station: queries.Station
+    date: str
+    day_type: str
+    riders: int
+    expected: float
+    score: float
+
+##################################################################
+#
+# robust_scores
+#
+# (expected, score) arrays for values grouped into runs: groupStart
+# and groupEnd give, for each value, the bounds of its run. Each value
+# is compared with the window values of its run centred on it (shifted
+# inward at the ends of a run). Runs shorter than window get NaN.
+#
+def robust_scores(values, groupStart, groupEnd, window=WINDOW):
+    np = columnar.np
+    expected = np.full(len(values), np.nan)
+    scores = np.full(len(values), np.nan)
+    offsets = np.arange(window)
+    middle = window // 2
+
+    for first in range(0, len(values), CHUNK_ROWS):
+        rows = np.arange(first, min(first + CHUNK_ROWS, len(values)))
+        starts, ends = groupStart[rows], groupEnd[rows]
+        full = ends - starts >= window
+        rows, starts, ends = rows[full], starts[full], ends[full]
+        if len(rows) == 0:
+            continue
+
+        windowStart = np.clip(rows - middle, starts, ends - window)
+        windows = values[windowStart[:, None] + offsets]
+        median = np.partition(windows, middle, axis=1)[:, middle]
+        mad = np.partition(np.abs(windows - median[:, None]), middle, axis=1)[:, middle]
+
+        expected[rows] = median
+        scores[rows] = (values[rows] - median) / np.maximum(mad * MAD_SCALE, MIN_SPREAD)
+    return expected, scores
+
+##################################################################
+#
+# scan_anomalies
+#
+# The top Anomalies (by absolute score, or only drops / only surges
+# with direction 'low' / 'high') among the given stations, every
+# station by default. Returns None if NumPy is not installed. Uses
+# the columnar engine's arrays when enabled, otherwise the snapshot
+# next to the database (built on first use).
+#
+def scan_anomalies(dbConn, stations=None, top=20, direction='both', window=WINDOW):
+    if not columnar.available():
+        return None
+    if window < 3 or window % 2 == 0:
+        raise ValueError("window must be an odd number of days, at least 3")
+    np = columnar.np
+
+    engine = columnar.get_engine() or columnar.open_columns(dbConn)
+    codes = np.repeat(np.arange(len(engine.station_ids)), np.diff(engine.offsets))
+    rows = np.arange(len(codes))
+    if stations is not None:
+        wanted = [engine.codes[station.station_id] for station in stations if station.station_id in engine.codes]
+        rows = rows[np.isin(codes, wanted)]
+
+    #each station's days of one type are a run, in day order (the
+    #snapshot is sorted by station then day and the sort is stable)
+    keys = codes[rows] * 4 + engine.day_type[rows]
+    rows = rows[np.argsort(keys, kind='stable')]
+    keys = codes[rows] * 4 + engine.day_type[rows]
+    boundaries = np.flatnonzero(np.diff(keys)) + 1
+    runStarts = np.concatenate(([0], boundaries))
+    runEnds = np.concatenate((boundaries, [len(rows)]))
+    lengths = runEnds - runStarts
+
+    values = engine.riders[rows].astype(np.float64)
+    expected, scores = robust_scores(values, np.repeat(runStarts, lengths), np.repeat(runEnds, lengths), window)
+
+    ranked = {'low': -scores, 'high': scores}.get(direction, np.abs(scores))
+    ranked = np.where(np.isnan(ranked), -np.inf, ranked)
+    count = min(top, int(np.isfinite(ranked).sum()))
+    if count == 0:
+        return ()
+    best = np.argpartition(-ranked, count - 1)[:count]
+    best = best[np.argsort(-ranked[best], kind='stable')]
+
+    names = dict(station_resolver.get_resolver(dbConn).stations)
+    dates = [str(day) for day in engine.day[rows[best]].astype(np.int64).astype('datetime64[D]')]
+    found = []
+    for position, rideDate in zip(best, dates):
+        row = rows[position]
+        stationID = int(engine.station_ids[codes[row]])
+        found.append(Anomaly(queries.Station(stationID, names.get(stationID, str(stationID))), rideDate,
+                             DAY_TYPE_LETTERS.get(int(engine.day_type[row]), '?'), int(engine.riders[row]),
+                             float(expected[position]), float(scores[position])))
+    return tuple(found)
@@ -0,0 +1,487 @@
+##################################################################
+# batch.py
+#
+# Overview: Non-interactive queries for the CTA L analysis app
+#   Each of the nine commands has a function here that takes lists of
+#   stations / years / coordinates instead of prompting, answers all of
+#   them with one grouped query, and returns a list of row dicts.
+#   The answers come from queries.py, so they share its result cache.
+#   main() exposes the same functions as CLI subcommands that write
+#   the rows as CSV or JSON, e.g.
+#     python3 main.py yearly --format csv > yearly.csv
+#     python3 main.py monthly --station Howard --year 2019 --year 2020
+#     python3 main.py series --station Howard --start 2019-01-01 --end 2021-01-01 --window 3 --yoy
+##################################################################
+
+import argparse
+import csv
+import datetime
+import json
+import sys
+
+import anomalies
+import columnar
+import database
+import partitions
+import prefix_index
+import queries
+import ranking
+import timeseries
+import topology
+import tracing
+
+DIRECTIONS = {'n': 'N', 'north': 'N', 's': 'S', 'south': 'S',
+              'e': 'E', 'east': 'E', 'w': 'W', 'west': 'W'}
+
+#percentage of part in total, 0 when there is no total
+def _ratio(part, total):
+    if total > 0:
+        return (part / total) * 100
+    return 0
+
+#command 1
+#every station matching each pattern
+def station_search(dbConn, patterns):
+    rows = []
+    for pattern in patterns:
+        for station in queries.find_stations(dbConn, pattern):
+            rows.append({'pattern': pattern, 'station_id': station.station_id,
+                         'station_name': station.station_name})
+    return rows
+
+#command 2
+#weekday / saturday / sunday-holiday split for each station,
+#no patterns means every station
+def ridership_percentage(dbConn, stationPatterns=None):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns or ()))
+
+    rows = []
+    for split in queries.ridership_split(dbConn, stations):
+        rows.append({
+            'station_id': split.station.station_id,
+            'station_name': split.station.station_name,
+            'weekday_riders': split.weekday,
+            'weekday_pct': round(_ratio(split.weekday, split.total), 2),
+            'saturday_riders': split.saturday,
+            'saturday_pct': round(_ratio(split.saturday, split.total), 2),
+            'sunday_holiday_riders': split.sunday,
+            'sunday_holiday_pct': round(_ratio(split.sunday, split.total), 2),
+            'total_riders': split.total,
+        })
+    return rows
+
+#command 3
+#each station's ridership by type of day and its share of the network
+#total, most riders of dayType first, yielded one row at a time
+def total_ridership(dbConn, dayType='W', top=None):
+    for ranked in ranking.rank_stations(dbConn, dayType, top):
+        totals = ranked.totals
+        network = ranked.network
+        yield {
+            'rank': ranked.rank,
+            'station_id': totals.station.station_id,
+            'station_name': totals.station.station_name,
+            'weekday_riders': totals.weekday,
+            'weekday_pct': round(_ratio(totals.weekday, network[1]), 2),
+            'saturday_riders': totals.saturday,
+            'saturday_pct': round(_ratio(totals.saturday, network[2]), 2),
+            'sunday_holiday_riders': totals.sunday,
+            'sunday_holiday_pct': round(_ratio(totals.sunday, network[3]), 2),
+            'total_riders': totals.total,
+        }
+
+#command 4
+#stops of each line color in each direction
+def line_stops(dbConn, colors, directions):
+    rows = []
+    for color in colors:
+        lineID = queries.line_id(dbConn, color.strip())
+        if lineID is None:
+            continue
+        for direction in directions:
+            direction = DIRECTIONS.get(direction.strip().lower(), direction)
+            for stop in queries.line_stops(dbConn, lineID, direction):
+                rows.append({'color': color, 'stop_name': stop.stop_name,
+                             'direction': stop.direction, 'ada': stop.ada})
+    return rows
+
+#command 5
+#number of stops of each color by direction
+def stops_by_color(dbConn):
+    totalStops = queries.total_stops(dbConn)
+    return [{'color': count.color, 'direction': count.direction, 'num_stops': count.num_stops,
+             'pct': round(_ratio(count.num_stops, totalStops), 2)}
+            for count in queries.stops_per_color(dbConn)]
+
+#command 6
+#yearly ridership for each station, one grouped query for all of them
+def yearly_ridership(dbConn, stationPatterns=None):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns or ()))
+
+    rows = []
+    for series in queries.yearly_ridership(dbConn, stations):
+        for year, riders in zip(series.years, series.riders):
+            rows.append({'station_id': series.station.station_id, 'station_name': series.station.station_name,
+                         'year': int(year), 'riders': riders})
+    return rows
+
+#command 7
+#monthly ridership for each station in each year
+def monthly_ridership(dbConn, stationPatterns, years):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns or ()))
+
+    rows = []
+    for year in years:
+        for series in queries.monthly_ridership(dbConn, stations, str(year)):
+            for month, riders in zip(series.months, series.riders):
+                rows.append({'station_id': series.station.station_id, 'station_name': series.station.station_name,
+                             'year': int(year), 'month': int(month), 'riders': riders})
+    rows.sort(key=lambda row: (row['station_name'], row['year'], row['month']))
+    return rows
+
+#command 8
+#daily ridership for each station in each year
+def daily_ridership(dbConn, stationPatterns, years):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns or ()))
+
+    rows = []
+    for year in years:
+        for series in queries.daily_ridership(dbConn, stations, str(year)):
+            for rideDate, riders in zip(series.dates, series.riders):
+                rows.append({'station_id': series.station.station_id, 'station_name': series.station.station_name,
+                             'date': rideDate, 'riders': riders})
+    rows.sort(key=lambda row: (row['station_name'], row['date']))
+    return rows
+
+#command 8, N stations
+#one row per day of each year with a column per station, all stations
+#of a year from a single pivoted query
+def compare_stations(dbConn, stationPatterns, years):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns or ()))
+
+    rows = []
+    for year in years:
+        matrix = queries.daily_matrix(dbConn, stations, str(year))
+        for rideDate, riders in zip(matrix.dates, matrix.riders):
+            row = {'date': rideDate}
+            for station, total_riders in zip(matrix.stations, riders):
+                row[station.station_name] = total_riders
+            rows.append(row)
+    return rows
+
+#ridership of each station per period between two dates, with an
+#optional rolling mean and year-over-year change, one row per station
+#and period
+def ridership_series(dbConn, stationPatterns, start, end, granularity='month', window=None, yoy=False):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns or ()))
+    if not stations:
+        return []
+    series = timeseries.ridership_series(dbConn, stations, start, end, granularity, window, yoy)
+
+    rows = []
+    for column, station in enumerate(series.stations):
+        for index, period in enumerate(series.periods):
+            row = {'station_id': station.station_id, 'station_name': station.station_name,
+                   'period': period, 'riders': series.riders[index][column]}
+            if window is not None:
+                rolling = series.rolling[index][column]
+                row[f'rolling_{window}'] = round(rolling, 2) if rolling is not None else None
+            if yoy:
+                row['yoy_change'] = series.yoy[index][column]
+            rows.append(row)
+    return rows
+
+#weekday / saturday / sunday-holiday ridership of each station between
+#two dates
+def range_ridership(dbConn, stationPatterns, start, end):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns or ()))
+
+    rows = []
+    for split in queries.range_split(dbConn, stations, start, end):
+        rows.append({'station_id': split.station.station_id, 'station_name': split.station.station_name,
+                     'start': start, 'end': end, 'weekday': split.weekday, 'saturday': split.saturday,
+                     'sunday_holiday': split.sunday, 'total': split.total})
+    return rows
+
+#the most unusual station days, scored against each station's usual
+#ridership for the type of day
+def ridership_anomalies(dbConn, stationPatterns, top=20, direction='both', window=anomalies.WINDOW):
+    stations = queries.match_stations(dbConn, tuple(stationPatterns)) if stationPatterns else None
+    try:
+        found = anomalies.scan_anomalies(dbConn, stations, top, direction, window)
+    except ValueError as error:
+        raise SystemExit(f"**{error}")
+    if found is None:
+        raise SystemExit("**NumPy is not installed, the anomaly scan needs it")
+
+    rows = []
+    for anomaly in found:
+        rows.append({'station_id': anomaly.station.station_id, 'station_name': anomaly.station.station_name,
+                     'date': anomaly.date, 'day_type': anomaly.day_type, 'riders': anomaly.riders,
+                     'expected': round(anomaly.expected, 1), 'score': round(anomaly.score, 2)})
+    return rows
+
+#command 9
+#stations within radius miles of each coordinate, nearest first
+def nearby_stations(dbConn, coordinates, radius=1.0):
+    rows = []
+    for lat, lon in coordinates:
+        for station in queries.nearby_stations(dbConn, lat, lon, radius):
+            rows.append({'latitude': lat, 'longitude': lon, 'station_name': station.station_name,
+                         'station_latitude': station.latitude, 'station_longitude': station.longitude,
+                         'distance_miles': round(station.distance, 3)})
+    return rows
+
+#command 9, by count instead of radius
+#the count stations nearest each coordinate, nearest first
+def nearest_stations(dbConn, coordinates, count=1):
+    rows = []
+    for lat, lon in coordinates:
+        for station in queries.nearest_stations(dbConn, lat, lon, count):
+            rows.append({'latitude': lat, 'longitude': lon, 'station_name': station.station_name,
+                         'station_latitude': station.latitude, 'station_longitude': station.longitude,
+                         'distance_miles': round(station.distance, 3)})
+    return rows
+
+#stations served by more than one line
+def transfer_stations(dbConn):
+    return [{'station_id': transfer.station.station_id, 'station_name': transfer.station.station_name,
+             'colors': " ".join(transfer.colors)}
+            for transfer in topology.get_topology(dbConn).transfer_stations()]
+
+#stops of a line in a direction from one station to another, in travel order
+def stops_between(dbConn, color, direction, fromName, toName):
+    lineID = queries.line_id(dbConn, color)
+    fromStation = queries.station_by_name(dbConn, fromName)
+    toStation = queries.station_by_name(dbConn, toName)
+    if lineID is None or fromStation is None or toStation is None:
+        return []
+
+    direction = DIRECTIONS.get(direction.strip().lower(), direction)
+    stops = topology.get_topology(dbConn).stops_between(lineID, direction, fromStation.station_id, toStation.station_id)
+    return [{'stop_number': number, 'station_id': stop.station.station_id, 'station_name': stop.station.station_name,
+             'stop_name': stop.stop_name, 'ada': stop.ada}
+            for number, stop in enumerate(stops, start=1)]
+
+##################################################################
+#
+# write_rows
+#
+# Writes row dicts to out as CSV (header from the first row) or as
+# a JSON array. rows may be any iterable and is written as it is read.
+#
+def write_rows(rows, out, fmt='csv'):
+    if fmt == 'json':
+        separator = "\n  "
+        out.write("[")
+        for row in rows:
+            out.write(separator)
+            out.write(json.dumps(row))
+            separator = ",\n  "
+        out.write("\n]\n" if separator != "\n  " else "]\n")
+        return
+
+    writer = None
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(out, fieldnames=list(row.keys()))
+            writer.writeheader()
+        writer.writerow(row)
+
+#parses "LAT,LON" into a pair of floats
+def parse_coordinate(text):
+    try:
+        lat, lon = text.split(",")
+        return (float(lat), float(lon))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected LAT,LON, got {text!r}")
+
+#checks a "YYYY-MM-DD" date
+def parse_day(text):
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {text!r}")
+
+##################################################################
+#
+# build_parser
+#
+# One subcommand per REPL command. Station options may repeat and
+# default to every station. Without a subcommand main.py starts the
+# REPL, using the options that apply to it.
+#
+def build_parser():
+    parser = argparse.ArgumentParser(prog='main.py', description='CTA L analysis app. Without a subcommand, starts the interactive app.')
+    parser.add_argument('--db', default=database.DB_FILE, help='ridership database file')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv', help='output format')
+    parser.add_argument('--output', help='write to this file instead of stdout')
+    parser.add_argument('--columnar', action='store_true', help='answer ridership queries from the NumPy columnar snapshot')
+    parser.add_argument('--prefix-index', action='store_true', help='answer ridership totals from the NumPy prefix-sum index')
+    parser.add_argument('--partitions', action='store_true', help='answer ridership by year from per-year database files')
+    parser.add_argument('--immutable', action='store_true', help='treat the database as immutable while open, for files nothing else writes to')
+    parser.add_argument('--in-memory', action='store_true', help='copy the database into memory and query the copy')
+    parser.add_argument('--memory-from', type=parse_day, help='with --in-memory, copy only ridership from this date')
+    parser.add_argument('--memory-to', type=parse_day, help='with --in-memory, copy only ridership before this date')
+    parser.add_argument('--slow-query-ms', type=float, default=tracing.SLOW_QUERY_MS, help='interactive app: log queries slower than this many ms')
+    parser.add_argument('--slow-log', default=tracing.SLOW_QUERY_LOG, help='interactive app: slow-query log file')
+    parser.add_argument('--trace-plans', action='store_true', help='interactive app: log the query plan of slow queries')
+    parser.add_argument('--profile-startup', action='store_true', help='interactive app: report the time spent in each startup step')
+
+    commands = parser.add_subparsers(dest='command')
+
+    search = commands.add_parser('search', help='command 1: stations matching name patterns')
+    search.add_argument('patterns', nargs='+', help='partial station names (wildcards _ and %%)')
+
+    percentage = commands.add_parser('percentage', help='command 2: weekday/saturday/sunday split')
+    percentage.add_argument('--station', action='append', help='station name pattern, repeatable')
+
+    totals = commands.add_parser('totals', help='command 3: stations ranked by ridership')
+    totals.add_argument('--day-type', choices=list(ranking.DAY_TYPES), default='W', help='rank by this type of day')
+    totals.add_argument('--top', type=int, help='only the N highest ranked stations')
+
+    line = commands.add_parser('line', help='command 4: stops of a line in a direction')
+    line.add_argument('--color', action='append', required=True, help='line color, repeatable')
+    line.add_argument('--direction', action='append', required=True, help='N/S/E/W, repeatable')
+
+    commands.add_parser('colors', help='command 5: number of stops per color and direction')
+
+    commands.add_parser('transfers', help='stations served by more than one line')
+
+    between = commands.add_parser('between', help='stops of a line from one station to another')
+    between.add_argument('--color', required=True, help='line color')
+    between.add_argument('--direction', required=True, help='N/S/E/W')
+    between.add_argument('--from', dest='from_station', required=True, help='first station name')
+    between.add_argument('--to', dest='to_station', required=True, help='last station name')
+
+    yearly = commands.add_parser('yearly', help='command 6: yearly ridership')
+    yearly.add_argument('--station', action='append', help='station name pattern, repeatable')
+
+    monthly = commands.add_parser('monthly', help='command 7: monthly ridership')
+    monthly.add_argument('--station', action='append', help='station name pattern, repeatable')
+    monthly.add_argument('--year', action='append', type=int, required=True, help='year, repeatable')
+
+    daily = commands.add_parser('daily', help='command 8: daily ridership')
+    daily.add_argument('--station', action='append', help='station name pattern, repeatable')
+    daily.add_argument('--year', action='append', type=int, required=True, help='year, repeatable')
+
+    compare = commands.add_parser('compare', help='command 8: stations side by side, one column each')
+    compare.add_argument('--station', action='append', help='station name pattern, repeatable')
+    compare.add_argument('--year', action='append', type=int, required=True, help='year, repeatable')
+
+    series = commands.add_parser('series', help='ridership per day/week/month/quarter/year over a date range')
+    series.add_argument('--station', action='append', help='station name pattern, repeatable')
+    series.add_argument('--start', type=parse_day, required=True, help='first date, YYYY-MM-DD')
+    series.add_argument('--end', type=parse_day, required=True, help='end date (not included), YYYY-MM-DD')
+    series.add_argument('--granularity', choices=timeseries.GRANULARITIES, default='month', help='period length')
+    series.add_argument('--window', type=int, help='rolling mean over this many periods')
+    series.add_argument('--yoy', action='store_true', help='add the change from a year earlier')
+
+    dateRange = commands.add_parser('range', help='ridership by type of day between two dates')
+    dateRange.add_argument('--station', action='append', help='station name pattern, repeatable')
+    dateRange.add_argument('--start', type=parse_day, required=True, help='first date, YYYY-MM-DD')
+    dateRange.add_argument('--end', type=parse_day, required=True, help='end date (not included), YYYY-MM-DD')
+
+    unusual = commands.add_parser('anomalies', help='the most unusual station days network-wide')
+    unusual.add_argument('--station', action='append', help='station name pattern, repeatable (default every station)')
+    unusual.add_argument('--top', type=int, default=20, help='number of days to report')
+    unusual.add_argument('--direction', choices=('both', 'low', 'high'), default='both',
+                         help='drops, surges or both')
+    unusual.add_argument('--window', type=int, default=anomalies.WINDOW,
+                         help='same-type days in each baseline (odd)')
+
+    nearby = commands.add_parser('nearby', help='command 9: stations near coordinates')
+    nearby.add_argument('coordinates', nargs='+', type=parse_coordinate, help='LAT,LON pairs')
+    nearby.add_argument('--radius', type=float, default=1.0, help='search radius in miles')
+
+    nearest = commands.add_parser('nearest', help='command 9: the stations nearest coordinates, however far')
+    nearest.add_argument('coordinates', nargs='+', type=parse_coordinate, help='LAT,LON pairs')
+    nearest.add_argument('--count', type=int, default=1, help='stations per coordinate')
+
+    return parser
+
+##################################################################
+#
+# run_command
+#
+# Dispatches parsed arguments to the matching query function.
+#
+def run_command(dbConn, args):
+    if args.command == 'search':
+        return station_search(dbConn, args.patterns)
+    if args.command == 'percentage':
+        return ridership_percentage(dbConn, args.station)
+    if args.command == 'totals':
+        return total_ridership(dbConn, args.day_type, args.top)
+    if args.command == 'line':
+        return line_stops(dbConn, args.color, args.direction)
+    if args.command == 'colors':
+        return stops_by_color(dbConn)
+    if args.command == 'transfers':
+        return transfer_stations(dbConn)
+    if args.command == 'between':
+        return stops_between(dbConn, args.color, args.direction, args.from_station, args.to_station)
+    if args.command == 'yearly':
+        return yearly_ridership(dbConn, args.station)
+    if args.command == 'monthly':
+        return monthly_ridership(dbConn, args.station, args.year)
+    if args.command == 'daily':
+        return daily_ridership(dbConn, args.station, args.year)
+    if args.command == 'compare':
+        return compare_stations(dbConn, args.station, args.year)
+    if args.command == 'series':
+        return ridership_series(dbConn, args.station, args.start, args.end, args.granularity, args.window, args.yoy)
+    if args.command == 'range':
+        return range_ridership(dbConn, args.station, args.start, args.end)
+    if args.command == 'anomalies':
+        return ridership_anomalies(dbConn, args.station, args.top, args.direction, args.window)
+    if args.command == 'nearby':
+        return nearby_stations(dbConn, args.coordinates, args.radius)
+    if args.command == 'nearest':
+        return nearest_stations(dbConn, args.coordinates, args.count)
+    raise ValueError(f"unknown command {args.command}")
+
+##################################################################
+#
+# run
+#
+# Runs the subcommand of already parsed arguments and writes its rows.
+#
+def run(args):
+    pool = database.open_pool(args.db, args.immutable, args.in_memory, args.memory_from, args.memory_to)
+    if isinstance(pool, database.MemoryPool):
+        print(f"**{pool.describe()}", file=sys.stderr)
+    dbConn = pool.connection()
+    try:
+        if args.columnar and columnar.enable(dbConn) is None:
+            print("**NumPy is not installed, using SQLite...", file=sys.stderr)
+        if args.prefix_index and prefix_index.enable(dbConn) is None:
+            print("**NumPy is not installed, using SQLite...", file=sys.stderr)
+        if args.partitions and partitions.enable(dbConn) is None:
+            print("**Year partitions need a database file, using SQLite...", file=sys.stderr)
+
+        rows = run_command(dbConn, args)
+
+        #rows may be a generator reading the database, so write them
+        #before the connection closes
+        if args.output:
+            with open(args.output, 'w', newline='') as out:
+                write_rows(rows, out, args.format)
+        else:
+            write_rows(rows, sys.stdout, args.format)
+    finally:
+        columnar.disable()
+        prefix_index.disable()
+        partitions.disable()
+        pool.close()
+
+    return 0
+
+##################################################################
+#
+# main
+#
+# Entry point for "python3 main.py <subcommand> ...".
+#
+def main(argv=None):
+    return run(build_parser().parse_args(argv))
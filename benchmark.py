@@ -0,0 +1,233 @@
+##################################################################
+# benchmark.py
+#
+# Overview: Benchmark harness for the CTA L analysis app
+#   Times startup (opening the database, print_stats) and the queries
+#   behind each of the nine commands against a real or synthetic
+#   database, reporting p50 / p95 latency and peak Python memory. The
+#   memory comes from a separate traced run, since tracemalloc slows
+#   allocation and would skew the timings. The query cache is cleared
+#   before every run so each timing includes the database work.
+#   Results can be saved as JSON and later runs compared against them
+#   to catch regressions.
+#     python3 benchmark.py --stations 150 --years 25
+#     python3 benchmark.py --db CTA2_L_daily_ridership.db --save base.json
+#     python3 benchmark.py --db CTA2_L_daily_ridership.db --compare base.json
+##################################################################
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import columnar
+import database
+import prefix_index
+import queries
+import ranking
+import stats_cache
+import synthetic_db
+
+##################################################################
+#
+# measure
+#
+# Runs func repeat times untraced, returning the wall times in
+# milliseconds, then once more under tracemalloc for the peak memory
+# in bytes. traced=False skips the extra run (peak None), for work
+# that only happens once, like a first build.
+#
+def measure(func, repeat, traced=True):
+    times = []
+    for _ in range(repeat):
+        queries.clear_cache()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    if not traced:
+        return times, None
+
+    queries.clear_cache()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+#p50 and p95 of a list of timings
+def percentiles(times):
+    if len(times) == 1:
+        return times[0], times[0]
+    cuts = statistics.quantiles(times, n=100, method='inclusive')
+    return cuts[49], cuts[94]
+
+##################################################################
+#
+# command_benchmarks
+#
+# (name, callable) for the queries behind each command, drawing
+# stations, years and coordinates from rng so runs vary like real use.
+#
+def command_benchmarks(dbConn, rng):
+    allStations = queries.find_stations(dbConn, '%')
+    years = [int(year) for year in queries.yearly_ridership(dbConn, allStations[:1])[0].years] or [2001]
+    colors = [row[0] for row in dbConn.execute("SELECT Color FROM Lines").fetchall()]
+
+    def station():
+        return rng.choice(allStations)
+
+    def command2():
+        found = queries.station_by_name(dbConn, station().station_name)
+        queries.ridership_split(dbConn, (found,))
+
+    def command3():
+        for _ in ranking.rank_stations(dbConn, 'W'):
+            pass
+
+    def command4():
+        lineID = queries.line_id(dbConn, rng.choice(colors))
+        queries.line_stops(dbConn, lineID, rng.choice('nsew'))
+
+    def command5():
+        queries.stops_per_color(dbConn)
+        queries.total_stops(dbConn)
+
+    return [
+        ('command 1 station search', lambda: queries.find_stations(dbConn, f"%{station().station_name[:3]}%")),
+        ('command 2 ridership split', command2),
+        ('command 3 station ranking', command3),
+        ('command 4 line stops', command4),
+        ('command 5 stops per color', command5),
+        ('command 6 yearly', lambda: queries.yearly_ridership(dbConn, (station(),))),
+        ('command 7 monthly', lambda: queries.monthly_ridership(dbConn, (station(),), str(rng.choice(years)))),
+        ('date range split', lambda: queries.range_split(dbConn, (station(),), *sorted(
+            f"{rng.choice(years)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(2)))),
+        ('command 8 daily matrix', lambda: queries.daily_matrix(dbConn, (station(), station()), str(rng.choice(years)))),
+        ('command 9 nearby', lambda: queries.nearby_stations(dbConn, rng.uniform(41.75, 42.05), rng.uniform(-87.9, -87.6), 1.0)),
+    ]
+
+##################################################################
+#
+# run_benchmarks
+#
+# Returns {name: {'p50_ms', 'p95_ms', 'peak_kb'}} for startup and
+# every command.
+#
+def run_benchmarks(path, repeat=20, useColumnar=False, seed=341, usePrefixIndex=False):
+    rng = random.Random(seed)
+    results = {}
+
+    def record(name, times, peak):
+        p50, p95 = percentiles(times)
+        results[name] = {'p50_ms': round(p50, 3), 'p95_ms': round(p95, 3),
+                         'peak_kb': round(peak / 1024, 1) if peak is not None else None}
+
+    #first open builds rollups and indexes, later opens only check them
+    times, peak = measure(lambda: database.open_database(path).close(), 1, traced=False)
+    record('open database (first)', times, peak)
+    times, peak = measure(lambda: database.open_database(path).close(), repeat)
+    record('open database', times, peak)
+
+    dbConn = database.open_database(path)
+    if useColumnar and columnar.enable(dbConn) is None:
+        print("**NumPy is not installed, using SQLite...", file=sys.stderr)
+    if usePrefixIndex:
+        times, peak = measure(lambda: prefix_index.enable(dbConn), 1, traced=False)
+        record('prefix index open', times, peak)
+
+    def uncached_stats():
+        stats_cache.invalidate_stats(dbConn)
+        stats_cache.get_stats(dbConn)
+
+    record('print_stats (recompute)', *measure(uncached_stats, max(1, repeat // 4)))
+    record('print_stats (cached)', *measure(lambda: stats_cache.get_stats(dbConn), repeat))
+
+    for name, func in command_benchmarks(dbConn, rng):
+        func()
+        record(name, *measure(func, repeat))
+
+    columnar.disable()
+    prefix_index.disable()
+    dbConn.close()
+    return results
+
+##################################################################
+#
+# print_results
+#
+# Prints one line per benchmark, with the change in p95 against a
+# baseline when given. Returns the names that regressed by more than
+# tolerance (a fraction, e.g. 0.25 for 25%).
+#
+def print_results(results, baseline=None, tolerance=0.25):
+    regressions = []
+
+    print(f"{'benchmark':<30} {'p50 ms':>10} {'p95 ms':>10} {'peak KB':>10}")
+    for name, result in results.items():
+        peak = f"{result['peak_kb']:.1f}" if result['peak_kb'] is not None else '-'
+        line = f"{name:<30} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} {peak:>10}"
+        if baseline and name in baseline and baseline[name]['p95_ms'] > 0:
+            change = result['p95_ms'] / baseline[name]['p95_ms'] - 1
+            line += f"  {change:+.0%}"
+            if change > tolerance:
+                regressions.append(name)
+                line += " **regression"
+        print(line)
+
+    return regressions
+
+##################################################################
+#
+# main
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CTA L analysis app queries.')
+    parser.add_argument('--db', help='database to benchmark, a synthetic one is generated if omitted')
+    parser.add_argument('--stations', type=int, default=150, help='synthetic database stations')
+    parser.add_argument('--years', type=int, default=25, help='synthetic database years')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per benchmark')
+    parser.add_argument('--columnar', action='store_true', help='benchmark the NumPy columnar engine')
+    parser.add_argument('--prefix-index', action='store_true', help='benchmark the NumPy prefix-sum index')
+    parser.add_argument('--save', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to compare p95 latency against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown before failing')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        path = args.db
+        if path is None:
+            path = os.path.join(scratch, 'synthetic.db')
+            start = time.perf_counter()
+            rows = synthetic_db.generate_database(path, args.stations, args.years)
+            print(f"generated {args.stations:,} stations x {args.years} years ({rows:,} ride entries) "
+                  f"in {time.perf_counter() - start:.1f}s")
+            print()
+
+        results = run_benchmarks(path, args.repeat, args.columnar, usePrefixIndex=args.prefix_index)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            baseline = json.load(baselineFile)
+
+    regressions = print_results(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump(results, out, indent=2)
+
+    if regressions:
+        print(f"**{len(regressions)} benchmark(s) regressed more than {args.tolerance:.0%}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,326 @@
+##################################################################
+# columnar.py
+#
+# Overview: Optional NumPy columnar engine for the CTA L analysis app
+#   ColumnarRidership holds the whole Ridership table as four parallel
+#   arrays (station code, day number, type of day, riders), sorted by
+#   station then day, so each station's rows are one contiguous slice.
+#   The arrays are saved as .npy files in a directory next to the
+#   database and memory-mapped on later runs; they are rebuilt when
+#   the data fingerprint no longer matches. queries.py hands commands
+#   2, 3, 6, 7 and 8 to the engine when it is enabled, and this module
+#   does nothing if NumPy is not installed. NumPy is only imported once
+#   the engine is asked for, keeping it out of plain startups.
+##################################################################
+
+import json
+import os
+
+import stats_cache
+
+#numpy, once available() has imported it
+np = None
+
+#Type_of_Day codes, anything else is counted only in totals
+DAY_TYPES = {'W': 0, 'A': 1, 'U': 2}
+OTHER_DAY_TYPE = 3
+
+#days since 1970-01-01, the epoch of numpy's datetime64[D]
+QUERY_COLUMNS = """
+    SELECT
+        Station_ID,
+        CAST(julianday(Ride_Date) - 2440587.5 AS INTEGER),
+        CASE Type_of_Day WHEN 'W' THEN 0 WHEN 'A' THEN 1 WHEN 'U' THEN 2 ELSE 3 END,
+        Num_Riders
+    FROM Ridership
+    ORDER BY Station_ID ASC, Ride_Date ASC
+"""
+
+ARRAYS = ('station_ids', 'offsets', 'day', 'day_type', 'riders')
+
+FETCH_SIZE = 100_000
+
+##################################################################
+#
+# available
+#
+# True if NumPy is installed, importing it on first call.
+#
+def available():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+##################################################################
+#
+# snapshot_dir
+#
+# Directory holding the .npy snapshot of the database's Ridership table.
+#
+def snapshot_dir(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA database_list")
+    for _, name, path in dbCursor.fetchall():
+        if name == 'main' and path and os.path.exists(path):
+            return os.path.splitext(path)[0] + '.columns'
+    return None
+
+#days since 1970-01-01 of a 'YYYY-MM-DD' date
+def _day_number(date):
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+#'YYYY-MM-DD' strings of day numbers
+def _date_strings(days):
+    return [str(date) for date in np.asarray(days, dtype=np.int64).astype('datetime64[D]')]
+
+##################################################################
+#
+# ColumnarRidership
+#
+# station_ids[c] is the Station_ID of station code c, and that
+# station's rows are day / day_type / riders[offsets[c]:offsets[c + 1]].
+#
+class ColumnarRidership:
+    def __init__(self, station_ids, offsets, day, day_type, riders):
+        self.station_ids = station_ids
+        self.offsets = offsets
+        self.day = day
+        self.day_type = day_type
+        self.riders = riders
+        self.codes = {int(stationID): code for code, stationID in enumerate(station_ids)}
+        self._allSums = None
+
+    #row range of a station, None if it has no ridership
+    def _slice(self, stationID):
+        code = self.codes.get(stationID)
+        if code is None:
+            return None
+        return slice(int(self.offsets[code]), int(self.offsets[code + 1]))
+
+    ##################################################################
+    #
+    # day_type_sums
+    #
+    # {Station_ID: (total, weekday, saturday, sunday)} for the given
+    # stations with ridership, or every station if stationIDs is None.
+    # The snapshot never changes, so the every-station sums are kept.
+    #
+    def day_type_sums(self, stationIDs=None):
+        if stationIDs is None:
+            if self._allSums is None:
+                codes = np.repeat(np.arange(len(self.station_ids)), np.diff(self.offsets))
+                sums = np.bincount(codes * 4 + self.day_type, weights=self.riders,
+                                   minlength=len(self.station_ids) * 4).reshape(-1, 4).astype(np.int64)
+                self._allSums = {int(stationID): (int(row.sum()), int(row[0]), int(row[1]), int(row[2]))
+                                 for stationID, row in zip(self.station_ids, sums)}
+            return self._allSums
+
+        found = {}
+        for stationID in stationIDs:
+            rows = self._slice(stationID)
+            if rows is None:
+                continue
+            sums = np.bincount(self.day_type[rows], weights=self.riders[rows], minlength=4).astype(np.int64)
+            found[stationID] = (int(sums.sum()), int(sums[0]), int(sums[1]), int(sums[2]))
+        return found
+
+    #{Station_ID: ([labels], [riders])} summing each station's rows,
+    #restricted by mask(days), into buckets given by bucket(days)
+    def _grouped(self, stationIDs, bucket, mask=None):
+        found = {}
+        for stationID in stationIDs:
+            rows = self._slice(stationID)
+            if rows is None:
+                continue
+            days = self.day[rows]
+            riders = self.riders[rows]
+            if mask is not None:
+                keep = mask(days)
+                days = days[keep]
+                riders = riders[keep]
+            if len(days) == 0:
+                continue
+            labels, inverse = np.unique(bucket(days), return_inverse=True)
+            sums = np.bincount(inverse, weights=riders).astype(np.int64)
+            found[stationID] = (labels.tolist(), sums.tolist())
+        return found
+
+    ##################################################################
+    #
+    # yearly
+    #
+    # {Station_ID: (['YYYY', ...], [riders, ...])}
+    #
+    def yearly(self, stationIDs):
+        found = self._grouped(stationIDs, lambda days: days.astype('datetime64[D]').astype('datetime64[Y]').astype(np.int64))
+        return {stationID: ([f"{year + 1970:04d}" for year in years], riders)
+                for stationID, (years, riders) in found.items()}
+
+    ##################################################################
+    #
+    # monthly
+    #
+    # {Station_ID: (['MM', ...], [riders, ...])} during one year.
+    #
+    def monthly(self, stationIDs, year):
+        start, end = _day_number(f"{year:04d}-01-01"), _day_number(f"{year + 1:04d}-01-01")
+        found = self._grouped(stationIDs,
+                              lambda days: days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12,
+                              lambda days: (days >= start) & (days < end))
+        return {stationID: ([f"{month + 1:02d}" for month in months], riders)
+                for stationID, (months, riders) in found.items()}
+
+    ##################################################################
+    #
+    # daily
+    #
+    # (['YYYY-MM-DD', ...], [(riders or None per station), ...]) for
+    # the days in [start, end) on which any of the stations has ridership.
+    #
+    def daily(self, stationIDs, start, end):
+        startDay, endDay = _day_number(start), _day_number(end)
+        found = self._grouped(stationIDs, lambda days: days, lambda days: (days >= startDay) & (days < endDay))
+
+        allDays = sorted({day for days, _ in found.values() for day in days})
+        position = {day: index for index, day in enumerate(allDays)}
+
+        rows = [[None] * len(stationIDs) for _ in allDays]
+        for column, stationID in enumerate(stationIDs):
+            if stationID not in found:
+                continue
+            for day, riders in zip(*found[stationID]):
+                rows[position[day]][column] = riders
+
+        return _date_strings(allDays), [tuple(row) for row in rows]
+
+    ##################################################################
+    #
+    # daily_numbers
+    #
+    # (Station_ID, day number, riders) arrays of the stations' rows in
+    # [start, end), for callers that bucket the days themselves.
+    #
+    def daily_numbers(self, stationIDs, start, end):
+        startDay, endDay = _day_number(start), _day_number(end)
+        ids, days, riders = [], [], []
+        for stationID in stationIDs:
+            rows = self._slice(stationID)
+            if rows is None:
+                continue
+            #each station's days are sorted, so the range is one slice
+            lo, hi = np.searchsorted(self.day[rows], (startDay, endDay))
+            rows = slice(rows.start + int(lo), rows.start + int(hi))
+            ids.append(np.full(int(hi - lo), stationID, dtype=np.int64))
+            days.append(self.day[rows].astype(np.int64))
+            riders.append(self.riders[rows].astype(np.int64))
+        if not ids:
+            return (np.zeros(0, dtype=np.int64),) * 3
+        return np.concatenate(ids), np.concatenate(days), np.concatenate(riders)
+
+##################################################################
+#
+# build_columns
+#
+# Reads Ridership once, in FETCH_SIZE batches, into sorted arrays.
+#
+def build_columns(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT COUNT(*) FROM Ridership")
+    total = dbCursor.fetchone()[0]
+
+    stationColumn = np.empty(total, dtype=np.int64)
+    day = np.empty(total, dtype=np.int32)
+    day_type = np.empty(total, dtype=np.uint8)
+    riders = np.empty(total, dtype=np.int32)
+
+    dbCursor.execute(QUERY_COLUMNS)
+    filled = 0
+    while True:
+        batch = dbCursor.fetchmany(FETCH_SIZE)
+        if not batch:
+            break
+        end = filled + len(batch)
+        columns = np.array(batch, dtype=np.int64).T
+        stationColumn[filled:end], day[filled:end], day_type[filled:end], riders[filled:end] = columns
+        filled = end
+
+    station_ids, counts = np.unique(stationColumn[:filled], return_counts=True)
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    return ColumnarRidership(station_ids, offsets, day[:filled], day_type[:filled], riders[:filled])
+
+##################################################################
+#
+# save_columns / load_columns
+#
+# The snapshot is one .npy per array plus meta.json holding the data
+# fingerprint it was built from, written last.
+#
+def save_columns(columns, directory, fingerprint):
+    os.makedirs(directory, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(directory, name + '.npy'), getattr(columns, name))
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta:
+        json.dump({'fingerprint': fingerprint, 'rows': int(len(columns.day))}, meta)
+
+def load_columns(directory, fingerprint):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as meta:
+            if json.load(meta).get('fingerprint') != fingerprint:
+                return None
+        arrays = [np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS]
+    except (OSError, ValueError):
+        return None
+    return ColumnarRidership(*arrays)
+
+##################################################################
+#
+# open_columns
+#
+# Memory-maps the snapshot next to the database, rebuilding it first
+# if it is missing or stale. NumPy must be available.
+#
+def open_columns(dbConn):
+    fingerprint = stats_cache.data_fingerprint(dbConn)
+    directory = snapshot_dir(dbConn)
+
+    columns = load_columns(directory, fingerprint) if directory else None
+    if columns is None:
+        columns = build_columns(dbConn)
+        if directory:
+            save_columns(columns, directory, fingerprint)
+            columns = load_columns(directory, fingerprint)
+    return columns
+
+_engine = None
+
+##################################################################
+#
+# enable
+#
+# Opens the snapshot (see open_columns) and routes the ridership
+# queries to it. Returns the engine, or None if NumPy is not installed.
+#
+def enable(dbConn):
+    global _engine
+    if not available():
+        return None
+
+    _engine = open_columns(dbConn)
+    return _engine
+
+##################################################################
+#
+# disable / get_engine
+#
+def disable():
+    global _engine
+    _engine = None
+
+def get_engine():
+    return _engine
@@ -0,0 +1,276 @@
+##################################################################
+# database.py
+#
+# Overview: Opening the CTA daily ridership database
+#   open_database connects to the database and brings the derived
+#   tables and indexes the commands rely on up to date, so the REPL
+#   and batch mode start from the same state. ConnectionPool prepares
+#   the file once the same way, then hands each thread its own tuned,
+#   read-only connection so many readers can query in parallel.
+#   MemoryPool does the same over a copy of the database held in RAM.
+##################################################################
+
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import rollups
+import indexes
+import stats_cache
+
+DB_FILE = 'CTA2_L_daily_ridership.db'
+
+#prepared statements kept per connection (sqlite3's default is 128)
+STATEMENT_CACHE = 512
+
+#applied to every read-only connection
+READER_PRAGMAS = [
+    "PRAGMA mmap_size = 268435456",      #read up to 256 MB of the file through mmap
+    "PRAGMA cache_size = -65536",        #64 MB page cache
+    "PRAGMA temp_store = MEMORY",        #sorts and temp b-trees stay in memory
+    "PRAGMA query_only = ON",
+]
+
+##################################################################
+#
+# open_database
+#
+# Connects to the database, creates any missing index and the
+# change-counting triggers, and folds any newly loaded ridership
+# into the rollup tables.
+#
+def open_database(path=DB_FILE):
+    dbConn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE)
+
+    indexes.ensure_indexes(dbConn)
+    stats_cache.track_changes(dbConn)
+    rollups.refresh_rollups(dbConn)
+
+    return dbConn
+
+##################################################################
+#
+# prepare_database
+#
+# Brings indexes, rollups and the cached statistics up to date
+# through a short-lived writable connection, so read-only
+# connections find everything they need.
+#
+def prepare_database(path=DB_FILE):
+    dbConn = open_database(path)
+    try:
+        stats_cache.get_stats(dbConn)
+    finally:
+        dbConn.close()
+
+#"file:" URI opening path read-only
+def reader_uri(path, immutable):
+    uri = "file:" + urllib.parse.quote(os.path.abspath(path)) + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    return uri
+
+##################################################################
+#
+# connect_reader
+#
+# Opens path read-only with READER_PRAGMAS applied. immutable tells
+# SQLite the file cannot change while open, so it skips locking and
+# change detection entirely; only use it on a file nothing writes.
+# factory is the sqlite3.Connection class to open, e.g. for tracing.
+#
+def connect_reader(path=DB_FILE, immutable=False, factory=sqlite3.Connection):
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    #the pool keeps each connection on one thread, but closes them all
+    #from whichever thread shuts it down
+    dbConn = sqlite3.connect(reader_uri(path, immutable), uri=True,
+                             cached_statements=STATEMENT_CACHE, check_same_thread=False, factory=factory)
+    for pragma in READER_PRAGMAS:
+        dbConn.execute(pragma)
+    return dbConn
+
+##################################################################
+#
+# ConnectionPool
+#
+# One read-only connection per thread, opened on the thread's first
+# connection() call and reused after that. Threads never share a
+# connection, so queries on different threads don't wait on each
+# other. The database is prepared when the pool is created unless
+# the file is not writable, in which case it must have been
+# prepared already.
+#
+class ConnectionPool:
+    def __init__(self, path=DB_FILE, immutable=False, factory=sqlite3.Connection):
+        self.path = path
+        self.immutable = immutable
+        self.factory = factory
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        if os.access(path, os.W_OK):
+            prepare_database(path)
+
+    #this thread's connection
+    def connection(self):
+        dbConn = getattr(self._local, 'dbConn', None)
+        if dbConn is None:
+            dbConn = self._connect()
+            self._local.dbConn = dbConn
+            with self._lock:
+                self._connections.append(dbConn)
+        return dbConn
+
+    def _connect(self):
+        return connect_reader(self.path, self.immutable, self.factory)
+
+    #closes every connection handed out, from any thread
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for dbConn in connections:
+            dbConn.close()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#tables rebuilt from Ridership after a partial copy rather than copied
+DERIVED_TABLES = {'Ridership_Daily', 'Ridership_Monthly', 'Ridership_Yearly', 'Rollup_State', 'Stats_Cache'}
+
+_memoryNames = itertools.count(1)
+
+#peak resident memory of this process in bytes, None where unknown
+def resident_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+##################################################################
+#
+# copy_ridership
+#
+# Copies the tables of the database at path into the empty database
+# dbConn is connected to (by uri), keeping only the Ridership rows
+# from fromDate up to (not including) toDate ('YYYY-MM-DD', either
+# may be None), then rebuilds the indexes, rollups and statistics
+# from what was copied. The copy is attached to a connection on the
+# file rather than the other way round, since a database attached to
+# a memdb connection would be opened in memory too.
+#
+def copy_ridership(dbConn, uri, path, fromDate=None, toDate=None):
+    source = sqlite3.connect(reader_uri(path, False), uri=True)
+    try:
+        source.execute("ATTACH DATABASE ? AS copy", (uri,))
+
+        #tables first, so each index is built once over its full table
+        schema = source.execute("""
+            SELECT type, name, tbl_name, sql FROM main.sqlite_master
+            WHERE type IN ('table', 'index') AND sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+            ORDER BY type = 'index'
+        """).fetchall()
+
+        for kind, name, table, sql in schema:
+            if table in DERIVED_TABLES:
+                continue
+            dbConn.execute(sql)
+            if kind != 'table':
+                continue
+            if name == 'Ridership':
+                source.execute("""
+                    INSERT INTO copy.Ridership SELECT * FROM main.Ridership
+                    WHERE Ride_Date >= IFNULL(?, '') AND (? IS NULL OR Ride_Date < ?)
+                """, (fromDate, toDate, toDate))
+            else:
+                source.execute(f"INSERT INTO copy.{name} SELECT * FROM main.{name}")
+            source.commit()
+    finally:
+        source.close()
+
+    indexes.ensure_indexes(dbConn)
+    rollups.refresh_rollups(dbConn)
+    stats_cache.get_stats(dbConn)
+
+##################################################################
+#
+# MemoryPool
+#
+# A ConnectionPool over a copy of the database held in memory, for
+# hosts where RAM is cheap and disk reads dominate query time. The
+# file is prepared, then copied whole with the backup API, or with
+# fromDate / toDate only that range of Ridership is copied and the
+# rollups are rebuilt from it. The copy lives in SQLite's memdb VFS
+# under a name unique to the pool, so each thread's read-only
+# connection sees the same copy. load_seconds and memory_bytes
+# describe the load.
+#
+class MemoryPool(ConnectionPool):
+    def __init__(self, path=DB_FILE, fromDate=None, toDate=None, factory=sqlite3.Connection):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        super().__init__(path, False, factory)
+
+        start = time.perf_counter()
+        self.uri = f"file:/cta-memory-{os.getpid()}-{next(_memoryNames)}?vfs=memdb"
+
+        #holds the copy open for as long as the pool lives
+        self._holder = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        if fromDate is None and toDate is None:
+            source = connect_reader(path)
+            try:
+                source.backup(self._holder)
+            finally:
+                source.close()
+            indexes.ensure_indexes(self._holder)
+        else:
+            copy_ridership(self._holder, self.uri, path, fromDate, toDate)
+
+        pageCount = self._holder.execute("PRAGMA page_count").fetchone()[0]
+        pageSize = self._holder.execute("PRAGMA page_size").fetchone()[0]
+        self.memory_bytes = pageCount * pageSize
+        self.load_seconds = time.perf_counter() - start
+
+    def _connect(self):
+        dbConn = sqlite3.connect(self.uri, uri=True, cached_statements=STATEMENT_CACHE,
+                                 check_same_thread=False, factory=self.factory)
+        for pragma in READER_PRAGMAS:
+            dbConn.execute(pragma)
+        return dbConn
+
+    #a short line describing the load, for startup output
+    def describe(self):
+        line = f"{self.memory_bytes / 1_048_576:.1f} MB loaded into memory in {self.load_seconds:.2f}s"
+        resident = resident_bytes()
+        if resident is not None:
+            line += f", {resident / 1_048_576:.0f} MB resident"
+        return line
+
+    def close(self):
+        super().close()
+        if self._holder is not None:
+            self._holder.close()
+            self._holder = None
+
+##################################################################
+#
+# open_pool
+#
+# A MemoryPool when inMemory or a date range is given, otherwise a
+# ConnectionPool over the file.
+#
+def open_pool(path=DB_FILE, immutable=False, inMemory=False, fromDate=None, toDate=None,
+              factory=sqlite3.Connection):
+    if inMemory or fromDate is not None or toDate is not None:
+        return MemoryPool(path, fromDate, toDate, factory)
+    return ConnectionPool(path, immutable, factory)
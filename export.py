@@ -0,0 +1,265 @@
+##################################################################
+# export.py
+#
+# Overview: Streaming export of daily ridership for the CTA L analysis app
+#   export_ridership writes every daily ridership entry of the chosen
+#   stations and dates, in station then date order, without ever
+#   holding the whole result: rows are read from the cursor with
+#   fetchmany in batches and each batch is written before the next is
+#   read, so memory stays constant however large the extract. Output
+#   is CSV or a compact binary columnar file (see write_columnar),
+#   and progress is reported after every batch.
+#     python3 export.py ridership.csv
+#     python3 export.py ridership.bin --format columnar --station Howard --start 2019-01-01 --end 2021-01-01
+##################################################################
+
+import argparse
+import array
+import csv
+import io
+import json
+import struct
+import sys
+import time
+from dataclasses import dataclass
+
+import batch
+import database
+import queries
+
+#rows per fetchmany, and per block of the columnar format
+BATCH_SIZE = 50_000
+
+FORMATS = ('csv', 'columnar')
+
+#{day} and {day_type} are the column expressions of the format
+QUERY_EXPORT = """
+    SELECT Station_ID, {day}, {day_type}, Num_Riders
+    FROM Ridership
+    WHERE Station_ID IN ({stations}){dates}
+    ORDER BY Station_ID ASC, Ride_Date ASC
+"""
+
+CSV_COLUMNS = {'day': "DATE(Ride_Date)", 'day_type': "Type_of_Day"}
+
+#days since 1970-01-01 and the Type_of_Day codes of columnar.py
+BINARY_COLUMNS = {'day': "CAST(julianday(Ride_Date) - 2440587.5 AS INTEGER)",
+                  'day_type': "CASE Type_of_Day WHEN 'W' THEN 0 WHEN 'A' THEN 1 WHEN 'U' THEN 2 ELSE 3 END"}
+
+CSV_HEADER = ('station_id', 'station_name', 'date', 'day_type', 'riders')
+
+#columnar file layout, all little-endian: MAGIC, a uint32 length and
+#that many bytes of JSON header, then blocks of a uint32 row count
+#followed by each column's values in COLUMNS order, ended by a block
+#of 0 rows
+MAGIC = b'CTACOL1\n'
+COLUMNS = (('station_id', 'i', '<i4'), ('day', 'i', '<i4'), ('day_type', 'B', 'u1'), ('riders', 'i', '<i4'))
+DAY_TYPE_CODES = {'W': 0, 'A': 1, 'U': 2}
+
+@dataclass(frozen=True, slots=True)
+class ExportResult:
+    rows: int
+    bytes: int
+    seconds: float
+
+    @property
+    def rows_per_second(self):
+        if self.seconds > 0:
+            return self.rows / self.seconds
+        return 0
+
+##################################################################
+#
+# stream_rows
+#
+# Runs sql and yields its rows in lists of at most batchSize, read
+# with fetchmany so only one batch is ever in memory.
+#
+def stream_rows(dbConn, sql, params=(), batchSize=BATCH_SIZE):
+    dbCursor = dbConn.cursor()
+    dbCursor.arraysize = batchSize
+    dbCursor.execute(sql, params)
+    while True:
+        rows = dbCursor.fetchmany()
+        if not rows:
+            break
+        yield rows
+
+#the export query of the stations over [start, end), either bound optional
+def _export_query(columns, stations, start, end):
+    dates = ""
+    params = [station.station_id for station in stations]
+    if start is not None:
+        dates += " AND Ride_Date >= ?"
+        params.append(start)
+    if end is not None:
+        dates += " AND Ride_Date < ?"
+        params.append(end)
+    sql = QUERY_EXPORT.format(stations=", ".join("?" for _ in stations), dates=dates, **columns)
+    return sql, tuple(params)
+
+##################################################################
+#
+# write_csv
+#
+# Writes batches of (Station_ID, date, day type, riders) rows as CSV
+# with a header, adding the station names. Yields the number of rows
+# and characters written after each batch.
+#
+def write_csv(batches, out, names):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    for rows in batches:
+        writer.writerows((stationID, names.get(stationID), rideDate, dayType, riders)
+                         for stationID, rideDate, dayType, riders in rows)
+        text = buffer.getvalue()
+        out.write(text)
+        buffer.seek(0)
+        buffer.truncate()
+        yield len(rows), len(text)
+    #the header alone, when there were no rows
+    out.write(buffer.getvalue())
+
+##################################################################
+#
+# write_columnar
+#
+# Writes batches of (Station_ID, day number, day type code, riders)
+# rows to a binary file as one block each, after a header naming the
+# columns and stations. Yields rows and bytes written after each batch.
+# Each column of a block loads directly with numpy.frombuffer.
+#
+def write_columnar(batches, out, names):
+    header = json.dumps({'columns': [[name, dtype] for name, _, dtype in COLUMNS],
+                         'epoch': '1970-01-01', 'day_types': DAY_TYPE_CODES,
+                         'stations': {str(stationID): name for stationID, name in names.items()}}).encode()
+    out.write(MAGIC + struct.pack('<I', len(header)) + header)
+    written = len(MAGIC) + 4 + len(header)
+
+    for rows in batches:
+        block = [struct.pack('<I', len(rows))]
+        for (_, typecode, _), values in zip(COLUMNS, zip(*rows)):
+            column = array.array(typecode, values)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            block.append(column.tobytes())
+        block = b''.join(block)
+        out.write(block)
+        yield len(rows), written + len(block)
+        written = 0
+
+    out.write(struct.pack('<I', 0))
+
+##################################################################
+#
+# read_columnar
+#
+# Reads a file written by write_columnar: returns the header and a
+# generator of blocks, each {column name: array.array}.
+#
+def read_columnar(binaryFile):
+    if binaryFile.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a ridership columnar file")
+    length, = struct.unpack('<I', binaryFile.read(4))
+    header = json.loads(binaryFile.read(length))
+
+    def blocks():
+        while True:
+            count, = struct.unpack('<I', binaryFile.read(4))
+            if count == 0:
+                return
+            block = {}
+            for name, typecode, _ in COLUMNS:
+                column = array.array(typecode)
+                column.frombytes(binaryFile.read(count * column.itemsize))
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                block[name] = column
+            yield block
+
+    return header, blocks()
+
+##################################################################
+#
+# export_ridership
+#
+# Streams the daily ridership of stations (every station by default)
+# over [start, end), either bound optional, to out: a text file for
+# 'csv', a binary file for 'columnar'. progress, if given, is called
+# as progress(rows, bytes, seconds) after each batch. Returns an
+# ExportResult.
+#
+def export_ridership(dbConn, out, stations=None, start=None, end=None, fmt='csv', batchSize=BATCH_SIZE,
+                     progress=None):
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt}")
+    if stations is None:
+        stations = queries.match_stations(dbConn, ())
+    names = {station.station_id: station.station_name for station in stations}
+
+    started = time.perf_counter()
+    totalRows = totalBytes = 0
+    if stations:
+        sql, params = _export_query(CSV_COLUMNS if fmt == 'csv' else BINARY_COLUMNS, stations, start, end)
+        batches = stream_rows(dbConn, sql, params, batchSize)
+    else:
+        batches = iter(())
+
+    writer = write_csv if fmt == 'csv' else write_columnar
+    for rows, written in writer(batches, out, names):
+        totalRows += rows
+        totalBytes += written
+        if progress is not None:
+            progress(totalRows, totalBytes, time.perf_counter() - started)
+    out.flush()
+
+    return ExportResult(totalRows, totalBytes, time.perf_counter() - started)
+
+##################################################################
+#
+# main
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export daily ridership as CSV or a binary columnar file.')
+    parser.add_argument('output', help="file to write, '-' for stdout")
+    parser.add_argument('--db', default=database.DB_FILE, help='ridership database file')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='output format')
+    parser.add_argument('--station', action='append', help='station name pattern, repeatable (default every station)')
+    parser.add_argument('--start', type=batch.parse_day, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', type=batch.parse_day, help='end date (not included), YYYY-MM-DD')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='rows fetched and written at a time')
+    parser.add_argument('--immutable', action='store_true', help='open the database as immutable')
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    def progress(rows, written, seconds):
+        rate = rows / seconds if seconds > 0 else 0
+        print(f"\r  {rows:,} rows, {written / 1_000_000:,.1f} MB ({rate:,.0f} rows/s)", end='',
+              file=sys.stderr, flush=True)
+
+    with database.ConnectionPool(args.db, args.immutable) as pool:
+        dbConn = pool.connection()
+        stations = queries.match_stations(dbConn, tuple(args.station or ()))
+
+        if args.output == '-':
+            out = sys.stdout if args.format == 'csv' else sys.stdout.buffer
+        elif args.format == 'csv':
+            out = open(args.output, 'w', newline='')
+        else:
+            out = open(args.output, 'wb')
+        try:
+            result = export_ridership(dbConn, out, stations, args.start, args.end, args.format, args.batch_size,
+                                      progress)
+        finally:
+            if args.output != '-':
+                out.close()
+    print(file=sys.stderr)
+
+    print(f"{result.rows:,} rows ({result.bytes / 1_000_000:,.1f} MB) exported in {result.seconds:.1f}s "
+          f"({result.rows_per_second:,.0f} rows/s)", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
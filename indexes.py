@@ -0,0 +1,130 @@
+##################################################################
+# indexes.py
+#
+# Overview: Index management and query plan checks for the CTA L analysis app
+#   ensure_indexes creates the indexes the command queries rely on
+#   (skipping any an existing index already covers), year_range turns a
+#   year into a sargable Ride_Date range, and print_query_plans runs
+#   EXPLAIN QUERY PLAN over the command queries to catch table scans.
+##################################################################
+
+#(index name, table, indexed columns)
+INDEXES = [
+    ('idx_Ridership_Station_Date', 'Ridership', ('Station_ID', 'Ride_Date')),
+    ('idx_Stops_Station', 'Stops', ('Station_ID',)),
+    ('idx_StopDetails_Line', 'StopDetails', ('Line_ID', 'Stop_ID')),
+]
+
+##################################################################
+#
+# has_covering_index
+#
+# True if some index on the table (including primary key autoindexes)
+# starts with the given columns in order.
+#
+def has_covering_index(dbConn, table, columns):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(f"PRAGMA index_list({table})")
+    indexNames = [row[1] for row in dbCursor.fetchall()]
+
+    for indexName in indexNames:
+        dbCursor.execute(f"PRAGMA index_info('{indexName}')")
+        indexed = [name for _, _, name in sorted(dbCursor.fetchall())]
+        if tuple(indexed[:len(columns)]) == tuple(columns):
+            return True
+
+    return False
+
+##################################################################
+#
+# ensure_indexes
+#
+# Creates any missing index from INDEXES and returns the names of
+# the indexes it created.
+#
+def ensure_indexes(dbConn):
+    dbCursor = dbConn.cursor()
+    created = []
+
+    for name, table, columns in INDEXES:
+        if has_covering_index(dbConn, table, columns):
+            continue
+        dbCursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+        created.append(name)
+
+    if created:
+        dbConn.commit()
+
+    return created
+
+##################################################################
+#
+# year_range
+#
+# Given a year, returns the [start, end) Ride_Date bounds covering it,
+# e.g. '2003' -> ('2003-01-01', '2004-01-01'). Comparing Ride_Date
+# against these bounds can use the (Station_ID, Ride_Date) index,
+# unlike strftime('%Y', Ride_Date) = ?. Raises ValueError if the year
+# is not a number.
+#
+def year_range(year):
+    year = int(year)
+    return (f"{year:04d}-01-01", f"{year + 1:04d}-01-01")
+
+##################################################################
+#
+# explain_query
+#
+# Returns the EXPLAIN QUERY PLAN detail lines for a query.
+#
+def explain_query(dbConn, query, params=()):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("EXPLAIN QUERY PLAN " + query, params)
+    return [row[3] for row in dbCursor.fetchall()]
+
+##################################################################
+#
+# table_scans
+#
+# Returns the plan lines that scan a table (or one of its indexes)
+# end to end, ignoring tables the query is expected to scan.
+#
+def table_scans(plan, allowedScans=()):
+    scans = []
+    for detail in plan:
+        parts = detail.split()
+        if len(parts) < 2 or parts[0] != 'SCAN':
+            continue
+        if parts[1] in allowedScans or parts[1] == 'CONSTANT':
+            continue
+        scans.append(detail)
+    return scans
+
+##################################################################
+#
+# print_query_plans
+#
+# Given a list of (label, query, params, allowedScans) checks, prints
+# each query plan and flags any that regressed to a table scan.
+# Returns the number of flagged queries.
+#
+def print_query_plans(dbConn, checks):
+    flagged = 0
+
+    print("Query Plans")
+    for label, query, params, allowedScans in checks:
+        plan = explain_query(dbConn, query, params)
+        scans = table_scans(plan, allowedScans)
+
+        if scans:
+            flagged += 1
+            print(f"{label} : **table scan")
+        else:
+            print(f"{label} : ok")
+
+        for detail in plan:
+            print(f"  {detail}")
+
+    print(f"{flagged} of {len(checks)} queries scan a table")
+    print()
+    return flagged
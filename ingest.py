@@ -0,0 +1,278 @@
+##################################################################
+# ingest.py
+#
+# Overview: Bulk loading of CTA daily ridership CSV files
+#   ingest_csv streams a CTA "L Station Entries - Daily totals" CSV
+#   (station_id, stationname, date, daytype, rides) in chunks, checks
+#   each row against Stations, and stages the good rows in a temporary
+#   table. One transaction then replaces the matching (station, date)
+#   rows of Ridership, so loading an overlapping file again changes
+#   nothing. Large loads drop the app's Ridership indexes first and
+#   rebuild them once at the end. Rollups are rewound when older days
+#   were replaced, then refreshed, and cached stats are invalidated.
+#   The rows replaced and loaded are added to the change count of
+#   stats_cache.py, so every snapshot of the old data is rebuilt.
+#     python3 ingest.py CTA_-_Ridership_-__L__Station_Entries_-_Daily_totals.csv
+#     python3 ingest.py new_days.csv --db CTA2_L_daily_ridership.db --rejects bad.csv
+##################################################################
+
+import argparse
+import csv
+import datetime
+import functools
+import sqlite3
+import time
+from dataclasses import dataclass
+
+import database
+import indexes
+import rollups
+import stats_cache
+
+#rows per executemany into the staging table
+CHUNK_SIZE = 50_000
+
+#drop and rebuild the Ridership indexes when a load is at least this
+#fraction of the table, cheaper than updating them row by row
+DEFER_INDEX_FRACTION = 0.1
+
+DAY_TYPES = {'W', 'A', 'U'}
+
+#CSV column of each field, when the file has no recognizable header
+CTA_COLUMNS = {'station_id': 0, 'date': 2, 'daytype': 3, 'rides': 4}
+
+STAGING_SCHEMA = """
+    CREATE TEMP TABLE IF NOT EXISTS Ingest_Staging (
+        Station_ID INTEGER NOT NULL,
+        Ride_Date TEXT NOT NULL,
+        Type_of_Day TEXT NOT NULL,
+        Num_Riders INTEGER NOT NULL,
+        PRIMARY KEY (Station_ID, Ride_Date)
+    ) WITHOUT ROWID
+"""
+
+@dataclass(frozen=True, slots=True)
+class IngestResult:
+    read: int
+    loaded: int
+    replaced: int
+    rejected: dict
+    first_date: str
+    last_date: str
+    seconds: float
+
+    @property
+    def rows_per_second(self):
+        if self.seconds > 0:
+            return self.read / self.seconds
+        return 0
+
+#'YYYY-MM-DD' of a CTA 'MM/DD/YYYY' or an ISO date, ValueError otherwise.
+#Every station repeats each date, so parsed dates are kept
+@functools.lru_cache(maxsize=4096)
+def parse_date(text):
+    text = text.strip()
+    if '/' in text:
+        return datetime.datetime.strptime(text, "%m/%d/%Y").date().isoformat()
+    return datetime.date.fromisoformat(text[:10]).isoformat()
+
+#what follows the date in stored Ride_Date values, e.g. ' 00:00:00.000'
+def _ride_date_suffix(dbConn):
+    row = dbConn.execute("SELECT Ride_Date FROM Ridership LIMIT 1").fetchone()
+    if row is None:
+        return " 00:00:00.000"
+    return row[0][10:]
+
+#{field: column} from a header row, None if it isn't one
+def _header_columns(row):
+    names = [name.strip().lower() for name in row]
+    if all(field in names for field in CTA_COLUMNS):
+        return {field: names.index(field) for field in CTA_COLUMNS}
+    return None
+
+##################################################################
+#
+# validate_rows
+#
+# Yields (Station_ID, Ride_Date, Type_of_Day, Num_Riders) for each
+# good CSV row and reports each bad one to reject(row, reason).
+#
+def validate_rows(rows, columns, stationIDs, suffix, reject):
+    for row in rows:
+        try:
+            stationID = int(row[columns['station_id']])
+        except (ValueError, IndexError):
+            reject(row, 'bad station id')
+            continue
+        if stationID not in stationIDs:
+            reject(row, 'unknown station')
+            continue
+
+        try:
+            rideDate = parse_date(row[columns['date']]) + suffix
+        except (ValueError, IndexError):
+            reject(row, 'bad date')
+            continue
+
+        dayType = row[columns['daytype']].strip().upper() if len(row) > columns['daytype'] else ''
+        if dayType not in DAY_TYPES:
+            reject(row, 'bad day type')
+            continue
+
+        try:
+            riders = int(row[columns['rides']].replace(',', ''))
+        except (ValueError, IndexError):
+            riders = -1
+        if riders < 0:
+            reject(row, 'bad rides')
+            continue
+
+        yield (stationID, rideDate, dayType, riders)
+
+#Ridership indexes from indexes.INDEXES that exist, to drop during a load
+def _ridership_indexes(dbConn):
+    existing = {row[1] for row in dbConn.execute("PRAGMA index_list(Ridership)")}
+    return [name for name, table, _ in indexes.INDEXES if table == 'Ridership' and name in existing]
+
+##################################################################
+#
+# ingest_csv
+#
+# Loads csvFile (an open text file) into the database at path and
+# returns an IngestResult. Rows of a (station, date) already present
+# are replaced, so re-running a file is safe. rejectsOut, if given,
+# receives the rejected rows with a reason column.
+#
+def ingest_csv(path, csvFile, rejectsOut=None):
+    start = time.perf_counter()
+    dbConn = sqlite3.connect(path, cached_statements=database.STATEMENT_CACHE)
+    dbCursor = dbConn.cursor()
+
+    try:
+        stats_cache.track_changes(dbConn)
+        stationIDs = {row[0] for row in dbCursor.execute("SELECT Station_ID FROM Stations")}
+        suffix = _ride_date_suffix(dbConn)
+        dbCursor.execute(STAGING_SCHEMA)
+        dbCursor.execute("DELETE FROM Ingest_Staging")
+
+        rejected = {}
+        rejectWriter = csv.writer(rejectsOut) if rejectsOut is not None else None
+
+        def reject(row, reason):
+            rejected[reason] = rejected.get(reason, 0) + 1
+            if rejectWriter is not None:
+                rejectWriter.writerow(list(row) + [reason])
+
+        reader = csv.reader(csvFile)
+        first = next(reader, None)
+        read = 0
+        columns = _header_columns(first) if first is not None else None
+        if columns is None:
+            columns = CTA_COLUMNS
+            if first is not None:
+                reader = _chain_row(first, reader)
+
+        #stage in chunks, a later row of the same station and day wins
+        good = validate_rows(reader, columns, stationIDs, suffix, reject)
+        while True:
+            chunk = [row for _, row in zip(range(CHUNK_SIZE), good)]
+            if not chunk:
+                break
+            dbCursor.executemany("INSERT OR REPLACE INTO Ingest_Staging VALUES (?, ?, ?, ?)", chunk)
+            dbConn.commit()
+            read += len(chunk)
+        read += sum(rejected.values())
+
+        staged, firstDate, lastDate = dbCursor.execute(
+            "SELECT COUNT(*), MIN(Ride_Date), MAX(Ride_Date) FROM Ingest_Staging").fetchone()
+        replaced = 0
+
+        if staged:
+            existing = dbCursor.execute("SELECT MAX(rowid) FROM Ridership").fetchone()[0] or 0
+            deferred = _ridership_indexes(dbConn) if staged >= existing * DEFER_INDEX_FRACTION else []
+
+            #one transaction for the whole swap, including the DROPs,
+            #which sqlite3 would otherwise run outside of it
+            dbCursor.execute("BEGIN")
+            try:
+                for name in deferred:
+                    dbCursor.execute(f"DROP INDEX {name}")
+
+                #the rows changed are counted here rather than by a
+                #trigger firing once per row
+                stats_cache.pause_tracking(dbConn, 'Ridership')
+
+                dbCursor.execute("""
+                    DELETE FROM Ridership
+                    WHERE (Station_ID, Ride_Date) IN (SELECT Station_ID, Ride_Date FROM Ingest_Staging)
+                """)
+                replaced = dbCursor.rowcount
+                dbCursor.execute("""
+                    INSERT INTO Ridership (Station_ID, Ride_Date, Type_of_Day, Num_Riders)
+                    SELECT Station_ID, Ride_Date, Type_of_Day, Num_Riders
+                    FROM Ingest_Staging
+                    ORDER BY Station_ID, Ride_Date
+                """)
+                stats_cache.count_changes(dbConn, replaced + staged)
+                stats_cache.resume_tracking(dbConn)
+
+                #replaced days the rollups already hold must be re-aggregated
+                try:
+                    mark = rollups.get_high_water_mark(dbConn)
+                except sqlite3.OperationalError:
+                    mark = None
+                if mark is not None and firstDate <= mark:
+                    rollups.rewind_rollups(dbConn, firstDate)
+
+                dbConn.commit()
+            except sqlite3.Error:
+                dbConn.rollback()
+                raise
+
+            dbCursor.execute("DELETE FROM Ingest_Staging")
+            dbConn.commit()
+
+            indexes.ensure_indexes(dbConn)
+            rollups.refresh_rollups(dbConn)
+            stats_cache.invalidate_stats(dbConn)
+    finally:
+        dbConn.close()
+
+    return IngestResult(read, staged, replaced, rejected,
+                        firstDate[:10] if staged else None, lastDate[:10] if staged else None,
+                        time.perf_counter() - start)
+
+#row followed by the rest of rows
+def _chain_row(row, rows):
+    yield row
+    yield from rows
+
+##################################################################
+#
+# main
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load a CTA daily ridership CSV into the database.')
+    parser.add_argument('csv', help='CTA L station entries daily totals CSV')
+    parser.add_argument('--db', default=database.DB_FILE, help='ridership database file')
+    parser.add_argument('--rejects', help='write rejected rows and the reason to this CSV')
+    args = parser.parse_args(argv)
+
+    rejectsOut = open(args.rejects, 'w', newline='') if args.rejects else None
+    try:
+        with open(args.csv, newline='') as csvFile:
+            result = ingest_csv(args.db, csvFile, rejectsOut)
+    finally:
+        if rejectsOut is not None:
+            rejectsOut.close()
+
+    print(f"{args.csv}: {result.read:,} rows read in {result.seconds:.1f}s ({result.rows_per_second:,.0f} rows/s)")
+    if result.loaded:
+        print(f"  {result.loaded:,} ride entries loaded for {result.first_date} to {result.last_date}, "
+              f"{result.replaced:,} existing entries replaced")
+    for reason, count in sorted(result.rejected.items()):
+        print(f"  **{count:,} rejected: {reason}")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
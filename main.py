@@ -14,115 +14,115 @@
 #   Command 7 prints total ridership for a station of a year of choice, option to plot data
 #   Command 8 prints total ridership between 2 stations, option to plot data
 #   Command 9 prints all stations within a 1 mile radius of latitude/longitude coordinates, option to plot data
+#   Run with arguments (python3 main.py --help) for non-interactive batch queries, see batch.py
+#   Run with --columnar to answer ridership commands from a NumPy snapshot of Ridership, see columnar.py
+#   Command explain prints the query plan of each ridership query and flags table scans
+#   Command anomalies prints the most unusual station days network-wide, see anomalies.py
+#   Command stats prints query latency per command, slow queries are logged (see tracing.py)
+#   Run with --prefix-index to answer ridership totals from per-station running sums, see prefix_index.py
+#   Run with --partitions to split ridership into one database file per year and query only the years needed, see partitions.py
+#   Run with --in-memory to copy the database (or --memory-from/--memory-to a date range) into RAM first
+#   Run with --profile-startup to time imports, opening the database and print_stats
+#   Run python3 main.py series ... for ridership per day/week/month/quarter/year with rolling means, see timeseries.py
+#   Run python3 service.py to serve the same queries as JSON over HTTP, see service.py
+#   Run python3 ingest.py <csv> to load a CTA daily ridership CSV into the database, see ingest.py
+#   Run python3 export.py <file> to stream daily ridership to CSV or a binary columnar file in batches, see export.py
+#   Run python3 reports.py <dir> to write every station's yearly/monthly reports and plots in parallel, see reports.py
 ##################################################################
 
-import sqlite3
-import math
-import matplotlib.pyplot as plt
+import time
+_importStart = time.perf_counter()
+
+import sys
+
+import database
+import indexes
+import partitions
+import plotting
+import batch
+import anomalies
+import columnar
+import prefix_index
+import queries
+import ranking
+import stats_cache
+import topology
+import tracing
+
+#plotting loads matplotlib on the first plot, not here
+_importSeconds = time.perf_counter() - _importStart
+
+#startup (imports through print_stats) should stay under this
+STARTUP_BUDGET_MS = 300
 
 ##################################################################  
 #
 # print_stats
 #
-# Given a connection to the CTA database, executes various
-# SQL queries to retrieve and output basic stats.
+# Given a connection to the CTA database, retrieves basic stats
+# (cached until the data changes) and outputs them.
 #
 def print_stats(dbConn):
-    dbCursor = dbConn.cursor()
+    numStations, numStops, numRides, min_date, max_date, totalRiders = stats_cache.get_stats(dbConn)
     
     print("General Statistics:")
     #prints total number of stations
-    dbCursor.execute("SELECT COUNT(*) FROM Stations;")
-    row = dbCursor.fetchone();
-    print("  # of stations:", f"{row[0]:,}")
+    print("  # of stations:", f"{numStations:,}")
     
     #prints total number of stops
-    dbCursor.execute("SELECT COUNT(*) FROM Stops;")
-    row = dbCursor.fetchone();
-    print("  # of stops:", f"{row[0]:,}")
+    print("  # of stops:", f"{numStops:,}")
     
     #prints total number of ride entries
-    dbCursor.execute("SELECT COUNT(*) FROM Ridership;")
-    row = dbCursor.fetchone();
-    print("  # of ride entries:", f"{row[0]:,}")
+    print("  # of ride entries:", f"{numRides:,}")
 
     #prints date range of ride entries
-    dbCursor.execute("SELECT MIN(Date(Ride_Date)), MAX(Date(Ride_Date)) FROM Ridership")
-    min_date, max_date = dbCursor.fetchone()
     print(f"  date range: {min_date} - {max_date}")
 
     #prints total number of Ridership
-    dbCursor.execute("SELECT SUM(Num_Riders) FROM Ridership")
-    row = dbCursor.fetchone()
-    print("  Total ridership:", f"{row[0]:,}")
+    print("  Total ridership:", f"{totalRiders:,}")
 
     print()
 
 #command 1
 #Finds all station names that match the user input
 def retrieve_stations(dbConn):
-    dbCursor = dbConn.cursor()
     print()
     userinput = input("Enter partial station name (wildcards _ and %): ").strip()
 
-    query = """
-        SELECT Station_ID, Station_Name
-        FROM Stations
-        WHERE UPPER(Station_Name) LIKE UPPER(?)
-        ORDER BY Station_Name ASC
-    """
-
-    dbCursor.execute(query, (userinput,))
-    results = dbCursor.fetchall()
+    results = queries.find_stations(dbConn, userinput)
 
     if results:
-        for row in results:
-            print(f"{row[0]} : {row[1]}")
+        for station in results:
+            print(f"{station.station_id} : {station.station_name}")
     else:
         print("**No stations found...")
+        print_suggestions(queries.suggest_stations(dbConn, userinput), "Did you mean")
 
     print()
 
 #command 2
 ##Given a station name, returns the percentage of riders on weekdays, saturdays, and sundays/holidays
 def ridership_percentage(dbConn):
-    dbCursor = dbConn.cursor()
     print()
     stationName = input("Enter the name of the station you would like to analyze: ").strip()
-    query_Station_ID = """
-        SELECT Station_ID
-        FROM Stations
-        WHERE Station_Name = ?
-    """
 
-    dbCursor.execute(query_Station_ID, (stationName,))
-    idResult = dbCursor.fetchone()
+    station = queries.station_by_name(dbConn, stationName)
 
-    if idResult is None:
+    if station is None:
         print("**No data found...")
+        print_suggestions(queries.suggest_stations(dbConn, stationName), "Did you mean")
         print()
         return
-    
-    stationID = idResult[0]
-
-    query_calc = """
-        SELECT
-            SUM(Num_Riders) AS total_riders,
-            SUM(CASE WHEN Type_of_Day = 'W' THEN Num_Riders ELSE 0 END) AS weekday_ridership,
-            SUM(CASE WHEN Type_of_Day = 'A' THEN Num_Riders ELSE 0 END) AS sat_ridership,
-            SUM(CASE WHEN Type_of_Day = 'U' THEN Num_Riders ELSE 0 END) AS sun_ridership
-        FROM Ridership
-        WHERE Station_ID = ?
-    """
-
-    dbCursor.execute(query_calc, (stationID,))
-    sums = dbCursor.fetchone()
-
-    if sums is None or sums[0] is None:
+
+    splits = queries.ridership_split(dbConn, (station,))
+
+    if not splits:
         print("**No data found...")
         return
     
-    totalRiders, weekdayRidership, satRidership, sunRidership = sums
+    split = splits[0]
+    totalRiders = split.total
+    weekdayRidership, satRidership, sunRidership = split.weekday, split.saturday, split.sunday
 
     if totalRiders > 0:
         weekdayRatio = (weekdayRidership / totalRiders) * 100
@@ -139,105 +139,29 @@ def ridership_percentage(dbConn):
     print()
 
 #command 3
-#outputs total ridership on weekends, saturdays, and sundays/holidays for each station
+#outputs total weekday ridership for each station, most riders first
+#rows are printed as the ranking streams them, see ranking.py
 def total_ridership(dbConn):
-    dbCursor = dbConn.cursor()
     #print()
 
-    weekdayData = []
-    satData = []
-    sunData = []
-
-    #calculates total ridership for weekends saturdays and sundays/holidays
-    query_total_ridership = """
-        SELECT
-            COALESCE(SUM(CASE WHEN r.Type_of_Day = 'W' THEN r.Num_Riders ELSE 0 END), 0) AS total_weekday_ridership,
-            COALESCE(SUM(CASE WHEN r.Type_of_Day = 'A' THEN r.Num_Riders ELSE 0 END), 0) AS total_sat_ridership,
-            COALESCE(SUM(CASE WHEN r.Type_of_Day = 'U' THEN r.Num_Riders ELSE 0 END), 0) AS total_sun_ridership
-        FROM Ridership r
-    """
-
-    dbCursor.execute(query_total_ridership)
-    total_ridership = dbCursor.fetchone()
-
-    if total_ridership is None:
-        print("**No data found")
-        return
-    
-    #stores query results into respective weekend, saturday, and sunday/holiday variables
-    totalWeekdayRiders, totalSatRiders, totalSunRiders = total_ridership
-
-    #calculates total number of riders for WUA for each station
-    query_calc = """
-    SELECT
-        s.Station_ID,
-        s.Station_Name,
-        COALESCE(SUM(r.Num_Riders), 0) AS total_riders,
-        COALESCE(SUM(CASE WHEN r.Type_of_Day = 'W' THEN r.Num_Riders ELSE 0 END), 0) AS weekday_ridership,
-        COALESCE(SUM(CASE WHEN r.Type_of_Day = 'A' THEN r.Num_Riders ELSE 0 END), 0) AS sat_ridership,
-        COALESCE(SUM(CASE WHEN r.Type_of_Day = 'U' THEN r.Num_Riders ELSE 0 END), 0) AS sun_ridership
-    FROM Stations s
-    LEFT JOIN Ridership r ON s.Station_ID = r.Station_ID
-    GROUP BY s.Station_ID, s.Station_Name
-    """
-
-    dbCursor.execute(query_calc)
-    sums = dbCursor.fetchall()
-
-    if sums is None:
-        print("**No data found...")
-        return
-    
-    for row in sums:
-        stationID, stationName, totalRiders, weekdayRiders, satRiders, sunRiders = row
-        if totalWeekdayRiders > 0:
-            weekdayRatio = (weekdayRiders / totalWeekdayRiders) * 100
-        else:
-            weekdayRatio = 0;
-        if totalSatRiders > 0:
-            satRatio = (satRiders / totalSatRiders) * 100
-        else:
-            satRatio = 0;
-        if totalSunRiders > 0:
-            sunRatio = (sunRiders / totalSunRiders) * 100
-        else:
-            sunRatio = 0;
-
-        weekdayData.append((stationName, weekdayRiders, weekdayRatio))
-        satData.append((stationName, satRiders, satRatio))
-        sunData.append((stationName, sunRiders, sunRatio))
-
-    weekdayData.sort(key=lambda x: x[1], reverse = True)
-    satData.sort(key=lambda x: x[1], reverse = True)
-    sunData.sort(key=lambda x: x[1], reverse = True)
-
     print("Ridership on Weekdays for Each Station")
-    for stationName, weekdayRiders, weekdayRatio in weekdayData:
-        print(f"{stationName} :{totalWeekdayRiders}, {weekdayRiders:,} ({weekdayRatio:.2f}%)")
+    for ranked in ranking.rank_stations(dbConn, 'W'):
+        print(f"{ranked.totals.station.station_name} :{ranked.network_riders}, {ranked.riders:,} ({ranked.pct:.2f}%)")
 
     print()
-    #DEBUGGING, prints ridership for saturdays and sundays/holidays aswell.
-    #print("Ridership on Saturdays for Each Station")
-    #for stationName, satRiders, satRatio in satData:
-    #    print(f"{stationName} : {satRiders:,} ({satRatio:.2f}%)")
-
-    #print()
-    #print("Ridership on Sundays/Holidays for Each Station")
-    #for stationName, sunRiders, sunRatio in sunData:
-    #    print(f"{stationName} : {sunRiders:,} ({sunRatio:.2f}%)")
-    #print()
+    #DEBUGGING, ranking.rank_stations(dbConn, 'A') and (dbConn, 'U') rank
+    #saturdays and sundays/holidays the same way
 
 #command 4
 #Outputs all stops of line in given direction
 def find_line(dbConn):
-    dbCursor = dbConn.cursor()
     print()
-    lines = {'red', 'blue', 'green', 'brown', 'purple', 'purple-express', 'yellow', 'pink', 'orange'}
     directions = {'n', 's', 'e', 'w', 'north', 'south', 'east', 'west'}
 
-    #asks and checks if line is valid
+    #asks and checks if line is valid, against the Lines table
     lineColor = input("Enter a line color (e.g. Red or Yellow): ").strip().lower()
-    if lineColor not in lines:
+    lineID = queries.line_id(dbConn, lineColor)
+    if lineID is None:
         print("**No such line...")
         print()
         return
@@ -249,34 +173,15 @@ def find_line(dbConn):
         print()
         return
 
-    dbCursor.execute("SELECT Line_ID FROM Lines WHERE LOWER(Color) = ?", (lineColor,))
-    lineIDQuery = dbCursor.fetchone()
-
-    if lineIDQuery is None:
-        print("**No such line...")
-        print()
-        return
-
-    lineID = lineIDQuery[0]
-
     #Searches for stops of the line id from color and direction
-    id_query = """
-        SELECT s.Stop_Name, s.Direction, s.ADA
-        FROM Stops s
-        JOIN StopDetails sd ON s.Stop_ID = sd.Stop_ID
-        WHERE sd.Line_ID = ? and LOWER(s.Direction) = ?
-        ORDER BY s.Stop_Name ASC
-    """
-
-    dbCursor.execute(id_query, (lineID, direction))
-    stops = dbCursor.fetchall()
+    stops = queries.line_stops(dbConn, lineID, direction)
 
     if not stops:
         print("**That line does not run in the direction chosen...")
         return
     
-    for sn, sd, ada in stops:
-        if ada == 1:
+    for sn, sd, ada in ((stop.stop_name, stop.direction, stop.ada) for stop in stops):
+        if ada:
             ada_status = "handicap accessible"
         else:
             ada_status = "not handicap accessible"
@@ -286,86 +191,70 @@ def find_line(dbConn):
 #command 5
 #Outputs number of stops for each line by direction, calculates line percentage by total lines
 def color_direction(dbConn):
-    dbCursor = dbConn.cursor();
     #print()
     print("Number of Stops For Each Color By Direction")
 
-    query = """
-        SELECT l.Color, s.Direction, COUNT(*) AS num_stops
-        FROM Stops s
-        JOIN StopDetails sd ON s.Stop_ID = sd.Stop_ID
-        JOIN Lines l ON sd.Line_ID = l.Line_ID
-        GROUP BY l.Color, s.Direction
-        ORDER BY l.Color ASC, s.Direction ASC
-    """
-
-    dbCursor.execute(query)
-    query_data = dbCursor.fetchall()
+    query_data = queries.stops_per_color(dbConn)
 
     #sums number of stops for percentage calculations
-    query_total_stops = """
-        SELECT COUNT(*) AS total_stops
-        FROM Stops
-    """
-
-    dbCursor.execute(query_total_stops)
-    stops_result = dbCursor.fetchone()
-    total_stops = stops_result[0]
+    total_stops = queries.total_stops(dbConn)
 
     if total_stops == 0:
         print("**Error, no stops in the database")
         return
     
-    for color, direction, numStops in query_data:
+    for color, direction, numStops in ((count.color, count.direction, count.num_stops) for count in query_data):
         perc = (numStops / total_stops) * 100
         print(f"{color} going {direction} : {numStops} ({perc:.2f}%)")
     print()
 
-#Command 6
-#User enters a station name and total ridership for each year is output to the terminal
-#User has option to plot data
-def yearly_ridership(dbConn):
-    dbCursor = dbConn.cursor()
-    print()
-    userinput = input("Enter a station name (wildcards _ and %): ").strip()
-
-    dbCursor.execute('''
-        SELECT Station_ID, Station_Name
-        FROM Stations
-        WHERE Station_Name LIKE ?
-    ''', (userinput,))
+#Helper function of station lookups
+#prints ranked station suggestions on one line, if there are any
+def print_suggestions(suggestions, label):
+    if suggestions:
+        print(f"  {label}: " + ", ".join(station.station_name for station in suggestions))
 
-    stations = dbCursor.fetchall()
+#Helper function of commands 6, 7 and 8
+#finds the one station matching the user input (wildcards _ and %)
+#prints an error with suggestions and returns None if there are none or several
+def find_one_station(dbConn, userinput):
+    stations = queries.find_stations(dbConn, userinput)
 
     if len(stations) == 0:
         print("**No station found...")
+        print_suggestions(queries.suggest_stations(dbConn, userinput), "Did you mean")
         print()
-        return
+        return None
     elif len(stations) > 1:
         print("**Multiple stations found...")
+        print_suggestions(queries.suggest_stations(dbConn, userinput, among=stations), "Closest matches")
         print()
-        return
+        return None
 
-    stid, stname = stations[0]
+    return stations[0]
 
-    dbCursor.execute('''
-        SELECT strftime('%Y', Ride_Date) AS Year, SUM(Num_Riders) AS total_riders
-        FROM Ridership
-        WHERE Station_ID = ?
-        GROUP BY Year
-        ORDER BY Year ASC
-    ''', (stid,))
+#Command 6
+#User enters a station name and total ridership for each year is output to the terminal
+#User has option to plot data
+def yearly_ridership(dbConn):
+    print()
+    userinput = input("Enter a station name (wildcards _ and %): ").strip()
+
+    station = find_one_station(dbConn, userinput)
+    if station is None:
+        return
 
-    ridership_data = dbCursor.fetchall()
+    stname = station.station_name
+    series = queries.yearly_ridership(dbConn, (station,))[0]
 
-    if not ridership_data:
+    if not series.years:
         print("**No station found...")
         print()
         return
     
     #prints data to terminal
     print(f"Yearly Ridership at {stname}")
-    for year, total_riders in ridership_data:
+    for year, total_riders in zip(series.years, series.riders):
         print(f"{year} : {total_riders:,}")
     print()
 
@@ -373,18 +262,12 @@ def yearly_ridership(dbConn):
     plotinput = input("Plot? (y/n) ").strip().lower()
 
     if (plotinput == 'y'):
-        years = [int(year) for year, _ in ridership_data]
-        total_riders = [total_riders / 1_000_000 for _, total_riders in ridership_data]
-
-        plt.figure(figsize=(12, 8))
-        plt.plot(years, total_riders, linestyle='-', color='b')
-        plt.xticks(years)
-        plt.xlabel('Year')
-        plt.ylabel('Number of Riders')
-        plt.title(f'Yearly Ridership at {stname} Station')
-        plt.grid(False)
-        #plt.show()
-        plt.savefig('command6.png')
+        years = [int(year) for year in series.years]
+        total_riders = [total_riders / 1_000_000 for total_riders in series.riders]
+
+        #drawn in the background, the prompt returns right away
+        plotting.render('command6.png', plotting.draw_line, f'Yearly Ridership at {stname} Station',
+                        'Year', 'Number of Riders', tuple(years), tuple(total_riders), xticks=tuple(years))
     
     print()
 
@@ -392,44 +275,21 @@ def yearly_ridership(dbConn):
 #User enters a station name and year and outputs monthly ridership for chosen year
 #user has option to plot data
 def monthly_ridership(dbConn):
-    dbCursor = dbConn.cursor()
     print()
     userinput = input("Enter a station name (wildcards _ and %): ").strip()
 
-    dbCursor.execute('''
-        SELECT Station_ID, Station_Name
-        FROM Stations
-        WHERE Station_Name LIKE ?
-    ''', (userinput,))
-
-    stations = dbCursor.fetchall()
-
-    if len(stations) == 0:
-        print("**No station found...")
-        print()
-        return
-    elif len(stations) > 1:
-        print("**Multiple stations found...")
-        print()
+    station = find_one_station(dbConn, userinput)
+    if station is None:
         return
 
     targetyear = input("Enter a year: ").strip()
     
-    stid, stname = stations[0]
-
-    dbCursor.execute('''
-        SELECT strftime('%m', Ride_Date) AS Month, SUM(Num_Riders) as total_riders
-        FROM Ridership
-        WHERE Station_ID = ? AND strftime('%Y', Ride_Date) = ?
-        GROUP BY Month
-        ORDER BY Month ASC
-    ''', (stid, targetyear))
-
-    ridership_data = dbCursor.fetchall()
+    stname = station.station_name
+    series = queries.monthly_ridership(dbConn, (station,), targetyear)[0]
 
     #prints data
     print(f"Monthly Ridership at {stname} for {targetyear}")
-    for month, total_riders in ridership_data:
+    for month, total_riders in zip(series.months, series.riders):
         print(f"{month}/{targetyear} : {total_riders:,}")
 
     print()
@@ -437,25 +297,20 @@ def monthly_ridership(dbConn):
     #plotting pseudo function
     plotinput = input("Plot? (y/n) ").strip().lower()
     if (plotinput == 'y'):
-        months = [int(month) for month, _ in ridership_data]
-        total_riders = [total_riders for _, total_riders in ridership_data]
-
-        plt.figure(figsize=(12, 8))
-        plt.plot(months, total_riders, linestyle='-', color='b')
-        plt.xticks(months, [f'{month:02d}' for month in months])
-        plt.xlabel('Month')
-        plt.ylabel('Number of Riders')
-        plt.title(f'Monthy Ridership at {stname} Station {targetyear}')
-        plt.grid(False)
-        #plt.show()
-        plt.savefig('command7.png')
+        months = [int(month) for month in series.months]
+        total_riders = list(series.riders)
+
+        plotting.render('command7.png', plotting.draw_line, f'Monthy Ridership at {stname} Station {targetyear}',
+                        'Month', 'Number of Riders', tuple(months), tuple(total_riders),
+                        xticks=tuple(months), xticklabels=tuple(f'{month:02d}' for month in months))
     
     print()
 
 #Helper function of two_station_daily_ridership
-#prints ride_date and total_riders as
+#prints ride_date and total_riders of one station's days as
 #YYYY-MM-DD total_riders
-def print_ridership(station_name, ridership_data):
+def print_ridership(station_name, dates, riders):
+    ridership_data = list(zip(dates, riders))
     if ridership_data:
         for ride_date, total_riders in ridership_data[:5]:
             print(f"{ride_date} {total_riders}")
@@ -463,117 +318,60 @@ def print_ridership(station_name, ridership_data):
         for ride_date, total_riders in ridership_data[-5:]:
             print(f"{ride_date} {total_riders}")
 
+#line colors of compared stations, in order
+COMPARE_COLORS = ['b', 'r', 'g', 'm', 'c', 'y', 'k']
+
 #Helper function of two_station_daily_ridership
-#extracts dates and total_riders from ridership_data
-def get_ridership_dates(ridership_data):
-    dates = [ride_date for ride_date, _ in ridership_data]
-    total_riders = [total_riders for _, total_riders in ridership_data]
-    return dates, total_riders
+#prints the first and last 5 days of each station in a DailyMatrix
+#and offers to plot every station on the same days
+def compare_stations(matrix):
+    #print results to terminal
+    #calls helper function
+    for index, station in enumerate(matrix.stations):
+        print(f"Station {index + 1}: {station.station_id} {station.station_name}")
+        print_ridership(station.station_name, *matrix.column(index))
+
+    print()
+    
+    #plotting pseudo function
+    plotinput = input("Plot? (y/n) ").strip().lower()
+    if (plotinput == 'y'):
+        #days a station has no ridership are left as gaps
+        series = tuple((station.station_name, COMPARE_COLORS[index % len(COMPARE_COLORS)],
+                        tuple(row[index] for row in matrix.riders))
+                       for index, station in enumerate(matrix.stations))
+        plotting.render('command8.png', plotting.draw_series, f'Ridership Each Day of {matrix.year}',
+                        tuple(matrix.dates), series, (0, 50, 100, 150, 200, 250, 300, 350), size=(14, 7))
+        
+    print()
 
 #command 8
 #Asks user for 2 stations and prints ridership of first 5 and last 5 days of selected year
 #user has option to plot data
 #this master function essentially just calculates the search queries of both stations
 def two_station_daily_ridership(dbConn):
-    dbCursor = dbConn.cursor()
     print()
     targetyear = input("Year to compare against? ").strip()
     print()
     station1input = input("Enter station 1 (wildcards _ and %): ").strip()
 
-    dbCursor.execute('''
-        SELECT Station_ID, Station_Name
-        FROM Stations
-        WHERE Station_Name LIKE ?
-    ''', (station1input,))
-
-    station1_idname = dbCursor.fetchall()
-
-    if len(station1_idname) == 0:
-        print("**No station found...")
-        print()
-        return
-    elif len(station1_idname) > 1:
-        print("**Multiple stations found...")
-        print()
+    station1 = find_one_station(dbConn, station1input)
+    if station1 is None:
         return
-    
-    station1id, station1name = station1_idname[0]
+
     print()
     station2input = input("Enter station 2 (wildcards _ and %): ").strip()
 
-    dbCursor.execute('''
-        SELECT Station_ID, Station_Name
-        FROM Stations
-        WHERE Station_Name LIKE ?
-    ''', (station2input,))
-
-    station2_idname = dbCursor.fetchall()
-
-    if len(station2_idname) == 0:
-        print("**No station found...")
-        print()
+    station2 = find_one_station(dbConn, station2input)
+    if station2 is None:
         return
-    elif len(station2_idname) > 1:
-        print("**Multiple stations found...")
-        print()
-        return
-
-    station2id, station2name = station2_idname[0]
 
-    dbCursor.execute('''
-        SELECT DATE(Ride_Date), SUM(Num_Riders) AS total_riders
-        FROM Ridership
-        WHERE Station_ID = ? AND strftime('%Y', Ride_Date) = ?
-        GROUP BY Ride_Date
-        ORDER BY Ride_Date ASC
-    ''', (station1id, targetyear))
-
-    station1_ridership = dbCursor.fetchall()
-
-    dbCursor.execute('''
-        SELECT DATE(Ride_Date), SUM(Num_Riders) AS total_riders
-        FROM Ridership
-        WHERE Station_ID = ? AND strftime('%Y', Ride_Date) = ?
-        GROUP BY Ride_Date
-        ORDER BY Ride_Date ASC
-    ''', (station2id, targetyear))
-
-    station2_ridership = dbCursor.fetchall()
-
-    #print results to terminal
-    #calls helper function
-    print(f"Station 1: {station1id} {station1name}")
-    print_ridership(station1name, station1_ridership)
-    print(f"Station 2: {station2id} {station2name}")
-    print_ridership(station2name, station2_ridership)
-
-    print()
-    
-    #plotting pseudo function
-    plotinput = input("Plot? (y/n) ").strip().lower()
-    if (plotinput == 'y'):
-        dates1, ridership1 = get_ridership_dates(station1_ridership)
-        dates2, ridership2 = get_ridership_dates(station2_ridership)
-
-        plt.figure(figsize=(14, 7))
-        plt.plot(dates1, ridership1, linestyle='-', color='b', label=station1name)
-        plt.plot(dates2, ridership2, linestyle='-', color='r', label=station2name)
-        plt.xticks([0, 50, 100, 150, 200, 250, 300, 350])
-        plt.xlabel('Day')
-        plt.ylabel('Number of Riders')
-        plt.title(f'Ridership Each Day of {targetyear}')
-        plt.legend()
-        plt.xticks([0, 50, 100, 150, 200, 250, 300, 350])
-        #plt.show()
-        plt.savefig('command8.png')
-        
-    print()
+    #both stations' days in one query, aligned by date
+    compare_stations(queries.daily_matrix(dbConn, (station1, station2), targetyear))
 
 #command 9
 #Asks user to input valid latitude and longitude and lists stations within a 1 mile radius of the coordinates
 def coordinate(dbConn):
-    dbCursor = dbConn.cursor()
     print()
     #ask and validate latitude and longitude
     target_latitude = float(input("Enter a latitude: "))
@@ -592,42 +390,17 @@ def coordinate(dbConn):
 
     #print()
 
-    #rough estimates of mile per latitude and longitude 
-    latr = round(1/69, 3)
-    longr = round(1 / 50, 3)
-
-    #calculate radius boundaries
-    min_lat = target_latitude - latr
-    max_lat = target_latitude + latr
-    min_long = target_longitude - longr
-    max_long = target_longitude + longr
-
-    query = """
-        SELECT s.Station_Name, st.Latitude, st.Longitude
-        FROM Stops st
-        JOIN Stations s ON st.Station_ID = s.Station_ID
-        WHERE Latitude BETWEEN ? AND ? AND Longitude BETWEEN ? AND ?
-        ORDER BY s.Station_Name ASC
-    """
-
-    dbCursor.execute(query, (min_lat, max_lat, min_long, max_long))
+    #nearest stop of each station within a mile, nearest first
+    nearby = queries.nearby_stations(dbConn, target_latitude, target_longitude, 1.0)
 
-    nearby_stations_raw = dbCursor.fetchall()
     #check if any stations exist
-    if nearby_stations_raw:
-        print()
-
-    if not nearby_stations_raw:
+    if not nearby:
         print("**No stations found...")
         print()
         return
 
-    #query returns 2 of each result for some odd reason
-    #filters out half so proper number of results
-    results = []
-    for i in range(0, len(nearby_stations_raw)):
-        if i % 2:
-            results.append(nearby_stations_raw[i])
+    print()
+    results = [(station.station_name, station.latitude, station.longitude) for station in nearby]
 
     #prints stations
     print("List of Stations Within a Mile")
@@ -638,66 +411,176 @@ def coordinate(dbConn):
     #plotting pseudo function
     plotinput = input("Plot? (y/n) ").strip().lower()
     if (plotinput == 'y'):
-        lats = [lat for _, lat, _ in results]
-        lons = [lon for _, _, lon in results]
-        names = [station_name for station_name, _, _ in results]
-
-        image = plt.imread("chicago.png")
-        xydims = [-87.9277, -87.5569, 41.7012, 42.0868]
-        plt.imshow(image, extent=xydims)
-        plt.title("Stations Near You")
-
-        for name, lat, lon in zip(names, lats, lons):
-            plt.plot(lat, lon)
-            plt.annotate(name, (lat, lon))
-
-        plt.xlim([-87.9277, -87.5569])
-        plt.ylim([41.7012, 42.0868])
-        #plt.show()
-        plt.savefig('command9.png')
+        #chicago.png is decoded once and kept by plotting
+        plotting.render('command9.png', plotting.draw_map, "Stations Near You", tuple(results), size=(6.4, 4.8))
+    print()
+
+#Command anomalies
+#prints the station days furthest from their usual ridership, from a
+#scan of every station's history
+def print_anomalies(dbConn):
+    print()
+    found = anomalies.scan_anomalies(dbConn, None, 10)
+    if found is None:
+        print("**NumPy is not installed, the anomaly scan needs it...")
+        print()
+        return
+
+    print("Most Unusual Days")
+    for anomaly in found:
+        print(f"{anomaly.date} ({anomaly.day_type}) {anomaly.station.station_name} : {anomaly.riders:,} riders, "
+              f"usually {anomaly.expected:,.0f} (score {anomaly.score:+.1f})")
     print()
 
 ##################################################################  
 #
-# main
+# print_startup_profile
 #
-print('** Welcome to CTA L analysis app **')
-print()
-
-dbConn = sqlite3.connect('CTA2_L_daily_ridership.db')
+# Prints how long each startup step took, given (step, seconds) pairs,
+# and flags a total over STARTUP_BUDGET_MS.
+#
+def print_startup_profile(steps):
+    print("Startup Profile")
+    for step, seconds in steps:
+        print(f"  {step:<20} {seconds * 1000:8.1f} ms")
+
+    totalMs = sum(seconds for _, seconds in steps) * 1000
+    print(f"  {'total':<20} {totalMs:8.1f} ms")
+    if totalMs > STARTUP_BUDGET_MS:
+        print(f"**Startup is over the {STARTUP_BUDGET_MS} ms budget")
+    print()
 
-print_stats(dbConn)
+##################################################################  
+#
+# main
+#
+# Runs the interactive REPL over the ridership database, options
+# are the parsed command line (see batch.build_parser).
+#
+def main(options):
+    print('** Welcome to CTA L analysis app **')
+    print()
 
-while True:
-    command = input("Please enter a command (1-9, x to exit): ").strip()
-    #exits program
-    if command.lower() == 'x':
-        break
-    
-    if command.isdigit() and (int(command) >= 1 and int(command) <= 9):
-        num = int(command)
-        if num == 1:
-            retrieve_stations(dbConn)
-        if num == 2:
-            ridership_percentage(dbConn)
-        if num == 3:
-            total_ridership(dbConn)
-        if num == 4:
-            find_line(dbConn)
-        if num == 5:
-            color_direction(dbConn)
-        if num == 6:
-            yearly_ridership(dbConn)
-        if num == 7:
-            monthly_ridership(dbConn)
-        if num == 8:
-            two_station_daily_ridership(dbConn)
-        if num == 9:
-            coordinate(dbConn)
-    else:
-        print("**Error, unknown command, try again...")
+    steps = [('imports', _importSeconds)]
+    start = time.perf_counter()
+
+    #time since start of the previous step, for --profile-startup
+    def step(name):
+        nonlocal start
+        now = time.perf_counter()
+        steps.append((name, now - start))
+        start = now
+
+    #the pool first refreshes the rollup tables and creates missing
+    #indexes, then every command reads through a read-only connection
+    #every query is timed for the stats command and the slow-query log
+    tracing.configure(options.slow_query_ms, options.slow_log, options.trace_plans)
+    pool = database.open_pool(options.db, options.immutable, options.in_memory, options.memory_from,
+                              options.memory_to, tracing.TracingConnection)
+    dbConn = pool.connection()
+    step('open database')
+
+    #every command reads a copy of the database held in RAM
+    if isinstance(pool, database.MemoryPool):
+        print(f"**{pool.describe()}")
         print()
 
+    #ridership from the memory-mapped NumPy snapshot instead of SQLite
+    if options.columnar:
+        if columnar.enable(dbConn) is None:
+            print("**NumPy is not installed, using SQLite...")
+            print()
+        step('columnar snapshot')
+
+    #ridership totals over any date range from running sums
+    if options.prefix_index:
+        if prefix_index.enable(dbConn) is None:
+            print("**NumPy is not installed, using SQLite...")
+            print()
+        step('prefix index')
+
+    #ridership by year from one database file per year
+    if options.partitions:
+        if partitions.enable(dbConn) is None:
+            print("**Year partitions need a database file, using SQLite...")
+            print()
+        step('year partitions')
+
+    with tracing.command('startup'):
+        #station names are resolved in memory by every command
+        queries.load_stations(dbConn)
+        step('load stations')
+
+        #lines and stops for commands 4 and 5
+        topology.get_topology(dbConn)
+        step('load topology')
+
+        print_stats(dbConn)
+        step('print_stats')
+
+    if options.profile_startup:
+        print_startup_profile(steps)
+
+    while True:
+        command = input("Please enter a command (1-9, x to exit): ").strip()
+        #exits program, once any plots still drawing are written
+        if command.lower() == 'x':
+            plotting.shutdown()
+            partitions.disable()
+            pool.close()
+            break
+
+        #diagnostic, prints the query plan of each ridership query
+        if command.lower() == 'explain':
+            print()
+            indexes.print_query_plans(dbConn, queries.PLAN_CHECKS)
+            continue
+
+        #diagnostic, summarizes the latency of the queries run so far
+        if command.lower() == 'stats':
+            print()
+            tracing.print_trace_report()
+            continue
+
+        #the most unusual station days network-wide
+        if command.lower() == 'anomalies':
+            with tracing.command('anomalies'):
+                print_anomalies(dbConn)
+            continue
+        
+        if command.isdigit() and (int(command) >= 1 and int(command) <= 9):
+            num = int(command)
+            with tracing.command(f"command {num}"):
+                if num == 1:
+                    retrieve_stations(dbConn)
+                if num == 2:
+                    ridership_percentage(dbConn)
+                if num == 3:
+                    total_ridership(dbConn)
+                if num == 4:
+                    find_line(dbConn)
+                if num == 5:
+                    color_direction(dbConn)
+                if num == 6:
+                    yearly_ridership(dbConn)
+                if num == 7:
+                    monthly_ridership(dbConn)
+                if num == 8:
+                    two_station_daily_ridership(dbConn)
+                if num == 9:
+                    coordinate(dbConn)
+        else:
+            print("**Error, unknown command, try again...")
+            print()
+
+#with a subcommand, runs that batch query instead of the REPL
+#(python3 main.py --help lists them)
+if __name__ == '__main__':
+    options = batch.build_parser().parse_args()
+    if options.command is not None:
+        sys.exit(batch.run(options))
+    main(options)
+
 
 #
 # done
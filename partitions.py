@@ -0,0 +1,314 @@
+##################################################################
+# partitions.py
+#
+# Overview: Year-partitioned ridership storage for the CTA L analysis app
+#   build_partitions copies Ridership into one database file per year
+#   in a directory next to the database, clustered by station and
+#   date, and on later runs rebuilds only the years whose rows changed.
+#   PartitionSet answers a query over a date range by attaching just
+#   the partitions the range touches (partition pruning) and running
+#   the query once per partition, on parallel threads when there are
+#   several, for the caller to merge. Every year but the newest is
+#   sealed and opened immutable=1, so SQLite skips locking and change
+#   checks on it and keeps its pages cached. queries.py sends commands
+#   6, 7 and 8 and date-range totals to the partitions when enabled.
+#     python3 partitions.py --db CTA2_L_daily_ridership.db
+##################################################################
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import database
+import indexes
+import stats_cache
+
+PARTITION_SCHEMA = """
+    CREATE TABLE Ridership (
+        Station_ID INTEGER NOT NULL,
+        Ride_Date TEXT NOT NULL,
+        Type_of_Day TEXT NOT NULL,
+        Num_Riders INTEGER NOT NULL,
+        PRIMARY KEY (Station_ID, Ride_Date)
+    ) WITHOUT ROWID
+"""
+
+#rows, highest rowid and riders of each year, plus riders weighted by
+#station and by day of the year, to spot changed years even when
+#replaced rows reuse the same rowids
+QUERY_YEAR_VERSIONS = """
+    SELECT substr(Ride_Date, 1, 4),
+           COUNT(*) || ':' || MAX(rowid) || ':' || SUM(Num_Riders) || ':' || SUM(Num_Riders * Station_ID)
+           || ':' || SUM(Num_Riders * CAST(substr(Ride_Date, 6, 2) || substr(Ride_Date, 9, 2) AS INTEGER))
+    FROM Ridership
+    GROUP BY substr(Ride_Date, 1, 4)
+"""
+
+#threads running partition queries
+WORKERS = 4
+
+MANIFEST = 'manifest.json'
+
+#directory holding the partitions of the database, None for one in memory
+def partition_dir(dbConn):
+    for _, name, path in dbConn.execute("PRAGMA database_list"):
+        if name == 'main' and path and os.path.exists(path):
+            return os.path.splitext(path)[0] + '.years'
+    return None
+
+def _partition_file(year):
+    return f"ridership_{year}.db"
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return None
+
+#writes the rows of one year from the database at path to a new
+#partition file, replacing any old one only once it is complete
+def _write_partition(path, directory, year):
+    final = os.path.join(directory, _partition_file(year))
+    partial = final + '.tmp'
+    if os.path.exists(partial):
+        os.remove(partial)
+
+    yearStart, yearEnd = indexes.year_range(year)
+    dbConn = sqlite3.connect(partial)
+    try:
+        dbConn.execute("PRAGMA journal_mode = OFF")
+        dbConn.execute(PARTITION_SCHEMA)
+        dbConn.execute("ATTACH DATABASE ? AS source", (os.path.abspath(path),))
+        dbConn.execute("""
+            INSERT INTO Ridership
+            SELECT Station_ID, Ride_Date, Type_of_Day, Num_Riders FROM source.Ridership
+            WHERE Ride_Date >= ? AND Ride_Date < ?
+            ORDER BY Station_ID, Ride_Date
+        """, (yearStart, yearEnd))
+        dbConn.commit()
+        dbConn.execute("DETACH DATABASE source")
+    finally:
+        dbConn.close()
+    os.replace(partial, final)
+
+##################################################################
+#
+# build_partitions
+#
+# Brings the partitions of the database at path up to date and
+# returns the manifest: {'fingerprint', 'partitions': {year: {'file',
+# 'version', 'sealed'}}}. Nothing is read beyond a fingerprint when
+# the data hasn't changed; otherwise only years whose row count,
+# highest rowid or rider checksums moved are rewritten, and partitions of
+# years no longer present are removed. progress, if given, is called
+# with each year rewritten.
+#
+def build_partitions(path, directory, progress=None):
+    dbConn = sqlite3.connect(database.reader_uri(path, False), uri=True)
+    try:
+        fingerprint = stats_cache.data_fingerprint(dbConn)
+        manifest = _read_manifest(directory)
+        if manifest is not None and manifest.get('fingerprint') == fingerprint:
+            return manifest
+        versions = dict(dbConn.execute(QUERY_YEAR_VERSIONS).fetchall())
+    finally:
+        dbConn.close()
+
+    os.makedirs(directory, exist_ok=True)
+    old = (manifest or {}).get('partitions', {})
+    newest = max(versions, default=None)
+
+    partitions = {}
+    for year in sorted(versions):
+        partition = old.get(year)
+        if (partition is None or partition['version'] != versions[year]
+                or not os.path.exists(os.path.join(directory, partition['file']))):
+            _write_partition(path, directory, year)
+            if progress is not None:
+                progress(year)
+        partitions[year] = {'file': _partition_file(year), 'version': versions[year], 'sealed': year != newest}
+
+    for year, partition in old.items():
+        if year not in partitions:
+            try:
+                os.remove(os.path.join(directory, partition['file']))
+            except OSError:
+                pass
+
+    manifest = {'fingerprint': fingerprint, 'partitions': partitions}
+    with open(os.path.join(directory, MANIFEST + '.tmp'), 'w') as out:
+        json.dump(manifest, out)
+    os.replace(os.path.join(directory, MANIFEST + '.tmp'), os.path.join(directory, MANIFEST))
+    return manifest
+
+##################################################################
+#
+# PartitionSet
+#
+# Queries the partitions listed in a manifest. Each thread has its
+# own in-memory connection that attaches partitions as they are
+# needed and keeps them attached, detaching the least recently used
+# one when SQLite's attach limit is reached.
+#
+class PartitionSet:
+    def __init__(self, directory, manifest, workers=WORKERS):
+        self.directory = directory
+        self.partitions = manifest['partitions']
+        self.years = sorted(self.partitions)
+        self.workers = workers
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    #years whose partitions hold days in [start, end), 'YYYY-MM-DD'
+    def years_between(self, start, end):
+        return [year for year in self.years if start < indexes.year_range(year)[1] and end > indexes.year_range(year)[0]]
+
+    #this thread's connection and its {year: schema name} of attached partitions
+    def _connection(self):
+        dbConn = getattr(self._local, 'dbConn', None)
+        if dbConn is None:
+            dbConn = sqlite3.connect(':memory:', uri=True, cached_statements=database.STATEMENT_CACHE,
+                                     check_same_thread=False)
+            dbConn.execute("PRAGMA temp_store = MEMORY")
+            self._local.dbConn = dbConn
+            self._local.attached = collections.OrderedDict()
+            self._local.limit = dbConn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+            with self._lock:
+                self._connections.append(dbConn)
+        return dbConn, self._local.attached
+
+    #schema name of a year's partition on this thread's connection
+    def _attach(self, year):
+        dbConn, attached = self._connection()
+        if year in attached:
+            attached.move_to_end(year)
+            return attached[year]
+
+        if len(attached) >= self._local.limit:
+            _, schema = attached.popitem(last=False)
+            dbConn.execute(f"DETACH DATABASE {schema}")
+
+        schema = f"y{year}"
+        partition = self.partitions[year]
+        dbConn.execute("ATTACH DATABASE ? AS " + schema,
+                       (database.reader_uri(os.path.join(self.directory, partition['file']), partition['sealed']),))
+        attached[year] = schema
+        return schema
+
+    #rows of sql on one year's partition, over [start, end) clipped to it
+    def _run(self, year, sql, params, start, end):
+        schema = self._attach(year)
+        yearStart, yearEnd = indexes.year_range(year)
+        dbCursor = self._connection()[0].cursor()
+        dbCursor.execute(sql.format(ridership=f"{schema}.Ridership"),
+                         tuple(params) + (max(start, yearStart), min(end, yearEnd)))
+        return dbCursor.fetchall()
+
+    ##################################################################
+    #
+    # query
+    #
+    # [(year, rows)] in year order of sql run on each partition the
+    # range [start, end) touches. sql reads {ridership} and ends its
+    # parameters with a Ride_Date lower and upper bound, which are
+    # filled in with the range clipped to each year. Several
+    # partitions are queried in parallel.
+    #
+    def query(self, sql, params, start, end):
+        years = self.years_between(start, end)
+        if len(years) <= 1:
+            return [(year, self._run(year, sql, params, start, end)) for year in years]
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                       thread_name_prefix='partition')
+        futures = [self._executor.submit(self._run, year, sql, params, start, end) for year in years]
+        return [(year, future.result()) for year, future in zip(years, futures)]
+
+    #every year covered, as a range for query()
+    def full_range(self):
+        if not self.years:
+            return ('', '')
+        return (indexes.year_range(self.years[0])[0], indexes.year_range(self.years[-1])[1])
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            connections, self._connections = self._connections, []
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for dbConn in connections:
+            dbConn.close()
+        self._local = threading.local()
+
+_partitions = None
+
+##################################################################
+#
+# enable
+#
+# Brings the partitions next to the database up to date (when their
+# directory can be written) and routes queries to them. Returns the
+# PartitionSet, or None for a database that isn't a file.
+#
+def enable(dbConn):
+    global _partitions
+    directory = partition_dir(dbConn)
+    if directory is None:
+        return None
+
+    path = [row[2] for row in dbConn.execute("PRAGMA database_list") if row[1] == 'main'][0]
+    if os.access(os.path.dirname(os.path.abspath(directory)), os.W_OK):
+        manifest = build_partitions(path, directory)
+    else:
+        manifest = _read_manifest(directory)
+        if manifest is None:
+            return None
+
+    disable()
+    _partitions = PartitionSet(directory, manifest)
+    return _partitions
+
+##################################################################
+#
+# disable / get_partitions
+#
+def disable():
+    global _partitions
+    if _partitions is not None:
+        _partitions.close()
+    _partitions = None
+
+def get_partitions():
+    return _partitions
+
+##################################################################
+#
+# main
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Split the ridership database into one file per year.')
+    parser.add_argument('--db', default=database.DB_FILE, help='ridership database file')
+    args = parser.parse_args(argv)
+
+    database.prepare_database(args.db)
+    directory = os.path.splitext(args.db)[0] + '.years'
+    start = time.perf_counter()
+    manifest = build_partitions(args.db, directory, lambda year: print(f"  wrote {year}"))
+
+    sealed = sum(partition['sealed'] for partition in manifest['partitions'].values())
+    print(f"{len(manifest['partitions'])} year partitions in {directory} ({sealed} sealed) "
+          f"up to date in {time.perf_counter() - start:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
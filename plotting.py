@@ -0,0 +1,195 @@
+##################################################################
+# plotting.py
+#
+# Overview: Background plot rendering for the CTA L analysis app
+#   Commands 6-9 describe a plot as plain data and hand it to render(),
+#   which draws it on a worker thread with the non-interactive Agg
+#   canvas so the prompt comes back at once. Each worker reuses one
+#   Figure, clearing it between plots, and nothing goes through pyplot
+#   so no figure is left open. The chicago.png basemap is decoded once.
+#   A plot whose data matches what was last written to the same file
+#   is not drawn again, plots of one file are drawn one at a time, and
+#   a plot superseded by a newer one for its file before it starts is
+#   skipped, so the newest plot always ends up in the file. matplotlib
+#   is imported by the first plot, on the worker, so launches that
+#   never plot never load it.
+##################################################################
+
+import concurrent.futures
+import functools
+import hashlib
+import os
+import sys
+import threading
+
+BASEMAP = "chicago.png"
+
+#longitude / latitude bounds of chicago.png
+BASEMAP_EXTENT = [-87.9277, -87.5569, 41.7012, 42.0868]
+
+WORKERS = 2
+
+_executor = None
+_executorLock = threading.Lock()
+
+#filename -> data hash of the plot last written there, of the newest
+#plot submitted for it, and the lock its renders take in turn
+_written = {}
+_latest = {}
+_fileLocks = {}
+_writtenLock = threading.Lock()
+
+_local = threading.local()
+
+#the decoded basemap, shared read-only by every worker
+@functools.lru_cache(maxsize=None)
+def load_basemap(path=BASEMAP):
+    import matplotlib.image
+    return matplotlib.image.imread(path)
+
+#this worker's Figure, cleared and resized for the next plot
+def _figure(size):
+    figure = getattr(_local, 'figure', None)
+    if figure is None:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        figure = Figure()
+        FigureCanvasAgg(figure)
+        _local.figure = figure
+    figure.clear()
+    figure.set_size_inches(size)
+    return figure
+
+##################################################################
+#
+# plot drawing functions
+#
+# Each draws one command's plot onto an empty Figure from plain data
+# (tuples of numbers and strings), so the data can be hashed.
+#
+def draw_line(figure, title, xlabel, ylabel, x, y, xticks=None, xticklabels=None):
+    axes = figure.add_subplot()
+    axes.plot(x, y, linestyle='-', color='b')
+    if xticks is not None:
+        axes.set_xticks(xticks)
+        if xticklabels is not None:
+            axes.set_xticklabels(xticklabels)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+    axes.set_title(title)
+    axes.grid(False)
+
+#series is ((label, color, riders), ...) with None riders drawn as gaps
+def draw_series(figure, title, dates, series, xticks):
+    axes = figure.add_subplot()
+    for label, color, riders in series:
+        axes.plot(dates, [float('nan') if value is None else value for value in riders],
+                  linestyle='-', color=color, label=label)
+    axes.set_xticks(xticks)
+    axes.set_xlabel('Day')
+    axes.set_ylabel('Number of Riders')
+    axes.set_title(title)
+    axes.legend()
+
+#points is ((name, lat, lon), ...)
+def draw_map(figure, title, points):
+    axes = figure.add_subplot()
+    axes.imshow(load_basemap(), extent=BASEMAP_EXTENT)
+    axes.set_title(title)
+    for name, lat, lon in points:
+        axes.plot(lat, lon)
+        axes.annotate(name, (lat, lon))
+    axes.set_xlim(BASEMAP_EXTENT[:2])
+    axes.set_ylim(BASEMAP_EXTENT[2:])
+
+#key identifying a plot by what is drawn, not when
+def data_hash(draw, size, args, kwargs):
+    text = repr((draw.__name__, size, args, sorted(kwargs.items())))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+##################################################################
+#
+# save_plot
+#
+# Draws draw(figure, *args, **kwargs) and saves it as filename on the
+# calling thread, writing to a temporary file first so a reader never
+# sees half a PNG. For callers that are already in the background,
+# such as report workers.
+#
+def save_plot(filename, draw, *args, size=(12, 8), **kwargs):
+    figure = _figure(size)
+    draw(figure, *args, **kwargs)
+    partial = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    figure.savefig(partial, format='png')
+    figure.clear()
+    os.replace(partial, filename)
+    return filename
+
+#save_plot on a worker unless a newer plot for the file has been
+#submitted, remembering what was drawn while it is still the newest
+def _render(filename, key, size, draw, args, kwargs):
+    with _writtenLock:
+        fileLock = _fileLocks.setdefault(filename, threading.Lock())
+
+    with fileLock:
+        with _writtenLock:
+            if _latest.get(filename) != key:
+                return filename
+        save_plot(filename, draw, *args, size=size, **kwargs)
+
+        with _writtenLock:
+            if _latest.get(filename) == key:
+                _written[filename] = key
+    return filename
+
+#reports a failed plot without interrupting the prompt
+def _report(future):
+    error = future.exception()
+    if error is not None:
+        print(f"**Plot failed: {error}", file=sys.stderr)
+
+def _get_executor():
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='plot')
+        return _executor
+
+##################################################################
+#
+# render
+#
+# Queues draw(figure, *args, **kwargs) to be saved as filename and
+# returns a Future of the filename. If filename already holds a plot
+# of the same data, and no other plot for it is queued, nothing is
+# drawn. A queued plot that a later render of the same file replaces
+# before it starts is never drawn; its Future still gives the filename.
+#
+def render(filename, draw, *args, size=(12, 8), **kwargs):
+    key = data_hash(draw, size, args, kwargs)
+
+    with _writtenLock:
+        unchanged = (_written.get(filename) == key and _latest.get(filename) == key
+                     and os.path.exists(filename))
+        _latest[filename] = key
+    if unchanged:
+        future = concurrent.futures.Future()
+        future.set_result(filename)
+        return future
+
+    future = _get_executor().submit(_render, filename, key, size, draw, args, kwargs)
+    future.add_done_callback(_report)
+    return future
+
+##################################################################
+#
+# shutdown
+#
+# Waits for queued plots to be written and stops the workers.
+#
+def shutdown():
+    global _executor
+    with _executorLock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
@@ -0,0 +1,473 @@
+##################################################################
+# prefix_index.py
+#
+# Overview: Optional NumPy prefix-sum index for the CTA L analysis app
+#   PrefixSumIndex holds, for every station and every day from its
+#   first ride date on, the running total of its riders on weekdays,
+#   Saturdays, Sundays/holidays and other days, plus the number of
+#   rows with ridership. The riders at a station between any two dates
+#   are then the difference of two rows: two lookups and a subtraction
+#   however long the range, and many windows at once are a single
+#   fancy-indexed NumPy subtraction. queries.py answers commands 2, 3,
+#   6 and 7 from it when it is enabled (daily ridership still comes
+#   from the columnar engine or SQL).
+#
+#   Each station's rows are blocks of their own, built one station at
+#   a time in int64 and streamed to a raw file next to the database,
+#   so neither building nor opening holds more than one station's
+#   rows in memory; later runs memory-map the file. meta.json records
+#   the rows, blocks, and Ridership rows and change count (see
+#   stats_cache.py) covered. When only later days have been added
+#   since, just the new rows are summed and appended as new blocks;
+#   anything else (replaced days, rows before a station's last day)
+#   rebuilds it.
+##################################################################
+
+import datetime
+import json
+import os
+
+import columnar
+import stats_cache
+
+#numpy, once available() has imported it
+np = None
+
+#channels of each row: riders per Type_of_Day code (see
+#columnar.DAY_TYPES), riders on other days, and rows with ridership
+CHANNELS = 5
+DAYS_CHANNEL = 4
+
+#columns of a block: station code, first day, first row, row count
+BLOCK_COLUMNS = 4
+
+#every Ridership row as (station, day number, type code, riders),
+#station by station along idx_Ridership_Station_Date
+QUERY_ROWS = """
+    SELECT
+        Station_ID,
+        CAST(julianday(Ride_Date) - 2440587.5 AS INTEGER),
+        CASE Type_of_Day WHEN 'W' THEN 0 WHEN 'A' THEN 1 WHEN 'U' THEN 2 ELSE 3 END,
+        Num_Riders
+    FROM Ridership
+    ORDER BY Station_ID ASC
+"""
+
+#the same for the rows after a rowid, found by rowid and then sorted
+#(+ keeps SQLite from walking the whole station index instead)
+QUERY_ROWS_AFTER = """
+    SELECT
+        Station_ID,
+        CAST(julianday(Ride_Date) - 2440587.5 AS INTEGER),
+        CASE Type_of_Day WHEN 'W' THEN 0 WHEN 'A' THEN 1 WHEN 'U' THEN 2 ELSE 3 END,
+        Num_Riders
+    FROM Ridership
+    WHERE rowid > ?
+    ORDER BY +Station_ID ASC
+"""
+
+#what has changed since the index was built from rows up to a rowid
+QUERY_SINCE = """
+    SELECT COUNT(*), MAX(rowid), (SELECT COUNT(*) FROM Ridership)
+    FROM Ridership
+    WHERE rowid > ?
+"""
+
+FETCH_SIZE = 100_000
+
+EPOCH = datetime.date(1970, 1, 1)
+
+#True if NumPy is installed, importing it through columnar on first call
+def available():
+    global np
+    if np is None:
+        if not columnar.available():
+            return False
+        np = columnar.np
+    return True
+
+#directory holding the index of the database, None for one in memory
+def index_dir(dbConn):
+    for _, name, path in dbConn.execute("PRAGMA database_list"):
+        if name == 'main' and path and os.path.exists(path):
+            return os.path.splitext(path)[0] + '.prefix'
+    return None
+
+#day numbers (days since 1970-01-01) of 'YYYY-MM-DD' dates
+def day_numbers(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+#sort keys of (station code, day) pairs, by code then day
+def _block_keys(codes, days):
+    return np.asarray(codes, dtype=np.int64) * 2**32 + (np.asarray(days, dtype=np.int64) + 2**31)
+
+##################################################################
+#
+# PrefixSumIndex
+#
+# blocks holds (code, first day, first row, row count) per block, and
+# rows first row + k of cumulative hold the channel totals of station
+# code over its days before first day + k. A station's first block
+# starts with zeros on its first ride date and ends on its last; days
+# appended later start a new block from the totals the previous one
+# ended on. Dates before a station's first block count nothing, and
+# dates past the end of a block count everything up to it.
+#
+class PrefixSumIndex:
+    def __init__(self, station_ids, blocks, cumulative):
+        self.station_ids = station_ids
+        self.cumulative = cumulative
+        self.codes = {int(stationID): code for code, stationID in enumerate(station_ids)}
+
+        blocks = np.asarray(blocks, dtype=np.int64).reshape(-1, BLOCK_COLUMNS)
+        self.blocks = blocks[np.lexsort((blocks[:, 1], blocks[:, 0]))]
+        self._keys = _block_keys(self.blocks[:, 0], self.blocks[:, 1])
+
+        #first and last day covered by any station
+        if len(self.blocks):
+            self.first_day = int(self.blocks[:, 1].min())
+            self.last_day = int((self.blocks[:, 1] + self.blocks[:, 3]).max()) - 2
+        else:
+            self.first_day, self.last_day = 0, -1
+
+        self._allSums = None
+        #(day numbers, labels) of the year and month boundaries, made once
+        self._periodDays = {}
+
+    #channel totals of station codes over their days before days, one
+    #row per (code, day) pair; codes of -1 get zeros
+    def _totals(self, codes, days):
+        codes = np.asarray(codes, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        totals = np.zeros((len(codes), CHANNELS), dtype=np.int64)
+        if len(self._keys) == 0:
+            return totals
+
+        #the station's last block starting on or before the day
+        found = np.searchsorted(self._keys, _block_keys(codes, days), side='right') - 1
+        known = found >= 0
+        known[known] = self.blocks[found[known], 0] == codes[known]
+        block = self.blocks[found[known]]
+        totals[known] = self.cumulative[block[:, 2] + np.minimum(days[known] - block[:, 1], block[:, 3] - 1)]
+        return totals
+
+    #(last day covered, channel totals) of a station code
+    def station_end(self, code):
+        block = self.blocks[np.searchsorted(self._keys, _block_keys(code + 1, -2**31)) - 1]
+        return int(block[1] + block[3]) - 2, self.cumulative[block[2] + block[3] - 1]
+
+    ##################################################################
+    #
+    # window_sums
+    #
+    # Channel totals, one row per window, of stationIDs[i] from
+    # starts[i] up to (not including) ends[i]. Dates may be
+    # 'YYYY-MM-DD' strings or day numbers; a station that has no
+    # ridership gets zeros. Everything is one vectorized lookup, for
+    # comparing many windows at once.
+    #
+    def window_sums(self, stationIDs, starts, ends):
+        codes = np.array([self.codes.get(int(stationID), -1) for stationID in stationIDs], dtype=np.int64)
+        starts, ends = np.asarray(starts), np.asarray(ends)
+        if starts.dtype.kind in 'UO':
+            starts = day_numbers(starts)
+        if ends.dtype.kind in 'UO':
+            ends = day_numbers(ends)
+        return self._totals(codes, ends) - self._totals(codes, np.minimum(starts, ends))
+
+    ##################################################################
+    #
+    # range_sums
+    #
+    # {Station_ID: (total, weekday, saturday, sunday)} between two
+    # 'YYYY-MM-DD' dates (end not included, either None for open) for
+    # the stations with ridership in the range, every station's window
+    # taken at once by window_sums.
+    #
+    def range_sums(self, stationIDs, start=None, end=None):
+        stationIDs = tuple(stationIDs)
+        startDay = self.first_day if start is None else (datetime.date.fromisoformat(start[:10]) - EPOCH).days
+        endDay = self.last_day + 1 if end is None else (datetime.date.fromisoformat(end[:10]) - EPOCH).days
+        sums = self.window_sums(stationIDs, np.full(len(stationIDs), startDay), np.full(len(stationIDs), endDay))
+
+        return {stationID: (sum(row[:DAYS_CHANNEL]), row[0], row[1], row[2])
+                for stationID, row in zip(stationIDs, sums.tolist()) if row[DAYS_CHANNEL]}
+
+    #same result as ColumnarRidership.day_type_sums, from the last rows
+    def day_type_sums(self, stationIDs=None):
+        if stationIDs is None:
+            if self._allSums is None:
+                self._allSums = self.range_sums(self.codes)
+            return self._allSums
+        return self.range_sums(stationIDs)
+
+    #{Station_ID: ([labels], [riders])} between consecutive boundary
+    #days, skipping periods without ridership
+    def _periods(self, stationIDs, boundaries, labels):
+        known = [(stationID, self.codes[stationID]) for stationID in stationIDs if stationID in self.codes]
+        if not known:
+            return {}
+        codes = np.repeat(np.array([code for _, code in known], dtype=np.int64), len(boundaries))
+        totals = self._totals(codes, np.tile(boundaries, len(known))).reshape(len(known), len(boundaries), CHANNELS)
+
+        found = {}
+        for (stationID, _), sums in zip(known, np.diff(totals, axis=1)):
+            keep = sums[:, DAYS_CHANNEL] > 0
+            if keep.any():
+                found[stationID] = ([label for label, kept in zip(labels, keep) if kept],
+                                    sums[keep, :DAYS_CHANNEL].sum(axis=1).tolist())
+        return found
+
+    ##################################################################
+    #
+    # yearly / monthly
+    #
+    # Same results as the ColumnarRidership methods, one subtraction
+    # per station and period.
+    #
+    def yearly(self, stationIDs):
+        if 'years' not in self._periodDays:
+            first, last = np.array([self.first_day, self.last_day + 1], dtype='datetime64[D]').astype('datetime64[Y]')
+            years = np.arange(first, last + 2)
+            self._periodDays['years'] = (years.astype('datetime64[D]').astype(np.int64),
+                                         [str(year) for year in years[:-1]])
+        return self._periods(stationIDs, *self._periodDays['years'])
+
+    def monthly(self, stationIDs, year):
+        if year not in self._periodDays:
+            months = np.arange(np.datetime64(f"{year:04d}-01"), np.datetime64(f"{year + 1:04d}-02"))
+            self._periodDays[year] = (months.astype('datetime64[D]').astype(np.int64),
+                                      [f"{month:02d}" for month in range(1, 13)])
+        return self._periods(stationIDs, *self._periodDays[year])
+
+#(Station_ID, (rows, 4) array of station, day number, type code,
+#riders) of each station in the results of sql, which must come
+#station by station, read in FETCH_SIZE batches
+def _station_rows(dbConn, sql, params=()):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(sql, params)
+    current, pending = None, []
+    while True:
+        batch = dbCursor.fetchmany(FETCH_SIZE)
+        if not batch:
+            break
+        rows = np.array(batch, dtype=np.int64)
+        for part in np.split(rows, np.flatnonzero(np.diff(rows[:, 0])) + 1):
+            stationID = int(part[0, 0])
+            if stationID != current and pending:
+                yield current, np.concatenate(pending)
+                pending = []
+            current = stationID
+            pending.append(part)
+    if pending:
+        yield current, np.concatenate(pending)
+
+#running channel totals of one station's rows, one row per day from
+#its first day through one past its last, starting from base
+def _accumulate(days, types, riders, base):
+    firstDay = int(days.min())
+    cumulative = np.zeros((int(days.max()) - firstDay + 2, CHANNELS), dtype=np.int64)
+    cumulative[0] = base
+    np.add.at(cumulative, (days - firstDay + 1, types), riders)
+    np.add.at(cumulative[:, DAYS_CHANNEL], days - firstDay + 1, 1)
+    return firstDay, np.cumsum(cumulative, axis=0, out=cumulative)
+
+##################################################################
+#
+# add_blocks
+#
+# Builds the block of each station in stationRows (see _station_rows),
+# one station at a time, continuing the stations of index if given,
+# and passes its rows to write. offset is the row the first block
+# starts on. Returns the station ids and the new (code, first day,
+# first row, row count) blocks, or None if a station has rows on or
+# before the last day index already covers for it.
+#
+def add_blocks(stationRows, index, write, offset):
+    station_ids = [int(stationID) for stationID in index.station_ids] if index is not None else []
+    codes = dict(index.codes) if index is not None else {}
+    blocks = []
+    for stationID, rows in stationRows:
+        code = codes.get(stationID)
+        base = np.zeros(CHANNELS, dtype=np.int64)
+        if code is None:
+            code = codes[stationID] = len(station_ids)
+            station_ids.append(stationID)
+        else:
+            lastDay, base = index.station_end(code)
+            if rows[:, 1].min() <= lastDay:
+                return None
+
+        firstDay, cumulative = _accumulate(rows[:, 1], rows[:, 2], rows[:, 3], base)
+        write(cumulative)
+        blocks.append((code, firstDay, offset, len(cumulative)))
+        offset += len(cumulative)
+
+    return (np.array(station_ids, dtype=np.int64),
+            np.array(blocks, dtype=np.int64).reshape(-1, BLOCK_COLUMNS))
+
+##################################################################
+#
+# save_index / load_index
+#
+# cumulative.bin is the raw int64 rows and blocks.bin the raw int64
+# blocks, both only ever appended to while the index is extended.
+# meta.json holds how many of each there are, the station ids and the
+# Ridership rows covered, and is written last so neither file is ever
+# read past what it vouches for.
+#
+def _write_meta(directory, station_ids, blockCount, rowCount, rows, maxRowid, version):
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta:
+        json.dump({'station_ids': [int(stationID) for stationID in station_ids], 'blocks': int(blockCount),
+                   'cumulative_rows': int(rowCount), 'rows': int(rows), 'max_rowid': int(maxRowid),
+                   'version': version}, meta)
+
+#builds the index of every Ridership row straight into directory
+def save_index(dbConn, directory, version):
+    os.makedirs(directory, exist_ok=True)
+    try:
+        os.remove(os.path.join(directory, 'meta.json'))
+    except FileNotFoundError:
+        pass
+
+    rows, maxRowid = dbConn.execute("SELECT COUNT(*), IFNULL(MAX(rowid), 0) FROM Ridership").fetchone()
+    rowCount = 0
+    with open(os.path.join(directory, 'cumulative.bin'), 'wb') as data:
+        def write(cumulative):
+            nonlocal rowCount
+            data.write(np.ascontiguousarray(cumulative).tobytes())
+            rowCount += len(cumulative)
+        station_ids, blocks = add_blocks(_station_rows(dbConn, QUERY_ROWS), None, write, 0)
+    with open(os.path.join(directory, 'blocks.bin'), 'wb') as data:
+        data.write(blocks.tobytes())
+    _write_meta(directory, station_ids, len(blocks), rowCount, rows, maxRowid, version)
+
+#appends blocks (and their rows) to the saved index
+def append_index(directory, index, station_ids, blocks, cumulative, rows, maxRowid, version):
+    for name, saved, added in (('cumulative.bin', index.cumulative, cumulative), ('blocks.bin', index.blocks, blocks)):
+        with open(os.path.join(directory, name), 'r+b') as data:
+            data.seek(saved.nbytes)
+            data.write(np.ascontiguousarray(added).tobytes())
+            data.truncate()
+    _write_meta(directory, station_ids, len(index.blocks) + len(blocks), len(index.cumulative) + len(cumulative),
+                rows, maxRowid, version)
+
+#(PrefixSumIndex, rows, max rowid, change count) of the saved index,
+#None if missing
+def load_index(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as meta:
+            info = json.load(meta)
+        station_ids = np.array(info['station_ids'], dtype=np.int64)
+        blocks = np.fromfile(os.path.join(directory, 'blocks.bin'), dtype=np.int64,
+                             count=info['blocks'] * BLOCK_COLUMNS)
+        if len(blocks) != info['blocks'] * BLOCK_COLUMNS:
+            return None
+        shape = (info['cumulative_rows'], CHANNELS)
+        #viewed as a plain ndarray, still backed by the mapping, to skip
+        #np.memmap's per-operation overhead
+        cumulative = (np.memmap(os.path.join(directory, 'cumulative.bin'), dtype=np.int64, mode='r',
+                                shape=shape).view(np.ndarray)
+                      if shape[0] else np.zeros(shape, dtype=np.int64))
+    except (OSError, ValueError, KeyError):
+        return None
+    return (PrefixSumIndex(station_ids, blocks, cumulative), info['rows'], info['max_rowid'],
+            info.get('version'))
+
+#the index with the Ridership rows after maxRowid added as new blocks,
+#appended to the saved files where possible; None if they don't all
+#fall after their stations' last days
+def _extend_index(dbConn, directory, index, maxRowid, rows, newMax, version):
+    parts = []
+    added = add_blocks(_station_rows(dbConn, QUERY_ROWS_AFTER, (maxRowid,)), index, parts.append,
+                       len(index.cumulative))
+    if added is None:
+        return None
+    station_ids, blocks = added
+    cumulative = np.concatenate(parts) if parts else np.zeros((0, CHANNELS), dtype=np.int64)
+
+    if directory:
+        try:
+            append_index(directory, index, station_ids, blocks, cumulative, rows, newMax, version)
+            extended = load_index(directory)
+            if extended is not None:
+                return extended[0]
+        except OSError:
+            pass
+    return PrefixSumIndex(station_ids, np.concatenate((index.blocks, blocks)),
+                          np.concatenate((index.cumulative, cumulative)))
+
+##################################################################
+#
+# open_index
+#
+# The index of the database at dbConn: the saved one if Ridership
+# hasn't changed, the saved one extended by any days appended since,
+# or a new one. Deleted rows can have their rowids reused, so rows
+# and rowids alone can't tell an append from a replacement; the
+# change count must have moved by exactly the rows added. A database
+# in memory (or a directory that can't be written) gets an index
+# held in memory.
+#
+def open_index(dbConn):
+    directory = index_dir(dbConn)
+    saved = load_index(directory) if directory else None
+    version = stats_cache.change_count(dbConn)
+
+    if saved is not None:
+        index, rows, maxRowid, savedVersion = saved
+        newRows, newMax, tableRows = dbConn.execute(QUERY_SINCE, (maxRowid,)).fetchone()
+        if newRows == 0 and tableRows == rows and version == savedVersion:
+            return index
+
+        #only rows added, nothing else changed
+        if version is None or savedVersion is None:
+            appended = version == savedVersion
+        else:
+            appended = version - savedVersion == newRows
+        if appended and newRows and tableRows == rows + newRows:
+            extended = _extend_index(dbConn, directory, index, maxRowid, tableRows, newMax, version)
+            if extended is not None:
+                return extended
+
+    if directory:
+        try:
+            save_index(dbConn, directory, version)
+            saved = load_index(directory)
+            if saved is not None:
+                return saved[0]
+        except OSError:
+            pass
+
+    parts = []
+    station_ids, blocks = add_blocks(_station_rows(dbConn, QUERY_ROWS), None, parts.append, 0)
+    return PrefixSumIndex(station_ids, blocks,
+                          np.concatenate(parts) if parts else np.zeros((0, CHANNELS), dtype=np.int64))
+
+_index = None
+
+##################################################################
+#
+# enable
+#
+# Opens the index next to the database (see open_index) and routes
+# the ridership totals to it. Returns the index, or None if NumPy is
+# not installed.
+#
+def enable(dbConn):
+    global _index
+    if not available():
+        return None
+    _index = open_index(dbConn)
+    return _index
+
+##################################################################
+#
+# disable / get_index
+#
+def disable():
+    global _index
+    _index = None
+
+def get_index():
+    return _index
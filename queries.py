@@ -0,0 +1,605 @@
+##################################################################
+# queries.py
+#
+# Overview: Query layer for the CTA L analysis app
+#   Every database question the commands ask is a function here that
+#   returns frozen, slotted result objects instead of printing. The
+#   REPL, batch mode and plotting all call these functions, and results
+#   are kept in an LRU cache keyed on the query, its parameters and the
+#   database's data version, so repeated lookups skip SQLite entirely.
+#   Ridership functions take a tuple of stations and answer all of them
+#   with one grouped query. Station name lookups go to the in-memory
+#   resolver in station_resolver.py instead of SQL, lines and stops to
+#   the TransitTopology in topology.py, and ridership goes to the NumPy
+#   engine in columnar.py when it has been enabled. Ridership totals go
+#   to the prefix-sum index in prefix_index.py ahead of either, and
+#   otherwise to the per-year files of partitions.py when enabled.
+##################################################################
+
+import functools
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import columnar
+import indexes
+import partitions
+import prefix_index
+import spatial
+import station_resolver
+import topology
+
+CACHE_SIZE = 512
+
+##################################################################
+#
+# result types
+#
+@dataclass(frozen=True, slots=True)
+class Station:
+    station_id: int
+    station_name: str
+
+@dataclass(frozen=True, slots=True)
+class RidershipSplit:
+    station: Station
+    weekday: int
+    saturday: int
+    sunday: int
+    total: int
+
+@dataclass(frozen=True, slots=True)
+class StationTotals:
+    station: Station
+    total: int
+    weekday: int
+    saturday: int
+    sunday: int
+
+@dataclass(frozen=True, slots=True)
+class DayTypeTotals:
+    weekday: int
+    saturday: int
+    sunday: int
+
+@dataclass(frozen=True, slots=True)
+class LineStop:
+    stop_name: str
+    direction: str
+    ada: bool
+
+@dataclass(frozen=True, slots=True)
+class ColorCount:
+    color: str
+    direction: str
+    num_stops: int
+
+#series are column arrays: labels[i] pairs with riders[i]
+@dataclass(frozen=True, slots=True)
+class YearlySeries:
+    station: Station
+    years: tuple
+    riders: tuple
+
+@dataclass(frozen=True, slots=True)
+class MonthlySeries:
+    station: Station
+    year: str
+    months: tuple
+    riders: tuple
+
+@dataclass(frozen=True, slots=True)
+class DailySeries:
+    station: Station
+    year: str
+    dates: tuple
+    riders: tuple
+
+#date x station matrix: riders[i][j] is stations[j] on dates[i],
+#None when that station has no ridership that day
+@dataclass(frozen=True, slots=True)
+class DailyMatrix:
+    stations: tuple
+    year: str
+    dates: tuple
+    riders: tuple
+
+    #(dates, riders) of one station, skipping the days it has no ridership
+    def column(self, index):
+        days = [(rideDate, row[index]) for rideDate, row in zip(self.dates, self.riders) if row[index] is not None]
+        return tuple(rideDate for rideDate, _ in days), tuple(riders for _, riders in days)
+
+@dataclass(frozen=True, slots=True)
+class NearbyStation:
+    station_name: str
+    latitude: float
+    longitude: float
+    distance: float
+
+##################################################################
+#
+# result cache
+#
+_cache = OrderedDict()
+_cacheLock = threading.Lock()
+cache_stats = {'hits': 0, 'misses': 0}
+
+##################################################################
+#
+# data_version
+#
+# Changes whenever the database content may have changed: PRAGMA
+# data_version moves when another connection commits, total_changes
+# when this one writes.
+#
+def data_version(dbConn):
+    version = dbConn.execute("PRAGMA data_version").fetchone()[0]
+    return (version, dbConn.total_changes)
+
+##################################################################
+#
+# cached
+#
+# Decorator memoizing a query function in the shared LRU cache.
+# List arguments are turned into tuples so they can be part of the key.
+#
+def cached(func):
+    @functools.wraps(func)
+    def wrapper(dbConn, *args):
+        args = tuple(tuple(arg) if isinstance(arg, list) else arg for arg in args)
+        key = (func.__name__, id(dbConn), data_version(dbConn), args)
+
+        with _cacheLock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                cache_stats['hits'] += 1
+                return _cache[key]
+            cache_stats['misses'] += 1
+
+        result = func(dbConn, *args)
+
+        with _cacheLock:
+            _cache[key] = result
+            if len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+        return result
+    return wrapper
+
+#the prefix-sum index when enabled, otherwise the columnar engine (or
+#None), for the functions that only need ridership totals
+def _totals_engine():
+    index = prefix_index.get_index()
+    if index is not None:
+        return index
+    return columnar.get_engine()
+
+##################################################################
+#
+# clear_cache
+#
+def clear_cache():
+    with _cacheLock:
+        _cache.clear()
+
+#"?, ?, ?" for count parameters
+def _placeholders(count):
+    return ", ".join("?" for _ in range(count))
+
+#groups (station id, label, riders) rows, ordered by station, into
+#{station id: ([labels], [riders])}
+def _group_series(rows):
+    grouped = {}
+    for stationID, label, riders in rows:
+        labels, values = grouped.setdefault(stationID, ([], []))
+        labels.append(label)
+        values.append(riders)
+    return grouped
+
+##################################################################
+#
+# SQL
+#
+# Station lists are spliced in as "IN (?, ?, ...)" with {stations}.
+#
+QUERY_STATION_SPLIT = """
+        SELECT
+            Station_ID,
+            SUM(Num_Riders) AS total_riders,
+            SUM(CASE WHEN Type_of_Day = 'W' THEN Num_Riders ELSE 0 END) AS weekday_ridership,
+            SUM(CASE WHEN Type_of_Day = 'A' THEN Num_Riders ELSE 0 END) AS sat_ridership,
+            SUM(CASE WHEN Type_of_Day = 'U' THEN Num_Riders ELSE 0 END) AS sun_ridership
+        FROM Ridership_Yearly
+        WHERE Station_ID IN ({stations})
+        GROUP BY Station_ID
+    """
+
+#like QUERY_STATION_SPLIT over the days in [start, end)
+QUERY_RANGE_SPLIT = """
+        SELECT
+            Station_ID,
+            SUM(Num_Riders) AS total_riders,
+            SUM(CASE WHEN Type_of_Day = 'W' THEN Num_Riders ELSE 0 END) AS weekday_ridership,
+            SUM(CASE WHEN Type_of_Day = 'A' THEN Num_Riders ELSE 0 END) AS sat_ridership,
+            SUM(CASE WHEN Type_of_Day = 'U' THEN Num_Riders ELSE 0 END) AS sun_ridership
+        FROM Ridership_Daily
+        WHERE Station_ID IN ({stations}) AND Ride_Day >= ? AND Ride_Day < ?
+        GROUP BY Station_ID
+    """
+
+QUERY_TOTAL_SPLIT = """
+        SELECT
+            COALESCE(SUM(CASE WHEN r.Type_of_Day = 'W' THEN r.Num_Riders ELSE 0 END), 0) AS total_weekday_ridership,
+            COALESCE(SUM(CASE WHEN r.Type_of_Day = 'A' THEN r.Num_Riders ELSE 0 END), 0) AS total_sat_ridership,
+            COALESCE(SUM(CASE WHEN r.Type_of_Day = 'U' THEN r.Num_Riders ELSE 0 END), 0) AS total_sun_ridership
+        FROM Ridership_Yearly r
+    """
+
+QUERY_STATION_TOTALS = """
+    SELECT
+        s.Station_ID,
+        s.Station_Name,
+        COALESCE(SUM(r.Num_Riders), 0) AS total_riders,
+        COALESCE(SUM(CASE WHEN r.Type_of_Day = 'W' THEN r.Num_Riders ELSE 0 END), 0) AS weekday_ridership,
+        COALESCE(SUM(CASE WHEN r.Type_of_Day = 'A' THEN r.Num_Riders ELSE 0 END), 0) AS sat_ridership,
+        COALESCE(SUM(CASE WHEN r.Type_of_Day = 'U' THEN r.Num_Riders ELSE 0 END), 0) AS sun_ridership
+    FROM Stations s
+    LEFT JOIN Ridership_Yearly r ON s.Station_ID = r.Station_ID
+    GROUP BY s.Station_ID, s.Station_Name
+    """
+
+QUERY_YEARLY = """
+        SELECT Station_ID, Year, SUM(Num_Riders) AS total_riders
+        FROM Ridership_Yearly
+        WHERE Station_ID IN ({stations})
+        GROUP BY Station_ID, Year
+        ORDER BY Station_ID ASC, Year ASC
+    """
+
+QUERY_MONTHLY = """
+        SELECT Station_ID, Month, SUM(Num_Riders) as total_riders
+        FROM Ridership_Monthly
+        WHERE Station_ID IN ({stations}) AND Year = ?
+        GROUP BY Station_ID, Month
+        ORDER BY Station_ID ASC, Month ASC
+    """
+
+#one row per day with a column per station ({pivot} holds one
+#"SUM(CASE WHEN Station_ID = ? ...)" per station), NULL where a station
+#has no ridership that day. Ride_Date range rather than
+#strftime('%Y', Ride_Date) so the (Station_ID, Ride_Date) index
+#narrows the search to one year
+QUERY_DAILY_MATRIX = """
+        SELECT DATE(Ride_Date), Station_ID, SUM(Num_Riders)
+        FROM {ridership}
+        WHERE Station_ID IN ({stations}) AND Ride_Date >= ? AND Ride_Date < ?
+        GROUP BY Ride_Date, Station_ID
+        ORDER BY Ride_Date ASC
+    """
+
+#partition-local versions of the ridership queries, run by
+#partitions.PartitionSet on each year's {ridership} table between the
+#two Ride_Date bounds it appends
+QUERY_PARTITION_YEARLY = """
+        SELECT Station_ID, substr(Ride_Date, 1, 4), SUM(Num_Riders)
+        FROM {ridership}
+        WHERE Station_ID IN ({stations}) AND Ride_Date >= ? AND Ride_Date < ?
+        GROUP BY Station_ID
+        ORDER BY Station_ID ASC
+    """
+
+QUERY_PARTITION_MONTHLY = """
+        SELECT Station_ID, substr(Ride_Date, 6, 2), SUM(Num_Riders)
+        FROM {ridership}
+        WHERE Station_ID IN ({stations}) AND Ride_Date >= ? AND Ride_Date < ?
+        GROUP BY Station_ID, substr(Ride_Date, 6, 2)
+        ORDER BY Station_ID ASC, substr(Ride_Date, 6, 2) ASC
+    """
+
+QUERY_PARTITION_RANGE_SPLIT = """
+        SELECT
+            Station_ID,
+            SUM(Num_Riders),
+            SUM(CASE WHEN Type_of_Day = 'W' THEN Num_Riders ELSE 0 END),
+            SUM(CASE WHEN Type_of_Day = 'A' THEN Num_Riders ELSE 0 END),
+            SUM(CASE WHEN Type_of_Day = 'U' THEN Num_Riders ELSE 0 END)
+        FROM {ridership}
+        WHERE Station_ID IN ({stations}) AND Ride_Date >= ? AND Ride_Date < ?
+        GROUP BY Station_ID
+    """
+
+#(label, query, sample params, tables the query is expected to scan)
+#for the "explain" diagnostic command
+PLAN_CHECKS = [
+    ('command 2', QUERY_STATION_SPLIT.format(stations='?'), (0,), ()),
+    ('date range', QUERY_RANGE_SPLIT.format(stations='?'), (0, '2000-01-01', '2001-01-01'), ()),
+    ('command 3 totals', QUERY_TOTAL_SPLIT, (), ('r',)),
+    ('command 3 stations', QUERY_STATION_TOTALS, (), ('s',)),
+    ('command 6', QUERY_YEARLY.format(stations='?'), (0,), ()),
+    ('command 7', QUERY_MONTHLY.format(stations='?'), (0, '2000'), ()),
+    ('command 8', QUERY_DAILY_MATRIX.format(stations='?', ridership='Ridership'), (0, '2000-01-01', '2001-01-01'), ()),
+]
+
+##################################################################
+#
+# stations
+#
+# Answered from the in-memory StationResolver rather than SQL, so
+# these skip the result cache.
+#
+#stations whose name matches a pattern (wildcards _ and %), by name
+def find_stations(dbConn, pattern):
+    return tuple(Station(stationID, stationName)
+                 for stationID, stationName in station_resolver.get_resolver(dbConn).like(pattern))
+
+#every station matching any of the patterns, by name; no patterns means all
+def match_stations(dbConn, patterns=()):
+    if not patterns:
+        return find_stations(dbConn, '%')
+
+    found = {}
+    for pattern in patterns:
+        for station in find_stations(dbConn, pattern):
+            found[station.station_id] = station
+    return tuple(sorted(found.values(), key=lambda station: station.station_name))
+
+#the station with exactly this name, or None
+def station_by_name(dbConn, stationName):
+    found = station_resolver.get_resolver(dbConn).exact(stationName)
+    if not found:
+        return None
+    return Station(found[0][0], found[0][1])
+
+#loads the station resolver up front instead of on the first lookup
+def load_stations(dbConn):
+    station_resolver.get_resolver(dbConn)
+
+#stations most similar to a misspelled or ambiguous name, best first,
+#optionally only from among the given stations
+def suggest_stations(dbConn, text, limit=5, among=None):
+    if among is not None:
+        among = [(station.station_id, station.station_name) for station in among]
+    return tuple(Station(stationID, stationName)
+                 for stationID, stationName in station_resolver.get_resolver(dbConn).suggest(text, limit, among))
+
+##################################################################
+#
+# ridership
+#
+#weekday / saturday / sunday-holiday split of each station with ridership
+@cached
+def ridership_split(dbConn, stations):
+    if not stations:
+        return ()
+
+    engine = _totals_engine()
+    if engine is not None:
+        sums = engine.day_type_sums(tuple(station.station_id for station in stations))
+        return tuple(RidershipSplit(station, *sums[station.station_id][1:], sums[station.station_id][0])
+                     for station in stations if station.station_id in sums)
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(QUERY_STATION_SPLIT.format(stations=_placeholders(len(stations))),
+                     tuple(station.station_id for station in stations))
+    sums = {row[0]: row[1:] for row in dbCursor.fetchall()}
+
+    splits = []
+    for station in stations:
+        if station.station_id not in sums or sums[station.station_id][0] is None:
+            continue
+        total, weekday, saturday, sunday = sums[station.station_id]
+        splits.append(RidershipSplit(station, weekday, saturday, sunday, total))
+    return tuple(splits)
+
+#weekday / saturday / sunday-holiday split of each station with
+#ridership from start up to (not including) end, both 'YYYY-MM-DD'
+@cached
+def range_split(dbConn, stations, start, end):
+    if not stations:
+        return ()
+
+    index = prefix_index.get_index()
+    yearParts = partitions.get_partitions()
+    if index is not None:
+        sums = index.range_sums(tuple(station.station_id for station in stations), start, end)
+    elif yearParts is not None:
+        #each year's partition sums its part of the range, added up here
+        sums = {}
+        for _, rows in yearParts.query(QUERY_PARTITION_RANGE_SPLIT.format(stations=_placeholders(len(stations)),
+                                                                          ridership='{ridership}'),
+                                       tuple(station.station_id for station in stations), start, end):
+            for stationID, *values in rows:
+                sums[stationID] = tuple(map(sum, zip(sums.get(stationID, (0, 0, 0, 0)), values)))
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(QUERY_RANGE_SPLIT.format(stations=_placeholders(len(stations))),
+                         tuple(station.station_id for station in stations) + (start, end))
+        sums = {row[0]: row[1:] for row in dbCursor.fetchall()}
+
+    return tuple(RidershipSplit(station, *sums[station.station_id][1:], sums[station.station_id][0])
+                 for station in stations if station.station_id in sums)
+
+#network-wide ridership by type of day
+@cached
+def network_split(dbConn):
+    engine = _totals_engine()
+    if engine is not None:
+        sums = engine.day_type_sums().values()
+        return DayTypeTotals(sum(row[1] for row in sums), sum(row[2] for row in sums), sum(row[3] for row in sums))
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(QUERY_TOTAL_SPLIT)
+    weekday, saturday, sunday = dbCursor.fetchone()
+    return DayTypeTotals(weekday, saturday, sunday)
+
+#every station's ridership by type of day, in database order
+@cached
+def station_totals(dbConn):
+    engine = _totals_engine()
+    if engine is not None:
+        sums = engine.day_type_sums()
+        allStations = sorted(station_resolver.get_resolver(dbConn).stations)
+        return tuple(StationTotals(Station(stationID, stationName), *sums.get(stationID, (0, 0, 0, 0)))
+                     for stationID, stationName in allStations)
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(QUERY_STATION_TOTALS)
+    return tuple(StationTotals(Station(stationID, stationName), total, weekday, saturday, sunday)
+                 for stationID, stationName, total, weekday, saturday, sunday in dbCursor.fetchall())
+
+#yearly ridership of each station, stations without ridership get empty series
+@cached
+def yearly_ridership(dbConn, stations):
+    if not stations:
+        return ()
+
+    engine = _totals_engine()
+    yearParts = partitions.get_partitions()
+    if engine is not None:
+        grouped = engine.yearly(tuple(station.station_id for station in stations))
+    elif yearParts is not None:
+        #one total per station from each year's partition, in year order
+        grouped = {}
+        for _, rows in yearParts.query(QUERY_PARTITION_YEARLY.format(stations=_placeholders(len(stations)),
+                                                                     ridership='{ridership}'),
+                                       tuple(station.station_id for station in stations), *yearParts.full_range()):
+            for stationID, year, riders in rows:
+                years, values = grouped.setdefault(stationID, ([], []))
+                years.append(year)
+                values.append(riders)
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(QUERY_YEARLY.format(stations=_placeholders(len(stations))),
+                         tuple(station.station_id for station in stations))
+        grouped = _group_series(dbCursor.fetchall())
+
+    return tuple(YearlySeries(station, *map(tuple, grouped.get(station.station_id, ([], []))))
+                 for station in stations)
+
+#monthly ridership of each station during a year
+@cached
+def monthly_ridership(dbConn, stations, year):
+    if not stations:
+        return ()
+
+    engine = _totals_engine()
+    yearParts = partitions.get_partitions()
+    if engine is not None:
+        #a year that isn't a number has no months
+        grouped = engine.monthly(tuple(station.station_id for station in stations), int(year)) if str(year).isdigit() else {}
+    elif yearParts is not None:
+        #each partition's months added into one total per station and month
+        months = {}
+        if str(year).isdigit():
+            for _, rows in yearParts.query(QUERY_PARTITION_MONTHLY.format(stations=_placeholders(len(stations)),
+                                                                          ridership='{ridership}'),
+                                           tuple(station.station_id for station in stations), *indexes.year_range(year)):
+                for stationID, month, riders in rows:
+                    stationMonths = months.setdefault(stationID, {})
+                    stationMonths[month] = stationMonths.get(month, 0) + riders
+        grouped = {stationID: (sorted(stationMonths), [stationMonths[month] for month in sorted(stationMonths)])
+                   for stationID, stationMonths in months.items()}
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(QUERY_MONTHLY.format(stations=_placeholders(len(stations))),
+                         tuple(station.station_id for station in stations) + (str(year),))
+        grouped = _group_series(dbCursor.fetchall())
+
+    return tuple(MonthlySeries(station, str(year), *map(tuple, grouped.get(station.station_id, ([], []))))
+                 for station in stations)
+
+#(dates, rows) of the date x station matrix of (date, Station_ID,
+#riders) rows in date order, None where a station has no ridership.
+#Pivoting here rather than in SQL keeps the result at three columns,
+#however many stations (SQLite allows at most 2000)
+def _pivot_days(rows, stationIDs):
+    columns = {}
+    for column, stationID in enumerate(stationIDs):
+        columns.setdefault(stationID, []).append(column)
+
+    dates, matrix = [], []
+    for rideDate, stationID, riders in rows:
+        if not dates or dates[-1] != rideDate:
+            dates.append(rideDate)
+            matrix.append([None] * len(stationIDs))
+        for column in columns[stationID]:
+            matrix[-1][column] = riders
+    return tuple(dates), tuple(tuple(row) for row in matrix)
+
+#daily ridership of every station during a year as one aligned
+#date x station matrix, from a single query. A year that isn't a
+#number matches no ride dates
+@cached
+def daily_matrix(dbConn, stations, year):
+    if not stations:
+        return DailyMatrix((), str(year), (), ())
+
+    try:
+        yearStart, yearEnd = indexes.year_range(year)
+    except ValueError:
+        yearStart = yearEnd = ''
+
+    stationIDs = tuple(station.station_id for station in stations)
+
+    engine = columnar.get_engine()
+    if engine is not None:
+        if not yearStart:
+            return DailyMatrix(tuple(stations), str(year), (), ())
+        dates, rows = engine.daily(stationIDs, yearStart, yearEnd)
+        return DailyMatrix(tuple(stations), str(year), tuple(dates), tuple(rows))
+
+    yearParts = partitions.get_partitions()
+    if yearParts is not None:
+        rows = [row for _, yearRows in yearParts.query(
+                    QUERY_DAILY_MATRIX.format(stations=_placeholders(len(stations)), ridership='{ridership}'),
+                    stationIDs, yearStart, yearEnd)
+                for row in yearRows]
+    else:
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(QUERY_DAILY_MATRIX.format(stations=_placeholders(len(stations)), ridership='Ridership'),
+                         stationIDs + (yearStart, yearEnd))
+        rows = dbCursor.fetchall()
+
+    return DailyMatrix(tuple(stations), str(year), *_pivot_days(rows, stationIDs))
+
+#daily ridership of each station during a year, as one series per
+#station taken from the daily matrix
+@cached
+def daily_ridership(dbConn, stations, year):
+    matrix = daily_matrix(dbConn, stations, year)
+    return tuple(DailySeries(station, str(year), *matrix.column(index))
+                 for index, station in enumerate(matrix.stations))
+
+##################################################################
+#
+# lines and stops
+#
+# Answered from the in-memory TransitTopology rather than SQL, so
+# these skip the result cache.
+#
+#Line_ID of a line color (case-insensitive), or None
+def line_id(dbConn, color):
+    return topology.get_topology(dbConn).line_id(color)
+
+#stops of a line going in a direction, by stop name
+def line_stops(dbConn, lineID, direction):
+    return topology.get_topology(dbConn).line_stops(lineID, direction)
+
+#number of stops of each color by direction
+def stops_per_color(dbConn):
+    return topology.get_topology(dbConn).stops_per_color()
+
+def total_stops(dbConn):
+    return topology.get_topology(dbConn).total_stops
+
+#stations within radius miles of a point, nearest first
+@cached
+def nearby_stations(dbConn, latitude, longitude, radius=1.0):
+    found = spatial.get_station_index(dbConn).within(latitude, longitude, radius)
+    return tuple(NearbyStation(stationName, lat, lon, distance) for distance, stationName, lat, lon in found)
+
+#the count stations nearest a point however far away, nearest first
+@cached
+def nearest_stations(dbConn, latitude, longitude, count=1):
+    found = spatial.get_station_index(dbConn).nearest(latitude, longitude, count)
+    return tuple(NearbyStation(stationName, lat, lon, distance) for distance, stationName, lat, lon in found)
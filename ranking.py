@@ -0,0 +1,140 @@
+##################################################################
+# ranking.py
+#
+# Overview: Station ridership rankings for the CTA L analysis app
+#   rank_stations answers command 3 with a single grouped query over
+#   the yearly rollup that also carries the network grand totals as
+#   window columns, then streams ranked rows to the caller. A top N
+#   ranking keeps only N rows in a heap; a full ranking is sorted by
+#   SQLite and read straight off the cursor.
+##################################################################
+
+import heapq
+from dataclasses import dataclass
+
+import columnar
+import queries
+import station_resolver
+
+#day type -> label used in output
+DAY_TYPES = {
+    'W': 'Weekdays',
+    'A': 'Saturdays',
+    'U': 'Sundays/Holidays',
+    'total': 'All Days',
+}
+
+#riders column of each day type in the ranking query
+_DAY_TYPE_SQL = {
+    'total': "COALESCE(SUM(r.Num_Riders), 0)",
+    'W': "COALESCE(SUM(CASE WHEN r.Type_of_Day = 'W' THEN r.Num_Riders ELSE 0 END), 0)",
+    'A': "COALESCE(SUM(CASE WHEN r.Type_of_Day = 'A' THEN r.Num_Riders ELSE 0 END), 0)",
+    'U': "COALESCE(SUM(CASE WHEN r.Type_of_Day = 'U' THEN r.Num_Riders ELSE 0 END), 0)",
+}
+
+#per-station sums plus the same sums over every station as window
+#columns, so grand totals cost no second scan. {order} is empty or
+#an ORDER BY on the ranked day type
+QUERY_RANKING = f"""
+    SELECT
+        s.Station_ID,
+        s.Station_Name,
+        {_DAY_TYPE_SQL['total']},
+        {_DAY_TYPE_SQL['W']},
+        {_DAY_TYPE_SQL['A']},
+        {_DAY_TYPE_SQL['U']},
+        SUM({_DAY_TYPE_SQL['total']}) OVER (),
+        SUM({_DAY_TYPE_SQL['W']}) OVER (),
+        SUM({_DAY_TYPE_SQL['A']}) OVER (),
+        SUM({_DAY_TYPE_SQL['U']}) OVER ()
+    FROM Stations s
+    LEFT JOIN Ridership_Yearly r ON s.Station_ID = r.Station_ID
+    GROUP BY s.Station_ID, s.Station_Name
+    {{order}}
+"""
+
+#position of each day type's riders in a grand total row
+_FIELD = {'total': 0, 'W': 1, 'A': 2, 'U': 3}
+
+@dataclass(frozen=True, slots=True)
+class RankedStation:
+    rank: int
+    day_type: str
+    totals: queries.StationTotals
+    network: tuple
+
+    #riders of the ranked day type at this station and network-wide
+    @property
+    def riders(self):
+        return _value(self.totals, self.day_type)
+
+    @property
+    def network_riders(self):
+        return self.network[_FIELD[self.day_type]]
+
+    #share of the network's riders for the ranked day type, in percent
+    @property
+    def pct(self):
+        if self.network_riders > 0:
+            return (self.riders / self.network_riders) * 100
+        return 0
+
+#(StationTotals, (total, weekday, saturday, sunday) network sums)
+#for every station, in Station_ID order, from the SQLite cursor
+def _sql_rows(dbConn, order):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(QUERY_RANKING.format(order=order))
+    for stationID, stationName, total, weekday, saturday, sunday, *network in dbCursor:
+        yield queries.StationTotals(queries.Station(stationID, stationName), total, weekday, saturday, sunday), tuple(network)
+
+#the same rows from the columnar engine
+def _columnar_rows(dbConn, engine):
+    sums = engine.day_type_sums()
+    allStations = sorted(station_resolver.get_resolver(dbConn).stations)
+    rows = [queries.StationTotals(queries.Station(stationID, stationName), *sums.get(stationID, (0, 0, 0, 0)))
+            for stationID, stationName in allStations]
+    network = tuple(sum(_value(row, field) for row in rows) for field in ('total', 'W', 'A', 'U'))
+    for row in rows:
+        yield row, network
+
+#riders of a StationTotals for a day type
+def _value(totals, dayType):
+    if dayType == 'W':
+        return totals.weekday
+    if dayType == 'A':
+        return totals.saturday
+    if dayType == 'U':
+        return totals.sunday
+    return totals.total
+
+##################################################################
+#
+# rank_stations
+#
+# Yields RankedStation rows, most riders of dayType ('W', 'A', 'U'
+# or 'total') first, ties in Station_ID order. With top, only the
+# first top stations are produced and only that many are held.
+#
+def rank_stations(dbConn, dayType='W', top=None):
+    if dayType not in DAY_TYPES:
+        raise ValueError(f"unknown day type {dayType!r}")
+
+    engine = columnar.get_engine()
+
+    #full ranking: let SQLite sort and stream straight off the cursor
+    if top is None and engine is None:
+        order = f"ORDER BY {_DAY_TYPE_SQL[dayType]} DESC, s.Station_ID ASC"
+        for rank, (totals, network) in enumerate(_sql_rows(dbConn, order), start=1):
+            yield RankedStation(rank, dayType, totals, network)
+        return
+
+    rows = _columnar_rows(dbConn, engine) if engine is not None else _sql_rows(dbConn, "")
+
+    if top is None:
+        ranked = sorted(rows, key=lambda row: _value(row[0], dayType), reverse=True)
+    else:
+        #nlargest keeps arrival (Station_ID) order among ties, like a stable sort
+        ranked = heapq.nlargest(top, rows, key=lambda row: _value(row[0], dayType))
+
+    for rank, (totals, network) in enumerate(ranked, start=1):
+        yield RankedStation(rank, dayType, totals, network)
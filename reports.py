@@ -0,0 +1,217 @@
+##################################################################
+# reports.py
+#
+# Overview: Parallel per-station reports for the CTA L analysis app
+#   generate_reports writes, for every station (or those matching the
+#   given patterns), the yearly totals of command 6 and the monthly
+#   totals of command 7 for each year as CSV, plus the same plots the
+#   REPL draws. Stations are split into small chunks and fanned out
+#   over a ProcessPoolExecutor, each worker process holding its own
+#   read-only connection, so reports scale with cores instead of
+#   sharing one connection and one interpreter lock. Only a few chunks
+#   per worker are queued at a time, progress is reported as chunks
+#   finish, and index.csv lists every station's report at the end.
+#     python3 reports.py reports/
+#     python3 reports.py reports/ --station Howard --year 2019 --workers 8 --no-plots
+##################################################################
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+import batch
+import database
+import plotting
+import queries
+
+#chunks queued per worker beyond the one it is running
+QUEUE_PER_WORKER = 2
+
+#chunks per worker, enough to even out stations of different sizes
+CHUNKS_PER_WORKER = 4
+
+@dataclass(frozen=True, slots=True)
+class StationReport:
+    station: queries.Station
+    directory: str
+    years: tuple
+    total: int
+    peak_year: str
+    files: tuple
+
+@dataclass(frozen=True, slots=True)
+class ReportResult:
+    reports: tuple
+    failed: dict
+    index: str
+    seconds: float
+
+#this worker process's read-only connection
+_workerConn = None
+
+def _init_worker(path, immutable):
+    global _workerConn
+    _workerConn = database.connect_reader(path, immutable)
+
+def _write_csv(filename, rows):
+    with open(filename, 'w', newline='') as out:
+        batch.write_rows(rows, out, 'csv')
+
+##################################################################
+#
+# report_stations
+#
+# Runs in a worker: writes the reports of a chunk of stations under
+# outDir and returns their StationReports. years limits the monthly
+# reports, otherwise every year a station has ridership gets one.
+#
+def report_stations(stations, outDir, years=None, plots=True):
+    dbConn = _workerConn
+    yearly = queries.yearly_ridership(dbConn, stations)
+
+    wanted = sorted({year for series in yearly for year in series.years}
+                    if years is None else {str(year) for year in years})
+    monthly = {year: queries.monthly_ridership(dbConn, stations, year) for year in wanted}
+
+    reports = []
+    for index, series in enumerate(yearly):
+        station = series.station
+        directory = os.path.join(outDir, str(station.station_id))
+        os.makedirs(directory, exist_ok=True)
+        files = []
+
+        filename = os.path.join(directory, 'yearly.csv')
+        _write_csv(filename, ({'year': int(year), 'riders': riders} for year, riders in zip(series.years, series.riders)))
+        files.append(filename)
+
+        filename = os.path.join(directory, 'monthly.csv')
+        _write_csv(filename, ({'year': int(year), 'month': int(month), 'riders': riders}
+                              for year in wanted
+                              for month, riders in zip(monthly[year][index].months, monthly[year][index].riders)))
+        files.append(filename)
+
+        if plots and series.years:
+            yearNumbers = tuple(int(year) for year in series.years)
+            files.append(plotting.save_plot(os.path.join(directory, 'yearly.png'), plotting.draw_line,
+                                            f'Yearly Ridership at {station.station_name} Station', 'Year',
+                                            'Number of Riders', yearNumbers,
+                                            tuple(riders / 1_000_000 for riders in series.riders), xticks=yearNumbers))
+            for year in wanted:
+                months = tuple(int(month) for month in monthly[year][index].months)
+                if not months:
+                    continue
+                files.append(plotting.save_plot(os.path.join(directory, f'monthly_{year}.png'), plotting.draw_line,
+                                                f'Monthly Ridership at {station.station_name} Station {year}',
+                                                'Month', 'Number of Riders', months, monthly[year][index].riders,
+                                                xticks=months, xticklabels=tuple(f'{month:02d}' for month in months)))
+
+        peak = max(zip(series.riders, series.years))[1] if series.years else None
+        reports.append(StationReport(station, directory, series.years, sum(series.riders), peak,
+                                     tuple(os.path.relpath(name, outDir) for name in files)))
+    return reports
+
+#stations split into about workers * CHUNKS_PER_WORKER chunks
+def _chunks(stations, workers):
+    size = max(1, -(-len(stations) // (workers * CHUNKS_PER_WORKER)))
+    return [stations[start:start + size] for start in range(0, len(stations), size)]
+
+##################################################################
+#
+# generate_reports
+#
+# Writes the reports of the stations matching stationPatterns (every
+# station by default) under outDir using workers processes, then
+# index.csv, and returns a ReportResult. progress, if given, is called
+# as progress(done, total) each time a chunk of stations finishes.
+# A chunk that fails is recorded in failed (station name -> error)
+# and the rest carry on.
+#
+def generate_reports(path, outDir, stationPatterns=None, years=None, workers=None, plots=True,
+                     immutable=False, progress=None):
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+
+    #one pool prepares the file and resolves the stations, then the
+    #workers open their own connections
+    with database.ConnectionPool(path, immutable) as pool:
+        stations = queries.match_stations(pool.connection(), tuple(stationPatterns or ()))
+
+    os.makedirs(outDir, exist_ok=True)
+    chunks = _chunks(stations, workers)
+    reports = []
+    failed = {}
+    done = 0
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                initargs=(path, immutable)) as executor:
+        pending = {}
+        remaining = iter(chunks)
+        while True:
+            #keep the queue short so results stream back as they finish
+            while len(pending) < workers * (1 + QUEUE_PER_WORKER):
+                chunk = next(remaining, None)
+                if chunk is None:
+                    break
+                pending[executor.submit(report_stations, chunk, outDir, years, plots)] = chunk
+            if not pending:
+                break
+
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                chunk = pending.pop(future)
+                try:
+                    reports.extend(future.result())
+                except Exception as error:
+                    for station in chunk:
+                        failed[station.station_name] = f"{type(error).__name__}: {error}"
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, len(stations))
+
+    reports.sort(key=lambda report: (report.station.station_name, report.station.station_id))
+    index = os.path.join(outDir, 'index.csv')
+    _write_csv(index, ({'station_id': report.station.station_id, 'station_name': report.station.station_name,
+                        'first_year': report.years[0] if report.years else None,
+                        'last_year': report.years[-1] if report.years else None,
+                        'total_riders': report.total, 'peak_year': report.peak_year,
+                        'directory': os.path.relpath(report.directory, outDir),
+                        'files': " ".join(report.files)} for report in reports))
+
+    return ReportResult(tuple(reports), failed, index, time.perf_counter() - start)
+
+##################################################################
+#
+# main
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write yearly and monthly ridership reports for every station.')
+    parser.add_argument('output', help='directory to write the reports to')
+    parser.add_argument('--db', default=database.DB_FILE, help='ridership database file')
+    parser.add_argument('--station', action='append', help='station name pattern, repeatable (default every station)')
+    parser.add_argument('--year', action='append', type=int, help='monthly reports for this year, repeatable '
+                                                                  '(default every year)')
+    parser.add_argument('--workers', type=int, help='worker processes (default one per core)')
+    parser.add_argument('--no-plots', dest='plots', action='store_false', help='write only the CSV files')
+    parser.add_argument('--immutable', action='store_true', help='open the database as immutable')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+
+    def progress(done, total):
+        rate = done / (time.perf_counter() - started)
+        print(f"\r  {done}/{total} stations ({rate:.1f}/s)", end='', file=sys.stderr, flush=True)
+
+    result = generate_reports(args.db, args.output, args.station, args.year, args.workers, args.plots,
+                              args.immutable, progress)
+    print(file=sys.stderr)
+
+    print(f"{len(result.reports)} station reports written in {result.seconds:.1f}s, see {result.index}")
+    for stationName, error in sorted(result.failed.items()):
+        print(f"  **{stationName} failed: {error}")
+    return 1 if result.failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
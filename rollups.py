@@ -0,0 +1,191 @@
+##################################################################
+# rollups.py
+#
+# Overview: Materialized ridership rollups for the CTA L analysis app
+#   Ridership_Daily, Ridership_Monthly and Ridership_Yearly hold
+#   per-station sums of Num_Riders split by Type_of_Day, so the
+#   ridership commands never have to re-scan the full Ridership table.
+#   Rollup_State remembers the highest Ride_Date already folded in
+#   (the high-water mark) so a refresh only aggregates new rows, and
+#   the change count of stats_cache.py it last saw, so a refresh with
+#   nothing written since is a single lookup.
+#   rewind_rollups moves the mark back when older days are reloaded.
+##################################################################
+
+import sqlite3
+
+import stats_cache
+
+HIGH_WATER_MARK = 'high_water_mark'
+REFRESHED_VERSION = 'refreshed_version'
+
+ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Ridership_Daily (
+        Station_ID INTEGER NOT NULL,
+        Ride_Day TEXT NOT NULL,
+        Type_of_Day TEXT NOT NULL,
+        Num_Riders INTEGER NOT NULL,
+        PRIMARY KEY (Station_ID, Ride_Day, Type_of_Day)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS Ridership_Monthly (
+        Station_ID INTEGER NOT NULL,
+        Year TEXT NOT NULL,
+        Month TEXT NOT NULL,
+        Type_of_Day TEXT NOT NULL,
+        Num_Riders INTEGER NOT NULL,
+        PRIMARY KEY (Station_ID, Year, Month, Type_of_Day)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS Ridership_Yearly (
+        Station_ID INTEGER NOT NULL,
+        Year TEXT NOT NULL,
+        Type_of_Day TEXT NOT NULL,
+        Num_Riders INTEGER NOT NULL,
+        PRIMARY KEY (Station_ID, Year, Type_of_Day)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS Rollup_State (
+        Name TEXT PRIMARY KEY,
+        Value TEXT
+    );
+"""
+
+#each rollup folds the Ridership rows in (low, high] into its totals,
+#adding onto any bucket that already exists
+ROLLUP_REFRESH = [
+    """
+    INSERT INTO Ridership_Daily (Station_ID, Ride_Day, Type_of_Day, Num_Riders)
+    SELECT Station_ID, DATE(Ride_Date), Type_of_Day, SUM(Num_Riders)
+    FROM Ridership
+    WHERE Ride_Date > ? AND Ride_Date <= ?
+    GROUP BY Station_ID, DATE(Ride_Date), Type_of_Day
+    ON CONFLICT (Station_ID, Ride_Day, Type_of_Day)
+    DO UPDATE SET Num_Riders = Num_Riders + excluded.Num_Riders
+    """,
+    """
+    INSERT INTO Ridership_Monthly (Station_ID, Year, Month, Type_of_Day, Num_Riders)
+    SELECT Station_ID, strftime('%Y', Ride_Date), strftime('%m', Ride_Date), Type_of_Day, SUM(Num_Riders)
+    FROM Ridership
+    WHERE Ride_Date > ? AND Ride_Date <= ?
+    GROUP BY Station_ID, strftime('%Y', Ride_Date), strftime('%m', Ride_Date), Type_of_Day
+    ON CONFLICT (Station_ID, Year, Month, Type_of_Day)
+    DO UPDATE SET Num_Riders = Num_Riders + excluded.Num_Riders
+    """,
+    """
+    INSERT INTO Ridership_Yearly (Station_ID, Year, Type_of_Day, Num_Riders)
+    SELECT Station_ID, strftime('%Y', Ride_Date), Type_of_Day, SUM(Num_Riders)
+    FROM Ridership
+    WHERE Ride_Date > ? AND Ride_Date <= ?
+    GROUP BY Station_ID, strftime('%Y', Ride_Date), Type_of_Day
+    ON CONFLICT (Station_ID, Year, Type_of_Day)
+    DO UPDATE SET Num_Riders = Num_Riders + excluded.Num_Riders
+    """,
+]
+
+##################################################################
+#
+# get_high_water_mark
+#
+# Returns the last Ride_Date folded into the rollups, or None if
+# the rollups have never been built.
+#
+def get_high_water_mark(dbConn):
+    return _get_state(dbConn, HIGH_WATER_MARK)
+
+#Value of a Rollup_State entry, None if unset
+def _get_state(dbConn, name):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT Value FROM Rollup_State WHERE Name = ?", (name,))
+    row = dbCursor.fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+#sets a Rollup_State entry, in the caller's transaction
+def _set_state(dbConn, name, value):
+    dbConn.execute("""
+        INSERT INTO Rollup_State (Name, Value) VALUES (?, ?)
+        ON CONFLICT (Name) DO UPDATE SET Value = excluded.Value
+    """, (name, value))
+
+##################################################################
+#
+# refresh_rollups
+#
+# Creates the rollup tables if missing and folds every Ridership row
+# newer than the high-water mark into them, all in one transaction.
+# Assumes each day's rows land together, which is how the CTA
+# publishes them. Finding the newest Ride_Date scans the whole
+# (Station_ID, Ride_Date) index, so it is skipped when the change
+# count hasn't moved since the last refresh. Returns the number of
+# new Ridership rows folded in.
+#
+def refresh_rollups(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.executescript(ROLLUP_SCHEMA)
+
+    version = stats_cache.change_count(dbConn)
+    if version is not None and _get_state(dbConn, REFRESHED_VERSION) == str(version):
+        return 0
+
+    oldMark = get_high_water_mark(dbConn)
+
+    dbCursor.execute("SELECT MAX(Ride_Date) FROM Ridership")
+    newMark = dbCursor.fetchone()[0]
+
+    #empty table or nothing newer than what is already rolled up
+    if newMark is None or (oldMark is not None and newMark <= oldMark):
+        if version is not None:
+            _set_state(dbConn, REFRESHED_VERSION, str(version))
+            dbConn.commit()
+        return 0
+
+    #'' sorts before every date, so a first build takes all rows
+    low = oldMark if oldMark is not None else ''
+
+    try:
+        dbCursor.execute("SELECT COUNT(*) FROM Ridership WHERE Ride_Date > ? AND Ride_Date <= ?", (low, newMark))
+        newRows = dbCursor.fetchone()[0]
+
+        for query in ROLLUP_REFRESH:
+            dbCursor.execute(query, (low, newMark))
+
+        _set_state(dbConn, HIGH_WATER_MARK, newMark)
+        if version is not None:
+            _set_state(dbConn, REFRESHED_VERSION, str(version))
+        dbConn.commit()
+    except sqlite3.Error:
+        dbConn.rollback()
+        raise
+
+    return newRows
+
+##################################################################
+#
+# rewind_rollups
+#
+# Removes every rollup bucket from fromDate's year onward and moves
+# the high-water mark back to the last Ride_Date before that year, so
+# the next refresh_rollups re-aggregates those years from Ridership.
+# Used when rows at or before the high-water mark were replaced.
+# Expects the rollups to have been built and does not commit, so it
+# can share the caller's transaction.
+#
+def rewind_rollups(dbConn, fromDate):
+    dbCursor = dbConn.cursor()
+
+    year = fromDate[:4]
+    yearStart = f"{year}-01-01"
+
+    dbCursor.execute("DELETE FROM Ridership_Daily WHERE Ride_Day >= ?", (yearStart,))
+    dbCursor.execute("DELETE FROM Ridership_Monthly WHERE Year >= ?", (year,))
+    dbCursor.execute("DELETE FROM Ridership_Yearly WHERE Year >= ?", (year,))
+
+    dbCursor.execute("DELETE FROM Rollup_State WHERE Name = ?", (REFRESHED_VERSION,))
+    dbCursor.execute("SELECT MAX(Ride_Date) FROM Ridership WHERE Ride_Date < ?", (yearStart,))
+    mark = dbCursor.fetchone()[0]
+    if mark is None:
+        dbCursor.execute("DELETE FROM Rollup_State WHERE Name = ?", (HIGH_WATER_MARK,))
+    else:
+        dbCursor.execute("UPDATE Rollup_State SET Value = ? WHERE Name = ?", (mark, HIGH_WATER_MARK))
@@ -0,0 +1,382 @@
+##################################################################
+# service.py
+#
+# Overview: Local HTTP JSON service for the CTA L analysis app
+#   Serves the batch.py query functions as GET endpoints, so dashboards
+#   can ask for rows without starting main.py per request. An asyncio
+#   server parses requests and hands each query to a thread pool, where
+#   every worker thread reads through its own read-only connection.
+#   Responses carry an ETag built from the database's data fingerprint,
+#   are cached under it, and a matching If-None-Match gets a 304.
+#   /metrics reports request counts and latency per endpoint. Only the
+#   standard library and the local database file are needed.
+#     python3 service.py --db CTA2_L_daily_ridership.db --port 8341
+#     curl 'localhost:8341/yearly?station=Howard'
+##################################################################
+
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import statistics
+import sys
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+import batch
+import columnar
+import database
+import partitions
+import prefix_index
+import ranking
+import rollups
+import stats_cache
+
+#responses kept, keyed by ETag
+RESPONSE_CACHE_SIZE = 256
+
+#latencies kept per endpoint for the metrics percentiles
+LATENCY_WINDOW = 1000
+
+MAX_HEADER_BYTES = 16384
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+#raised for bad query parameters, answered with a 400
+class BadRequest(ValueError):
+    pass
+
+##################################################################
+#
+# query parameters
+#
+# params is parse_qs output, {name: [values]}.
+#
+def _strings(params, name, required=False):
+    values = params.get(name, [])
+    if required and not values:
+        raise BadRequest(f"missing parameter {name!r}")
+    return values
+
+def _ints(params, name, required=False):
+    values = _strings(params, name, required)
+    try:
+        return [int(value) for value in values]
+    except ValueError:
+        raise BadRequest(f"parameter {name!r} must be a whole number")
+
+def _float(params, name, default):
+    values = _strings(params, name)
+    try:
+        return float(values[-1]) if values else default
+    except ValueError:
+        raise BadRequest(f"parameter {name!r} must be a number")
+
+def _coordinates(params):
+    try:
+        return [batch.parse_coordinate(value) for value in _strings(params, 'coordinate', True)]
+    except argparse.ArgumentTypeError as error:
+        raise BadRequest(str(error))
+
+def _totals(dbConn, params):
+    dayType = (_strings(params, 'day_type') or ['W'])[-1]
+    if dayType not in ranking.DAY_TYPES:
+        raise BadRequest(f"day_type must be one of {', '.join(ranking.DAY_TYPES)}")
+    top = _ints(params, 'top')
+    return list(batch.total_ridership(dbConn, dayType, top[-1] if top else None))
+
+def _series(dbConn, params):
+    window = _ints(params, 'window')
+    granularity = (_strings(params, 'granularity') or ['month'])[-1]
+    try:
+        return batch.ridership_series(dbConn, _strings(params, 'station'), _strings(params, 'start', True)[-1],
+                                      _strings(params, 'end', True)[-1], granularity,
+                                      window[-1] if window else None, bool(_strings(params, 'yoy')))
+    except ValueError as error:
+        raise BadRequest(str(error))
+
+def _stats(dbConn, params):
+    stations, stops, rides, minDate, maxDate, total = stats_cache.get_stats(dbConn)
+    return {'stations': stations, 'stops': stops, 'ride_entries': rides,
+            'first_date': minDate, 'last_date': maxDate, 'total_riders': total}
+
+#path -> function(dbConn, params) returning the JSON body
+ENDPOINTS = {
+    '/search': lambda dbConn, params: batch.station_search(dbConn, _strings(params, 'pattern', True)),
+    '/percentage': lambda dbConn, params: batch.ridership_percentage(dbConn, _strings(params, 'station')),
+    '/totals': _totals,
+    '/line': lambda dbConn, params: batch.line_stops(dbConn, _strings(params, 'color', True),
+                                                     _strings(params, 'direction', True)),
+    '/colors': lambda dbConn, params: batch.stops_by_color(dbConn),
+    '/yearly': lambda dbConn, params: batch.yearly_ridership(dbConn, _strings(params, 'station')),
+    '/monthly': lambda dbConn, params: batch.monthly_ridership(dbConn, _strings(params, 'station'),
+                                                               _ints(params, 'year', True)),
+    '/daily': lambda dbConn, params: batch.daily_ridership(dbConn, _strings(params, 'station'),
+                                                           _ints(params, 'year', True)),
+    '/compare': lambda dbConn, params: batch.compare_stations(dbConn, _strings(params, 'station'),
+                                                              _ints(params, 'year', True)),
+    '/nearby': lambda dbConn, params: batch.nearby_stations(dbConn, _coordinates(params),
+                                                            _float(params, 'radius', 1.0)),
+    '/nearest': lambda dbConn, params: batch.nearest_stations(dbConn, _coordinates(params),
+                                                              (_ints(params, 'count') or [1])[-1]),
+    '/series': _series,
+    '/stats': _stats,
+}
+
+##################################################################
+#
+# Metrics
+#
+# Request count, error count and recent latencies of each endpoint.
+#
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self.started = time.time()
+
+    def _entry(self, endpoint):
+        return self._endpoints.setdefault(endpoint, {'requests': 0, 'errors': 0, 'not_modified': 0,
+                                                     'cache_hits': 0, 'latencies': []})
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            entry = self._entry(endpoint)
+            entry['requests'] += 1
+            if status >= 400:
+                entry['errors'] += 1
+            if status == 304:
+                entry['not_modified'] += 1
+            entry['latencies'].append(seconds * 1000)
+            del entry['latencies'][:-LATENCY_WINDOW]
+
+    def cache_hit(self, endpoint):
+        with self._lock:
+            self._entry(endpoint)['cache_hits'] += 1
+
+    #JSON-ready summary with p50 / p95 / max latency in milliseconds
+    def snapshot(self):
+        with self._lock:
+            endpoints = {}
+            for endpoint, entry in sorted(self._endpoints.items()):
+                latencies = sorted(entry['latencies'])
+                summary = {key: entry[key] for key in ('requests', 'errors', 'not_modified', 'cache_hits')}
+                if len(latencies) > 1:
+                    cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+                    summary.update(p50_ms=round(cuts[49], 3), p95_ms=round(cuts[94], 3))
+                elif latencies:
+                    summary.update(p50_ms=round(latencies[0], 3), p95_ms=round(latencies[0], 3))
+                if latencies:
+                    summary['max_ms'] = round(latencies[-1], 3)
+                endpoints[endpoint] = summary
+        return {'uptime_s': round(time.time() - self.started, 1), 'endpoints': endpoints}
+
+##################################################################
+#
+# QueryService
+#
+# Answers requests from a ConnectionPool on a thread pool of workers.
+#
+class QueryService:
+    def __init__(self, pool, workers=4):
+        self.pool = pool
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='query')
+        self.metrics = Metrics()
+        self._responses = OrderedDict()
+        self._responsesLock = threading.Lock()
+
+    #changes whenever rows are loaded, replaced or deleted or the rollups move
+    def data_version(self, dbConn):
+        return f"{stats_cache.data_fingerprint(dbConn)}/{rollups.get_high_water_mark(dbConn)}"
+
+    #runs on a worker: (status, body bytes, etag) for a request
+    def _answer(self, path, query, ifNoneMatch):
+        dbConn = self.pool.connection()
+        params = urllib.parse.parse_qs(query)
+        canonical = urllib.parse.urlencode(sorted(params.items()), doseq=True)
+        etag = '"' + hashlib.sha1(f"{self.data_version(dbConn)} {path}?{canonical}".encode()).hexdigest() + '"'
+
+        if etag in ifNoneMatch:
+            return 304, b"", etag
+
+        with self._responsesLock:
+            body = self._responses.get(etag)
+            if body is not None:
+                self._responses.move_to_end(etag)
+        if body is not None:
+            self.metrics.cache_hit(path)
+            return 200, body, etag
+
+        body = (json.dumps(ENDPOINTS[path](dbConn, params)) + "\n").encode()
+
+        with self._responsesLock:
+            self._responses[etag] = body
+            if len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+        return 200, body, etag
+
+    ##################################################################
+    #
+    # handle
+    #
+    # (status, body bytes, extra headers) for one GET request.
+    #
+    async def handle(self, method, target, headers):
+        start = time.perf_counter()
+        split = urllib.parse.urlsplit(target)
+        path = split.path.rstrip('/') or '/'
+
+        extra = {}
+        if method != 'GET':
+            status, body = 405, _error("only GET is supported")
+        elif path == '/metrics':
+            status, body = 200, (json.dumps(self.metrics.snapshot()) + "\n").encode()
+        elif path not in ENDPOINTS:
+            status, body = 404, _error(f"no endpoint {path}, try one of {', '.join(sorted(ENDPOINTS))}")
+        else:
+            ifNoneMatch = [tag.strip() for tag in headers.get('if-none-match', '').split(',') if tag.strip()]
+            loop = asyncio.get_running_loop()
+            try:
+                status, body, etag = await loop.run_in_executor(self.executor, self._answer,
+                                                                path, split.query, ifNoneMatch)
+                extra['ETag'] = etag
+            except BadRequest as error:
+                status, body = 400, _error(str(error))
+            except Exception as error:
+                status, body = 500, _error(f"{type(error).__name__}: {error}")
+
+        if path != '/metrics':
+            self.metrics.record(path if path in ENDPOINTS else 'other', status, time.perf_counter() - start)
+        return status, body, extra
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+
+def _error(message):
+    return (json.dumps({'error': message}) + "\n").encode()
+
+#request line and headers, None when the client has gone away
+async def _read_request(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        return None
+
+    lines = head.decode('latin-1').split("\r\n")
+    parts = lines[0].split()
+    if len(parts) != 3:
+        return None
+    method, target, version = parts
+
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, target, version, headers
+
+##################################################################
+#
+# serve_client
+#
+# Answers requests on one connection until the client closes it or
+# asks to (HTTP/1.1 keep-alive, so load tests can reuse connections).
+#
+async def serve_client(service, reader, writer):
+    try:
+        while True:
+            request = await _read_request(reader)
+            if request is None:
+                break
+            method, target, version, headers = request
+
+            #a request body is never used, skip it
+            length = int(headers.get('content-length', 0) or 0)
+            if length:
+                await reader.readexactly(length)
+
+            status, body, extra = await service.handle(method, target, headers)
+            keepAlive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+            response = [f"HTTP/1.1 {status} {STATUS_TEXT[status]}",
+                        "Content-Type: application/json",
+                        f"Content-Length: {len(body)}",
+                        f"Connection: {'keep-alive' if keepAlive else 'close'}"]
+            response += [f"{name}: {value}" for name, value in extra.items()]
+            writer.write(("\r\n".join(response) + "\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+
+            if not keepAlive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+##################################################################
+#
+# run_server
+#
+# Serves until cancelled. ready, if given, is called with the bound
+# (host, port) once the server accepts connections.
+#
+async def run_server(service, host='127.0.0.1', port=8341, ready=None):
+    server = await asyncio.start_server(lambda reader, writer: serve_client(service, reader, writer),
+                                        host, port, limit=MAX_HEADER_BYTES)
+    if ready is not None:
+        ready(server.sockets[0].getsockname()[:2])
+    async with server:
+        await server.serve_forever()
+
+##################################################################
+#
+# main
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the CTA L analysis queries as JSON over HTTP.')
+    parser.add_argument('--db', default=database.DB_FILE, help='ridership database file')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8341, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=4, help='threads running queries')
+    parser.add_argument('--immutable', action='store_true', help='treat the database as immutable while open')
+    parser.add_argument('--columnar', action='store_true', help='answer ridership queries from the NumPy columnar snapshot')
+    parser.add_argument('--prefix-index', action='store_true', help='answer ridership totals from the NumPy prefix-sum index')
+    parser.add_argument('--partitions', action='store_true', help='answer ridership by year from per-year database files')
+    parser.add_argument('--in-memory', action='store_true', help='copy the database into memory and query the copy')
+    parser.add_argument('--memory-from', type=batch.parse_day, help='with --in-memory, copy only ridership from this date')
+    parser.add_argument('--memory-to', type=batch.parse_day, help='with --in-memory, copy only ridership before this date')
+    args = parser.parse_args(argv)
+
+    pool = database.open_pool(args.db, args.immutable, args.in_memory, args.memory_from, args.memory_to)
+    if isinstance(pool, database.MemoryPool):
+        print(f"**{pool.describe()}", file=sys.stderr)
+    if args.columnar and columnar.enable(pool.connection()) is None:
+        print("**NumPy is not installed, using SQLite...", file=sys.stderr)
+    if args.prefix_index and prefix_index.enable(pool.connection()) is None:
+        print("**NumPy is not installed, using SQLite...", file=sys.stderr)
+    if args.partitions and partitions.enable(pool.connection()) is None:
+        print("**Year partitions need a database file, using SQLite...", file=sys.stderr)
+
+    service = QueryService(pool, args.workers)
+
+    def ready(address):
+        print(f"serving {args.db} on http://{address[0]}:{address[1]}/ ({', '.join(sorted(ENDPOINTS))}, /metrics)")
+
+    try:
+        asyncio.run(run_server(service, args.host, args.port, ready))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        columnar.disable()
+        prefix_index.disable()
+        partitions.disable()
+        service.close()
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
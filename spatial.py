@@ -0,0 +1,164 @@
+##################################################################
+# spatial.py
+#
+# Overview: Nearby-station lookups for the CTA L analysis app
+#   StationIndex buckets every stop into a fixed grid of lat/long cells
+#   so a search only measures the stops in the cells around the target.
+#   Distances are great-circle (haversine) miles, and each station is
+#   reported once, at its stop nearest the target. The shared index is
+#   rebuilt when the database or its data changes.
+##################################################################
+
+import math
+
+import stats_cache
+
+EARTH_RADIUS_MILES = 3958.8
+
+#miles per degree of latitude (longitude shrinks by cos(latitude))
+MILES_PER_DEGREE = 69.09
+
+#roughly half a mile a side around Chicago
+CELL_DEGREES = 0.01
+
+##################################################################
+#
+# haversine_miles
+#
+# Great-circle distance in miles between two lat/long points.
+#
+def haversine_miles(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+##################################################################
+#
+# StationIndex
+#
+# Grid index over stops. Built from (station id, station name,
+# latitude, longitude) rows, one per stop.
+#
+class StationIndex:
+    def __init__(self, stops, cellDegrees=CELL_DEGREES):
+        self.cellDegrees = cellDegrees
+        self.cells = {}
+        self.size = 0
+
+        for stationID, stationName, lat, lon in stops:
+            if lat is None or lon is None:
+                continue
+            self.cells.setdefault(self._cell(lat, lon), []).append((stationID, stationName, lat, lon))
+            self.size += 1
+
+        if self.cells:
+            rows = [row for row, _ in self.cells]
+            cols = [col for _, col in self.cells]
+            self.bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self.bounds = (0, -1, 0, -1)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cellDegrees), math.floor(lon / self.cellDegrees))
+
+    #collects the nearest stop of each station among the given cells
+    #into best, a dict of station id -> (distance, name, lat, lon)
+    def _measure(self, lat, lon, cells, best):
+        for cell in cells:
+            for stationID, stationName, stopLat, stopLon in self.cells.get(cell, ()):
+                distance = haversine_miles(lat, lon, stopLat, stopLon)
+                current = best.get(stationID)
+                if current is None or distance < current[0]:
+                    best[stationID] = (distance, stationName, stopLat, stopLon)
+
+    ##################################################################
+    #
+    # within
+    #
+    # Returns (distance, station name, latitude, longitude) for every
+    # station with a stop within radius miles of the point, nearest first.
+    #
+    def within(self, lat, lon, radius=1.0):
+        latSpan = radius / MILES_PER_DEGREE
+        lonSpan = radius / (MILES_PER_DEGREE * max(math.cos(math.radians(abs(lat) + latSpan)), 1e-6))
+
+        minRow, minCol = self._cell(lat - latSpan, lon - lonSpan)
+        maxRow, maxCol = self._cell(lat + latSpan, lon + lonSpan)
+        cells = [(row, col) for row in range(minRow, maxRow + 1) for col in range(minCol, maxCol + 1)]
+
+        best = {}
+        self._measure(lat, lon, cells, best)
+
+        return sorted(found for found in best.values() if found[0] <= radius)
+
+    ##################################################################
+    #
+    # nearest
+    #
+    # Returns the k stations nearest the point as (distance, station
+    # name, latitude, longitude), nearest first. Searches outward one
+    # ring of cells at a time until no unsearched cell can be closer.
+    #
+    def nearest(self, lat, lon, k=1):
+        if k <= 0 or self.size == 0:
+            return []
+
+        centerRow, centerCol = self._cell(lat, lon)
+        minRow, maxRow, minCol, maxCol = self.bounds
+        maxRing = max(abs(centerRow - minRow), abs(centerRow - maxRow), abs(centerCol - minCol), abs(centerCol - maxCol))
+
+        best = {}
+        ring = 0
+        while ring <= maxRing:
+            if ring == 0:
+                cells = [(centerRow, centerCol)]
+            else:
+                cells = [(centerRow + dr, centerCol + dc)
+                         for dr in range(-ring, ring + 1)
+                         for dc in range(-ring, ring + 1)
+                         if max(abs(dr), abs(dc)) == ring]
+            self._measure(lat, lon, cells, best)
+
+            #anything outside this ring is at least this many miles away
+            reach = ring * self.cellDegrees
+            guaranteed = reach * MILES_PER_DEGREE * math.cos(math.radians(min(abs(lat) + reach, 89.0)))
+
+            if len(best) >= k and sorted(found[0] for found in best.values())[k - 1] <= guaranteed:
+                break
+            ring += 1
+
+        return sorted(best.values())[:k]
+
+##################################################################
+#
+# load_station_index
+#
+# Builds a StationIndex over every stop in the database.
+#
+def load_station_index(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("""
+        SELECT s.Station_ID, s.Station_Name, st.Latitude, st.Longitude
+        FROM Stops st
+        JOIN Stations s ON st.Station_ID = s.Station_ID
+    """)
+    return StationIndex(dbCursor.fetchall())
+
+#(stats_cache.data_key, StationIndex) of the last database loaded
+_stationIndex = (None, None)
+
+##################################################################
+#
+# get_station_index
+#
+# Returns the shared StationIndex, building it on first use and
+# again whenever the database or its data changes.
+#
+def get_station_index(dbConn):
+    global _stationIndex
+    key = stats_cache.data_key(dbConn)
+    loadedKey, index = _stationIndex
+    if index is None or loadedKey != key:
+        index = load_station_index(dbConn)
+        _stationIndex = (key, index)
+    return index
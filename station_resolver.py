@@ -0,0 +1,178 @@
+##################################################################
+# station_resolver.py
+#
+# Overview: In-memory station name resolution for the CTA L analysis app
+#   StationResolver loads every station once and answers name lookups
+#   without going back to SQLite: exact names, SQL LIKE patterns
+#   (wildcards _ and %, case-insensitive like SQLite's LIKE), prefixes,
+#   and ranked "did you mean" suggestions from a trigram index for
+#   names that are misspelled or ambiguous. The shared resolver is
+#   reloaded when the database or its data changes.
+##################################################################
+
+import bisect
+import re
+
+import stats_cache
+
+##################################################################
+#
+# like_regex
+#
+# Compiles a SQL LIKE pattern into an equivalent case-insensitive regex.
+#
+def like_regex(pattern):
+    parts = []
+    for ch in pattern:
+        if ch == '%':
+            parts.append('.*')
+        elif ch == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(ch))
+    return re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+#trigrams of a name, padded so short names and word starts count
+def _trigrams(text):
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+##################################################################
+#
+# StationResolver
+#
+# Built from (Station_ID, Station_Name) rows. Lookups return
+# (Station_ID, Station_Name) pairs ordered by name, the same order
+# as ORDER BY Station_Name.
+#
+class StationResolver:
+    def __init__(self, rows):
+        #ordered like SQLite's default (binary) collation
+        self.stations = sorted(rows, key=lambda row: (row[1], row[0]))
+
+        self.byName = {}
+        for position, (_, stationName) in enumerate(self.stations):
+            self.byName.setdefault(stationName, []).append(position)
+
+        #lowercased names with positions, sorted for prefix searches
+        self.lowered = sorted((stationName.lower(), position)
+                              for position, (_, stationName) in enumerate(self.stations))
+        self.loweredKeys = [name for name, _ in self.lowered]
+
+        #trigram -> positions of the stations containing it
+        self.trigrams = {}
+        for position, (_, stationName) in enumerate(self.stations):
+            for gram in _trigrams(stationName):
+                self.trigrams.setdefault(gram, []).append(position)
+
+    def _rows(self, positions):
+        return [self.stations[position] for position in sorted(positions)]
+
+    #positions of stations whose lowercased name starts with prefix
+    def _prefix_positions(self, prefix):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.loweredKeys, prefix)
+        end = bisect.bisect_left(self.loweredKeys, prefix + '\U0010ffff')
+        return [position for _, position in self.lowered[start:end]]
+
+    ##################################################################
+    #
+    # exact
+    #
+    # Stations named exactly name (case-sensitive, like Station_Name = ?).
+    #
+    def exact(self, name):
+        return self._rows(self.byName.get(name, []))
+
+    ##################################################################
+    #
+    # prefix
+    #
+    # Stations whose name starts with prefix, ignoring case.
+    #
+    def prefix(self, prefix):
+        return self._rows(self._prefix_positions(prefix))
+
+    ##################################################################
+    #
+    # like
+    #
+    # Stations matching a SQL LIKE pattern, ignoring case. Only names
+    # sharing the pattern's literal prefix are tested against it, and a
+    # pattern that is just a prefix and % (the usual "Clark%") is
+    # answered by prefix without a regex.
+    #
+    def like(self, pattern):
+        literal = re.split(r'[%_]', pattern, maxsplit=1)[0]
+        if pattern == literal + '%':
+            return self.prefix(literal)
+        candidates = self._prefix_positions(literal)
+
+        #no wildcards, just a case-insensitive name
+        if literal == pattern:
+            return self._rows(position for position in candidates
+                              if self.stations[position][1].lower() == pattern.lower())
+
+        regex = like_regex(pattern)
+        return self._rows(position for position in candidates
+                          if regex.fullmatch(self.stations[position][1]))
+
+    ##################################################################
+    #
+    # suggest
+    #
+    # Up to limit stations ranked by trigram similarity to text
+    # (wildcards ignored), most similar first. Only stations sharing
+    # at least one trigram are considered.
+    #
+    def suggest(self, text, limit=5, among=None):
+        grams = _trigrams(text.replace('%', ' ').replace('_', ' ').strip())
+
+        shared = {}
+        for gram in grams:
+            for position in self.trigrams.get(gram, ()):
+                shared[position] = shared.get(position, 0) + 1
+
+        if among is not None:
+            allowed = {tuple(row) for row in among}
+            shared = {position: count for position, count in shared.items()
+                      if self.stations[position] in allowed}
+
+        scored = []
+        for position, count in shared.items():
+            stationGrams = len(_trigrams(self.stations[position][1]))
+            similarity = count / (len(grams) + stationGrams - count)
+            scored.append((-similarity, self.stations[position][1], position))
+
+        scored.sort()
+        return [self.stations[position] for _, _, position in scored[:limit]]
+
+##################################################################
+#
+# load_resolver
+#
+# Builds a StationResolver over every station in the database.
+#
+def load_resolver(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT Station_ID, Station_Name FROM Stations")
+    return StationResolver(dbCursor.fetchall())
+
+#(stats_cache.data_key, StationResolver) of the last database loaded
+_resolver = (None, None)
+
+##################################################################
+#
+# get_resolver
+#
+# Returns the shared StationResolver, loading it on first use and
+# again whenever the database or its data changes.
+#
+def get_resolver(dbConn):
+    global _resolver
+    key = stats_cache.data_key(dbConn)
+    loadedKey, resolver = _resolver
+    if resolver is None or loadedKey != key:
+        resolver = load_resolver(dbConn)
+        _resolver = (key, resolver)
+    return resolver
@@ -0,0 +1,206 @@
+##################################################################
+# stats_cache.py
+#
+# Overview: Cached general statistics for the CTA L analysis app
+#   The numbers print_stats shows at startup are stored in the
+#   Stats_Cache table next to a fingerprint of the data they were
+#   computed from. Startup only rescans Ridership when the fingerprint
+#   no longer matches, and then does so in a single pass.
+#   Data_Version counts every row inserted, updated or deleted in
+#   Stations, Stops, Lines, StopDetails and Ridership, kept up by
+#   triggers, so whatever writes the data (ingest.py, a sqlite3 shell)
+#   moves the fingerprint and the topology.py cache key.
+##################################################################
+
+import sqlite3
+
+STATS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Stats_Cache (
+        Fingerprint TEXT PRIMARY KEY,
+        Num_Stations INTEGER,
+        Num_Stops INTEGER,
+        Num_Ride_Entries INTEGER,
+        Min_Date TEXT,
+        Max_Date TEXT,
+        Total_Riders INTEGER
+    );
+"""
+
+#every statistic in one statement, Ridership is scanned once
+QUERY_STATS = """
+    SELECT
+        (SELECT COUNT(*) FROM Stations),
+        (SELECT COUNT(*) FROM Stops),
+        COUNT(*),
+        DATE(MIN(Ride_Date)),
+        DATE(MAX(Ride_Date)),
+        SUM(Num_Riders)
+    FROM Ridership
+"""
+
+#tables whose every row change moves Data_Version
+TRACKED_TABLES = ('Stations', 'Stops', 'Lines', 'StopDetails', 'Ridership')
+TRACKED_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+DATA_VERSION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Data_Version (
+        Id INTEGER PRIMARY KEY CHECK (Id = 1),
+        Version INTEGER NOT NULL
+    )
+"""
+
+DATA_VERSION_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS Data_Version_{table}_{event} AFTER {event} ON {table}
+    BEGIN
+        UPDATE Data_Version SET Version = Version + 1;
+    END
+"""
+
+##################################################################
+#
+# track_changes
+#
+# Creates Data_Version and its triggers if missing, committing them.
+# Needs a writable connection; checking costs one lookup when they
+# already exist.
+#
+def track_changes(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'Data_Version_%'")
+    if dbCursor.fetchone()[0] < len(TRACKED_TABLES) * len(TRACKED_EVENTS):
+        resume_tracking(dbConn)
+        dbConn.commit()
+
+##################################################################
+#
+# pause_tracking / resume_tracking / count_changes
+#
+# For bulk loads, where a trigger per row is a real cost: pause drops
+# a table's triggers, the loader adds the rows it changed with
+# count_changes, and resume creates any missing trigger again. None
+# of them commit, so all of it can share the load's transaction and
+# no other connection ever sees the triggers gone.
+#
+def pause_tracking(dbConn, table):
+    for event in TRACKED_EVENTS:
+        dbConn.execute(f"DROP TRIGGER IF EXISTS Data_Version_{table}_{event}")
+
+def resume_tracking(dbConn):
+    dbConn.execute(DATA_VERSION_SCHEMA)
+    dbConn.execute("INSERT OR IGNORE INTO Data_Version (Id, Version) VALUES (1, 0)")
+    for table in TRACKED_TABLES:
+        for event in TRACKED_EVENTS:
+            dbConn.execute(DATA_VERSION_TRIGGER.format(table=table, event=event))
+
+def count_changes(dbConn, changes):
+    dbConn.execute("UPDATE Data_Version SET Version = Version + ? WHERE Id = 1", (changes,))
+
+##################################################################
+#
+# change_count
+#
+# The number of row changes Data_Version has counted, or None if the
+# database has never been opened writable to create it.
+#
+def change_count(dbConn):
+    try:
+        row = dbConn.execute("SELECT Version FROM Data_Version WHERE Id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row is not None else None
+
+##################################################################
+#
+# data_fingerprint
+#
+# Summarizes the contents of the tracked tables as the Data_Version
+# change count plus the highest rowid of Stations, Stops and Ridership.
+# The count moves with every insert, update and delete, including
+# rows deleted and re-inserted under the same rowids; the rowids
+# cover databases that haven't had the triggers created yet. Costs
+# one index lookup per table. The file's mtime/size can't be used
+# because writing the cache changes both.
+#
+def data_fingerprint(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("""
+        SELECT
+            (SELECT MAX(rowid) FROM Stations),
+            (SELECT MAX(rowid) FROM Stops),
+            (SELECT MAX(rowid) FROM Ridership)
+    """)
+    return "/".join(str(value) for value in (change_count(dbConn),) + dbCursor.fetchone())
+
+##################################################################
+#
+# data_key
+#
+# (database file, data_fingerprint) of the data the shared in-memory
+# structures (station_resolver.py, spatial.py, topology.py) are built
+# from; they are rebuilt whenever it changes, so a long-running
+# process sees new data and a second database never gets the first
+# one's. The file is '' for a plain in-memory database.
+#
+def data_key(dbConn):
+    path = [row[2] for row in dbConn.execute("PRAGMA database_list") if row[1] == 'main'][0]
+    return (path, data_fingerprint(dbConn))
+
+##################################################################
+#
+# invalidate_stats
+#
+# Drops any cached statistics so the next get_stats recomputes them.
+#
+def invalidate_stats(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.executescript(STATS_SCHEMA)
+    dbCursor.execute("DELETE FROM Stats_Cache")
+    dbConn.commit()
+
+##################################################################
+#
+# get_stats
+#
+# Returns (# of stations, # of stops, # of ride entries, first date,
+# last date, total ridership), from the cache when the data is
+# unchanged and from a single-pass query otherwise.
+#
+def get_stats(dbConn):
+    dbCursor = dbConn.cursor()
+
+    #read-only connections use the cache if it exists but never write it
+    readOnly = dbCursor.execute("PRAGMA query_only").fetchone()[0]
+    if not readOnly:
+        dbCursor.executescript(STATS_SCHEMA)
+
+    fingerprint = data_fingerprint(dbConn)
+
+    try:
+        dbCursor.execute("""
+            SELECT Num_Stations, Num_Stops, Num_Ride_Entries, Min_Date, Max_Date, Total_Riders
+            FROM Stats_Cache
+            WHERE Fingerprint = ?
+        """, (fingerprint,))
+        cached = dbCursor.fetchone()
+    except sqlite3.OperationalError:
+        #no Stats_Cache table, only possible when read-only
+        cached = None
+
+    if cached is not None:
+        return cached
+
+    dbCursor.execute(QUERY_STATS)
+    stats = dbCursor.fetchone()
+
+    if readOnly:
+        return stats
+
+    try:
+        dbCursor.execute("DELETE FROM Stats_Cache")
+        dbCursor.execute("INSERT INTO Stats_Cache VALUES (?, ?, ?, ?, ?, ?, ?)", (fingerprint,) + stats)
+        dbConn.commit()
+    except sqlite3.Error:
+        dbConn.rollback()
+        raise
+
+    return stats
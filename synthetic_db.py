@@ -0,0 +1,180 @@
+##################################################################
+# synthetic_db.py
+#
+# Overview: Synthetic CTA ridership database generator
+#   Writes a database with the same Stations / Stops / StopDetails /
+#   Lines / Ridership schema as CTA2_L_daily_ridership.db, at any scale,
+#   for benchmarking. Output is deterministic for a given seed.
+#     python3 synthetic_db.py bench.db --stations 150 --years 25
+#     python3 synthetic_db.py huge.db --stations 10000 --years 50
+##################################################################
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+SCHEMA = """
+    CREATE TABLE Stations (
+        Station_ID INTEGER PRIMARY KEY,
+        Station_Name TEXT NOT NULL
+    );
+
+    CREATE TABLE Lines (
+        Line_ID INTEGER PRIMARY KEY,
+        Color TEXT NOT NULL
+    );
+
+    CREATE TABLE Stops (
+        Stop_ID INTEGER PRIMARY KEY,
+        Station_ID INTEGER NOT NULL,
+        Stop_Name TEXT NOT NULL,
+        Direction TEXT NOT NULL,
+        ADA INTEGER NOT NULL,
+        Latitude REAL,
+        Longitude REAL
+    );
+
+    CREATE TABLE StopDetails (
+        Stop_ID INTEGER NOT NULL,
+        Line_ID INTEGER NOT NULL,
+        PRIMARY KEY (Stop_ID, Line_ID)
+    );
+
+    CREATE TABLE Ridership (
+        Station_ID INTEGER NOT NULL,
+        Ride_Date TEXT NOT NULL,
+        Type_of_Day TEXT NOT NULL,
+        Num_Riders INTEGER NOT NULL,
+        PRIMARY KEY (Station_ID, Ride_Date)
+    );
+"""
+
+COLORS = ['Red', 'Blue', 'Green', 'Brown', 'Purple', 'Purple-Express', 'Yellow', 'Pink', 'Orange']
+
+#the area covered by chicago.png
+MIN_LAT, MAX_LAT = 41.7012, 42.0868
+MIN_LON, MAX_LON = -87.9277, -87.5569
+
+#fixed-date holidays ridden on a Sunday schedule
+HOLIDAYS = {(1, 1), (7, 4), (12, 25)}
+
+BATCH_SIZE = 50_000
+
+STREET_NAMES = ['Clark', 'Lake', 'State', 'Damen', 'Western', 'Halsted', 'Ashland', 'Pulaski',
+                'Kedzie', 'Cicero', 'Central', 'Harlem', 'Belmont', 'Fullerton', 'Division',
+                'Chicago', 'Grand', 'Addison', 'Irving Park', 'Montrose', 'Lawrence', 'Foster']
+
+#a unique, readable station name for station number i
+def station_name(i):
+    first = STREET_NAMES[i % len(STREET_NAMES)]
+    second = STREET_NAMES[(i // len(STREET_NAMES)) % len(STREET_NAMES)]
+    suffix = i // (len(STREET_NAMES) ** 2)
+    name = f"{first}/{second}" if first != second else first
+    return f"{name} {suffix + 1}" if suffix else name
+
+#W (weekday), A (saturday) or U (sunday/holiday) for a date
+def type_of_day(day):
+    if (day.month, day.day) in HOLIDAYS or day.weekday() == 6:
+        return 'U'
+    if day.weekday() == 5:
+        return 'A'
+    return 'W'
+
+##################################################################
+#
+# generate_database
+#
+# Creates path (which must not exist) with numStations stations and
+# daily ridership for numYears years starting January 1 of startYear.
+# Returns the number of Ridership rows written.
+#
+def generate_database(path, numStations=150, numYears=25, startYear=2001, seed=341):
+    if os.path.exists(path):
+        raise FileExistsError(path)
+
+    rng = random.Random(seed)
+    dbConn = sqlite3.connect(path)
+    dbCursor = dbConn.cursor()
+
+    #bulk load speed over durability, the file is disposable
+    dbCursor.execute("PRAGMA journal_mode = OFF")
+    dbCursor.execute("PRAGMA synchronous = OFF")
+    dbCursor.executescript(SCHEMA)
+
+    dbCursor.executemany("INSERT INTO Lines VALUES (?, ?)", list(enumerate(COLORS, start=1)))
+
+    stationIDs = []
+    baseRiders = []
+    stopID = 30000
+    for i in range(numStations):
+        stationID = 40000 + i * 10
+        name = station_name(i)
+        stationIDs.append(stationID)
+        baseRiders.append(rng.lognormvariate(7.5, 0.8))
+        dbCursor.execute("INSERT INTO Stations VALUES (?, ?)", (stationID, name))
+
+        lat = rng.uniform(MIN_LAT, MAX_LAT)
+        lon = rng.uniform(MIN_LON, MAX_LON)
+        ada = 1 if rng.random() < 0.7 else 0
+        lines = rng.sample(range(1, len(COLORS) + 1), 1 if rng.random() < 0.8 else 2)
+        directions = ('N', 'S') if rng.random() < 0.6 else ('E', 'W')
+
+        for direction in directions:
+            stopID += 1
+            bound = {'N': 'Northbound', 'S': 'Southbound', 'E': 'Eastbound', 'W': 'Westbound'}[direction]
+            dbCursor.execute("INSERT INTO Stops VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (stopID, stationID, f"{name} ({bound})", direction, ada, lat, lon))
+            dbCursor.executemany("INSERT INTO StopDetails VALUES (?, ?)", [(stopID, line) for line in lines])
+
+    dayFactor = {'W': 1.0, 'A': 0.55, 'U': 0.4}
+    first = datetime.date(startYear, 1, 1)
+    last = datetime.date(startYear + numYears, 1, 1)
+
+    def ridership_rows():
+        day = first
+        while day < last:
+            rideDate = day.isoformat() + " 00:00:00.000"
+            dayType = type_of_day(day)
+            factor = dayFactor[dayType]
+            for stationID, base in zip(stationIDs, baseRiders):
+                yield (stationID, rideDate, dayType, int(base * factor * rng.uniform(0.8, 1.2)))
+            day += datetime.timedelta(days=1)
+
+    rows = ridership_rows()
+    written = 0
+    while True:
+        batch = [row for _, row in zip(range(BATCH_SIZE), rows)]
+        if not batch:
+            break
+        dbCursor.executemany("INSERT INTO Ridership VALUES (?, ?, ?, ?)", batch)
+        written += len(batch)
+
+    dbConn.commit()
+    dbConn.close()
+    return written
+
+##################################################################
+#
+# main
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic CTA ridership database.')
+    parser.add_argument('path', help='database file to create')
+    parser.add_argument('--stations', type=int, default=150, help='number of stations')
+    parser.add_argument('--years', type=int, default=25, help='years of daily ridership')
+    parser.add_argument('--start-year', type=int, default=2001, help='first year of ridership')
+    parser.add_argument('--seed', type=int, default=341, help='random seed')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    rows = generate_database(args.path, args.stations, args.years, args.start_year, args.seed)
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.path}: {args.stations:,} stations, {rows:,} ride entries in {elapsed:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,61 @@
+##################################################################
+# test_daily_matrix.py
+#
+# Overview: Regression test for command 8's daily matrix over many stations
+#   daily_matrix must not need a result column per station: SQLite
+#   allows at most 2000, and compare defaults to every station. The
+#   limit is lowered here so a few stations are already too many for
+#   one column each.
+#     python3 -m pytest test_daily_matrix.py
+##################################################################
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import columnar
+import database
+import queries
+import synthetic_db
+
+class ManyStationsTest(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, 'ridership.db')
+        synthetic_db.generate_database(self.path, 6, 1)
+        database.prepare_database(self.path)
+
+    def tearDown(self):
+        columnar.disable()
+        queries.clear_cache()
+        shutil.rmtree(self.scratch)
+
+    def test_matrix_wider_than_the_column_limit(self):
+        with database.ConnectionPool(self.path) as pool:
+            dbConn = pool.connection()
+            dbConn.setlimit(sqlite3.SQLITE_LIMIT_COLUMN, 4)
+            stations = queries.match_stations(dbConn, ())
+            stations = stations + stations[:1]
+
+            #{date: {Station_ID: riders}} straight from Ridership
+            expected = {}
+            for rideDate, stationID, riders in dbConn.execute(
+                    "SELECT DATE(Ride_Date), Station_ID, Num_Riders FROM Ridership"):
+                day = expected.setdefault(rideDate, {})
+                day[stationID] = day.get(stationID, 0) + riders
+
+            queries.clear_cache()
+            matrix = queries.daily_matrix(dbConn, stations, '2001')
+            self.assertEqual(matrix.dates, tuple(sorted(expected)))
+            self.assertEqual(matrix.riders, tuple(tuple(expected[rideDate].get(station.station_id)
+                                                      for station in stations)
+                                                for rideDate in matrix.dates))
+
+            if columnar.enable(dbConn) is not None:
+                queries.clear_cache()
+                self.assertEqual(queries.daily_matrix(dbConn, stations, '2001'), matrix)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+##################################################################
+# test_ingest.py
+#
+# Overview: Regression test for re-ingesting days already loaded
+#   Replacing existing days deletes their rows and inserts new ones,
+#   which can reuse the same rowids. Every engine that keeps a
+#   snapshot next to the database (columnar.py, prefix_index.py,
+#   partitions.py) must notice and answer the same as plain SQL.
+#     python3 -m pytest test_ingest.py
+##################################################################
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import columnar
+import database
+import ingest
+import partitions
+import prefix_index
+import queries
+import stats_cache
+import synthetic_db
+
+#(name, enable, disable) of each engine with a snapshot on disk
+ENGINES = [
+    ('columnar', columnar.enable, columnar.disable),
+    ('prefix index', prefix_index.enable, prefix_index.disable),
+    ('partitions', partitions.enable, partitions.disable),
+]
+
+class ReplacedDaysTest(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, 'ridership.db')
+        synthetic_db.generate_database(self.path, 4, 2)
+
+    def tearDown(self):
+        for _, _, disable in ENGINES:
+            disable()
+        queries.clear_cache()
+        shutil.rmtree(self.scratch)
+
+    #the answers of the ridership commands, with enable(dbConn) routing
+    #them to an engine, or plain SQL when enable is None
+    def answers(self, enable=None):
+        with database.ConnectionPool(self.path) as pool:
+            dbConn = pool.connection()
+            if enable is not None and enable(dbConn) is None:
+                self.skipTest("engine not available")
+            try:
+                queries.clear_cache()
+                stations = queries.match_stations(dbConn, ())
+                return (queries.ridership_split(dbConn, stations),
+                        queries.yearly_ridership(dbConn, stations),
+                        queries.monthly_ridership(dbConn, stations, '2002'),
+                        queries.range_split(dbConn, stations, '2002-06-01', '2003-01-01'),
+                        queries.daily_matrix(dbConn, stations[:2], '2002'))
+            finally:
+                for _, _, disable in ENGINES:
+                    disable()
+
+    #loads riders for (Station_ID, 'YYYY-MM-DD') entries already in the database
+    def replace_entries(self, entries, riders):
+        csvPath = os.path.join(self.scratch, 'replace.csv')
+        with open(csvPath, 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(['station_id', 'stationname', 'date', 'daytype', 'rides'])
+            for stationID, day in entries:
+                writer.writerow([stationID, 'Replaced', day, 'W', riders])
+        with open(csvPath, newline='') as csvFile:
+            result = ingest.ingest_csv(self.path, csvFile)
+        self.assertEqual(result.replaced, len(entries))
+
+    def test_engines_match_sql_after_replacing_days(self):
+        database.prepare_database(self.path)
+        with database.ConnectionPool(self.path) as pool:
+            dbConn = pool.connection()
+            #the newest rows, whose rowids the replacements will reuse
+            entries = dbConn.execute("""
+                SELECT Station_ID, DATE(Ride_Date) FROM Ridership ORDER BY rowid DESC LIMIT 4
+            """).fetchall()
+            before = stats_cache.data_fingerprint(dbConn)
+            maxRowid = dbConn.execute("SELECT MAX(rowid) FROM Ridership").fetchone()[0]
+
+        for name, enable, _ in ENGINES:
+            with self.subTest(engine=name):
+                self.assertEqual(self.answers(enable), self.answers())
+
+        self.replace_entries(entries, 1_000_000)
+
+        with database.ConnectionPool(self.path) as pool:
+            dbConn = pool.connection()
+            self.assertEqual(dbConn.execute("SELECT MAX(rowid) FROM Ridership").fetchone()[0], maxRowid)
+            self.assertNotEqual(stats_cache.data_fingerprint(dbConn), before)
+
+        expected = self.answers()
+        self.assertGreater(max(series.riders[-1] for series in expected[1]), 1_000_000)
+        for name, enable, _ in ENGINES:
+            with self.subTest(engine=name):
+                self.assertEqual(self.answers(enable), expected)
+
+if __name__ == '__main__':
+    unittest.main()
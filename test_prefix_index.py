@@ -0,0 +1,90 @@
+##################################################################
+# test_prefix_index.py
+#
+# Overview: Regression test for the prefix-sum index layout
+#   Each station's running totals start on its own first ride date
+#   instead of every station having a row for every day, and days
+#   loaded later are appended as new blocks without a rebuild. Both
+#   must answer the same as plain SQL.
+#     python3 -m pytest test_prefix_index.py
+##################################################################
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+import database
+import ingest
+import prefix_index
+import synthetic_db
+
+#{Station_ID: (total, weekday, saturday, sunday)} over [start, end)
+QUERY_SPLIT = """
+    SELECT Station_ID, SUM(Num_Riders),
+           SUM(CASE WHEN Type_of_Day = 'W' THEN Num_Riders ELSE 0 END),
+           SUM(CASE WHEN Type_of_Day = 'A' THEN Num_Riders ELSE 0 END),
+           SUM(CASE WHEN Type_of_Day = 'U' THEN Num_Riders ELSE 0 END)
+    FROM Ridership
+    WHERE Ride_Date >= ? AND Ride_Date < ?
+    GROUP BY Station_ID
+"""
+
+@unittest.skipUnless(prefix_index.available(), "NumPy is not installed")
+class PrefixIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, 'ridership.db')
+        synthetic_db.generate_database(self.path, 4, 2)
+        database.prepare_database(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    def assertMatchesSQL(self, index, dbConn, start, end):
+        expected = {row[0]: row[1:] for row in dbConn.execute(QUERY_SPLIT, (start, end))}
+        self.assertEqual(index.range_sums(tuple(index.codes), start, end), expected)
+
+    def test_station_blocks_and_appended_days(self):
+        dbConn = database.open_database(self.path)
+        try:
+            #a station whose ridership starts a year late
+            late = dbConn.execute("SELECT MIN(Station_ID) FROM Stations").fetchone()[0]
+            dbConn.execute("DELETE FROM Ridership WHERE Station_ID = ? AND Ride_Date < '2002-01-01'", (late,))
+            dbConn.commit()
+
+            index = prefix_index.open_index(dbConn)
+            spans = dbConn.execute("""
+                SELECT SUM(julianday(Last) - julianday(First) + 2) FROM (
+                    SELECT MIN(DATE(Ride_Date)) AS First, MAX(DATE(Ride_Date)) AS Last
+                    FROM Ridership GROUP BY Station_ID)
+            """).fetchone()[0]
+            self.assertEqual(len(index.cumulative), spans)
+            self.assertMatchesSQL(index, dbConn, '2001-03-01', '2002-08-15')
+            self.assertMatchesSQL(index, dbConn, '1990-01-01', '2030-01-01')
+        finally:
+            dbConn.close()
+
+        csvPath = os.path.join(self.scratch, 'new_days.csv')
+        with open(csvPath, 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(['station_id', 'stationname', 'date', 'daytype', 'rides'])
+            for stationID in index.codes:
+                writer.writerow([stationID, 'Appended', '01/03/2003', 'W', 1000])
+            writer.writerow([late, 'Appended', '01/06/2003', 'A', 250])
+        with open(csvPath, newline='') as csvFile:
+            ingest.ingest_csv(self.path, csvFile)
+
+        dbConn = database.open_database(self.path)
+        try:
+            extended = prefix_index.open_index(dbConn)
+            self.assertEqual(len(extended.blocks), len(index.blocks) + len(index.codes))
+            self.assertEqual(len(extended.cumulative), len(index.cumulative) + 2 * len(index.codes) + 3)
+            self.assertMatchesSQL(extended, dbConn, '2002-12-01', '2003-01-05')
+            self.assertMatchesSQL(extended, dbConn, '1990-01-01', '2030-01-01')
+        finally:
+            dbConn.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+##################################################################
+# test_shared_data.py
+#
+# Overview: Regression test for the shared in-memory lookups
+#   The station resolver, the spatial index and the transit topology
+#   are built once and shared by every connection. A process that
+#   keeps running (service.py) must see stations and stops change,
+#   and a second database opened in it must get its own stations.
+#     python3 -m pytest test_shared_data.py
+##################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import database
+import queries
+import synthetic_db
+
+class SharedDataTest(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.paths = []
+        for numStations in (4, 6):
+            path = os.path.join(self.scratch, f'ridership{numStations}.db')
+            synthetic_db.generate_database(path, numStations, 1)
+            database.prepare_database(path)
+            self.paths.append(path)
+
+    def tearDown(self):
+        queries.clear_cache()
+        shutil.rmtree(self.scratch)
+
+    #(station names, nearest station name, stop names of the first line
+    #and direction) as answered on dbConn
+    def answers(self, dbConn):
+        queries.clear_cache()
+        colorCount = queries.stops_per_color(dbConn)[0]
+        lineID = queries.line_id(dbConn, colorCount.color)
+        return (tuple(station.station_name for station in queries.match_stations(dbConn, ())),
+                queries.nearest_stations(dbConn, 41.88, -87.63)[0].station_name,
+                tuple(stop.stop_name for stop in queries.line_stops(dbConn, lineID, colorCount.direction)))
+
+    def test_two_databases_in_one_process(self):
+        with database.ConnectionPool(self.paths[0]) as first, database.ConnectionPool(self.paths[1]) as second:
+            firstNames = self.answers(first.connection())[0]
+            secondNames = self.answers(second.connection())[0]
+            self.assertEqual(len(firstNames), 4)
+            self.assertEqual(len(secondNames), 6)
+            self.assertEqual(self.answers(first.connection())[0], firstNames)
+
+    def test_updates_seen_by_an_open_pool(self):
+        with database.ConnectionPool(self.paths[0]) as pool:
+            before = self.answers(pool.connection())
+
+            dbConn = database.open_database(self.paths[0])
+            try:
+                dbConn.execute("UPDATE Stations SET Station_Name = Station_Name || ' (renamed)'")
+                dbConn.execute("UPDATE Stops SET Stop_Name = Stop_Name || ' (renamed)'")
+                dbConn.commit()
+            finally:
+                dbConn.close()
+
+            names, nearest, stops = self.answers(pool.connection())
+            self.assertEqual(set(names), {name + ' (renamed)' for name in before[0]})
+            self.assertEqual(nearest, before[1] + ' (renamed)')
+            self.assertEqual(stops, tuple(name + ' (renamed)' for name in before[2]))
+
+if __name__ == '__main__':
+    unittest.main()
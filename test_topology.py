@@ -0,0 +1,58 @@
+##################################################################
+# test_topology.py
+#
+# Overview: Regression test for the saved transit topology
+#   topology.py keeps the rows it is built from as JSON next to the
+#   database. Updating a stop in place changes no row count or rowid,
+#   so the copy must be keyed on the Data_Version change count for
+#   commands 4 and 5 to list the new stop names and ADA flags.
+#     python3 -m pytest test_topology.py
+##################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import database
+import synthetic_db
+import topology
+
+class UpdatedStopsTest(unittest.TestCase):
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.path = os.path.join(self.scratch, 'ridership.db')
+        synthetic_db.generate_database(self.path, 4, 1)
+        database.prepare_database(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.scratch)
+
+    #(color, direction, listing) of the first line and direction
+    def listing(self):
+        with database.ConnectionPool(self.path) as pool:
+            loaded = topology.load_topology(pool.connection())
+            colorCount = loaded.stops_per_color()[0]
+            lineID = loaded.line_id(colorCount.color)
+            return loaded.line_stops(lineID, colorCount.direction)
+
+    def test_listing_follows_updated_stops(self):
+        before = self.listing()
+        self.assertTrue(os.path.exists(os.path.splitext(self.path)[0] + '.topology.json'))
+        self.assertEqual(self.listing(), before)
+
+        dbConn = database.open_database(self.path)
+        try:
+            dbConn.execute("UPDATE Stops SET ADA = 1 - ADA, Stop_Name = Stop_Name || ' (renamed)'")
+            dbConn.commit()
+        finally:
+            dbConn.close()
+
+        after = self.listing()
+        self.assertEqual(len(after), len(before))
+        for old, new in zip(before, after):
+            self.assertEqual(new.stop_name, old.stop_name + ' (renamed)')
+            self.assertEqual(new.ada, not old.ada)
+
+if __name__ == '__main__':
+    unittest.main()
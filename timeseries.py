@@ -0,0 +1,270 @@
+##################################################################
+# timeseries.py
+#
+# Overview: Ridership time series for the CTA L analysis app
+#   ridership_series answers any set of stations over any date range
+#   at day, week, month, quarter or year granularity, optionally with
+#   a rolling mean over the last N periods and the change from the
+#   same period a year earlier. Daily totals come from one query on
+#   the Ridership_Daily rollup (or the columnar engine when enabled)
+#   and are bucketed, smoothed and differenced in a single pass, so
+#   every granularity costs the same one read. With NumPy the days
+#   are read as day numbers and the pass is done on arrays (np.add.at
+#   into periods, cumulative sums for the rolling mean), otherwise in
+#   plain Python.
+##################################################################
+
+import datetime
+from dataclasses import dataclass
+
+import columnar
+import queries
+
+GRANULARITIES = ('day', 'week', 'month', 'quarter', 'year')
+
+#daily totals of each station, by station then day
+QUERY_DAILY_TOTALS = """
+        SELECT Station_ID, Ride_Day, SUM(Num_Riders)
+        FROM Ridership_Daily
+        WHERE Station_ID IN ({stations}) AND Ride_Day >= ? AND Ride_Day < ?
+        GROUP BY Station_ID, Ride_Day
+        ORDER BY Station_ID ASC, Ride_Day ASC
+    """
+
+#the same as days since 1970-01-01, the epoch of numpy's datetime64[D]
+QUERY_DAILY_NUMBERS = """
+        SELECT Station_ID, CAST(julianday(Ride_Day) - 2440587.5 AS INTEGER), SUM(Num_Riders)
+        FROM Ridership_Daily
+        WHERE Station_ID IN ({stations}) AND Ride_Day >= ? AND Ride_Day < ?
+        GROUP BY Station_ID, Ride_Day
+    """
+
+#periods is one label per period, riders / rolling / yoy one row per
+#period with a value (or None) per station
+@dataclass(frozen=True, slots=True)
+class TimeSeries:
+    stations: tuple
+    granularity: str
+    window: int
+    periods: tuple
+    riders: tuple
+    rolling: tuple
+    yoy: tuple
+
+    #(periods, values) of one station for a field ('riders', 'rolling'
+    #or 'yoy'), including None gaps
+    def column(self, index, field='riders'):
+        return self.periods, tuple(row[index] for row in getattr(self, field))
+
+#first day of the period a date falls in
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'quarter':
+        return day.replace(month=(day.month - 1) // 3 * 3 + 1, day=1)
+    if granularity == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+#label of the period starting on day
+def period_label(day, granularity):
+    if granularity == 'month':
+        return f"{day.year:04d}-{day.month:02d}"
+    if granularity == 'quarter':
+        return f"{day.year:04d}-Q{(day.month - 1) // 3 + 1}"
+    if granularity == 'year':
+        return f"{day.year:04d}"
+    return day.isoformat()
+
+#start of the period after the one starting on day
+def next_period(day, granularity):
+    if granularity == 'day':
+        return day + datetime.timedelta(days=1)
+    if granularity == 'week':
+        return day + datetime.timedelta(days=7)
+    months = {'month': 1, 'quarter': 3, 'year': 12}[granularity]
+    month = day.month - 1 + months
+    return day.replace(year=day.year + month // 12, month=month % 12 + 1)
+
+#start of the same period a year earlier, None for February 29
+def year_before(day, granularity):
+    if granularity == 'week':
+        return day - datetime.timedelta(days=364)
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return None
+
+#{station id: {'YYYY-MM-DD': riders}} of daily totals in [start, end)
+def _daily_totals(dbConn, stationIDs, start, end):
+    found = {stationID: {} for stationID in stationIDs}
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(QUERY_DAILY_TOTALS.format(stations=", ".join("?" for _ in stationIDs)),
+                     stationIDs + (start, end))
+    for stationID, rideDay, riders in dbCursor:
+        found[stationID][rideDay] = riders
+    return found
+
+#(station ids, day numbers, riders) arrays of daily totals in [start,
+#end), from the columnar engine when enabled
+def _daily_numbers(dbConn, stationIDs, start, end):
+    np = columnar.np
+    engine = columnar.get_engine()
+    if engine is not None:
+        return engine.daily_numbers(stationIDs, start, end)
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(QUERY_DAILY_NUMBERS.format(stations=", ".join("?" for _ in stationIDs)),
+                     stationIDs + (start, end))
+    rows = np.array(dbCursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+#(sums, rolling, differences) rows of the periods starting on starts,
+#one pass per station in plain Python, for when NumPy is missing
+def _combine(daily, stationIDs, starts, position, granularity, window, yoy):
+    #one pass over each station's days, summing into its periods
+    sums = [[None] * len(stationIDs) for _ in starts]
+    periodOf = {}
+    for column, stationID in enumerate(stationIDs):
+        for rideDay, riders in daily[stationID].items():
+            index = periodOf.get(rideDay)
+            if index is None:
+                index = periodOf[rideDay] = position[period_start(datetime.date.fromisoformat(rideDay), granularity)]
+            current = sums[index][column]
+            sums[index][column] = riders if current is None else current + riders
+
+    #running sums over the last window periods, one pass per station
+    rolling = [[None] * len(stationIDs) for _ in starts]
+    if window is not None:
+        for column in range(len(stationIDs)):
+            total = count = 0
+            for index, row in enumerate(sums):
+                if row[column] is not None:
+                    total += row[column]
+                    count += 1
+                if index >= window:
+                    dropped = sums[index - window][column]
+                    if dropped is not None:
+                        total -= dropped
+                        count -= 1
+                if index >= window - 1 and count:
+                    rolling[index][column] = total / count
+
+    differences = [[None] * len(stationIDs) for _ in starts]
+    if yoy:
+        for index, periodStart in enumerate(starts):
+            earlier = position.get(year_before(periodStart, granularity))
+            if earlier is None:
+                continue
+            for column in range(len(stationIDs)):
+                now, then = sums[index][column], sums[earlier][column]
+                if now is not None and then is not None:
+                    differences[index][column] = now - then
+
+    return sums, rolling, differences
+
+#rows of values with None wherever valid is False
+def _rows(values, valid):
+    rows = values.astype(object)
+    rows[~valid] = None
+    return rows.tolist()
+
+#_combine with NumPy over _daily_numbers arrays: each day's period is
+#found by searchsorted on the period start day numbers and summed into
+#its (period, station) cell with np.add.at, and the rolling means and
+#year-earlier changes come from cumulative sums and shifted rows
+#instead of per-period loops
+def _combine_arrays(numbers, stationIDs, starts, position, granularity, window, yoy):
+    np = columnar.np
+    ids, days, riders = numbers
+    distinct = sorted(set(stationIDs))
+    periods, width = len(starts), len(stationIDs)
+    startDays = np.array(starts, dtype='datetime64[D]').astype(np.int64)
+
+    cells = (np.searchsorted(startDays, days, side='right') - 1) * len(distinct)
+    cells += np.searchsorted(np.array(distinct, dtype=np.int64), ids)
+    sums = np.zeros(periods * len(distinct), dtype=np.int64)
+    np.add.at(sums, cells, riders)
+    present = np.bincount(cells, minlength=periods * len(distinct)) > 0
+
+    #one column per requested station, repeats included
+    columns = [distinct.index(stationID) for stationID in stationIDs]
+    sums = sums.reshape(periods, len(distinct))[:, columns]
+    present = present.reshape(periods, len(distinct))[:, columns]
+
+    rolling = [[None] * width for _ in starts]
+    differences = [[None] * width for _ in starts]
+    if window is not None:
+        #totals and counts of the last window periods, as differences of
+        #running sums with a leading row of zeros
+        totals = np.zeros((periods + 1, width), dtype=np.int64)
+        counts = np.zeros((periods + 1, width), dtype=np.int64)
+        np.cumsum(sums, axis=0, out=totals[1:])
+        np.cumsum(present, axis=0, out=counts[1:])
+        dropped = np.maximum(np.arange(periods) + 1 - window, 0)
+        total, count = totals[1:] - totals[dropped], counts[1:] - counts[dropped]
+        valid = (count > 0) & (np.arange(periods) >= window - 1)[:, None]
+        rolling = _rows(np.divide(total, count, out=np.zeros((periods, width)), where=valid), valid)
+
+    if yoy:
+        earlier = np.array([position.get(year_before(periodStart, granularity), -1) for periodStart in starts],
+                           dtype=np.int64)
+        valid = present & present[earlier] & (earlier >= 0)[:, None]
+        differences = _rows(sums - sums[earlier], valid)
+
+    return _rows(sums, present), rolling, differences
+
+##################################################################
+#
+# ridership_series
+#
+# TimeSeries of the stations from the period containing start up to
+# (not including) end, both 'YYYY-MM-DD', at a granularity from
+# GRANULARITIES. window, if
+# given, is the number of periods in the rolling mean, and yoy adds
+# the change from a year earlier. Periods with no ridership are None.
+# Raises ValueError for a bad date, granularity or window.
+#
+@queries.cached
+def ridership_series(dbConn, stations, start, end, granularity='month', window=None, yoy=False):
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if window is not None and window < 1:
+        raise ValueError("window must be at least 1 period")
+
+    first = period_start(datetime.date.fromisoformat(start), granularity)
+    last = datetime.date.fromisoformat(end)
+    stations = tuple(stations)
+
+    #read far enough back that the first reported period has a full
+    #window and a year-earlier value
+    readFrom = first
+    for _ in range((window or 1) - 1):
+        readFrom = period_start(readFrom - datetime.timedelta(days=1), granularity)
+    if yoy:
+        readFrom = min(readFrom, period_start(datetime.date(first.year - 1, first.month, 1), granularity))
+
+    #every period from readFrom to end, so windows count empty periods
+    starts = []
+    day = readFrom
+    while day < last:
+        starts.append(day)
+        day = next_period(day, granularity)
+    position = {periodStart: index for index, periodStart in enumerate(starts)}
+
+    stationIDs = tuple(station.station_id for station in stations)
+    if columnar.available():
+        numbers = _daily_numbers(dbConn, tuple(dict.fromkeys(stationIDs)), readFrom.isoformat(), last.isoformat())
+        sums, rolling, differences = _combine_arrays(numbers, stationIDs, starts, position, granularity, window, yoy)
+    else:
+        daily = _daily_totals(dbConn, stationIDs, readFrom.isoformat(), last.isoformat())
+        sums, rolling, differences = _combine(daily, stationIDs, starts, position, granularity, window, yoy)
+
+    keep = position[first] if first in position else len(starts)
+    return TimeSeries(stations, granularity, window,
+                      tuple(period_label(periodStart, granularity) for periodStart in starts[keep:]),
+                      tuple(tuple(row) for row in sums[keep:]),
+                      tuple(tuple(row) for row in rolling[keep:]) if window is not None else (),
+                      tuple(tuple(row) for row in differences[keep:]) if yoy else ())
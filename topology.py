@@ -0,0 +1,216 @@
+##################################################################
+# topology.py
+#
+# Overview: In-memory transit topology for the CTA L analysis app
+#   TransitTopology holds every line, the stops of each line in each
+#   direction and the station of each stop, built in one pass over
+#   Lines, Stops, StopDetails and Stations. Commands 4 and 5 are
+#   answered from it without SQL, and it also finds transfer stations
+#   (served by more than one line) and the stops between two stations.
+#   The rows it is built from are saved as JSON next to the database
+#   with the stats_cache.py change count, and reused until a row of
+#   any table is inserted, updated or deleted.
+#
+#   The tables don't record stop order, so a line's stops in travel
+#   order are sorted by position: northbound by rising latitude,
+#   southbound by falling latitude, and likewise longitude for east
+#   and westbound.
+##################################################################
+
+import json
+import os
+from dataclasses import dataclass
+
+import queries
+import stats_cache
+
+#(Line_ID, Color) of every line
+QUERY_LINES = "SELECT Line_ID, Color FROM Lines"
+
+#every stop once per line serving it, or once with a NULL Line_ID
+QUERY_STOPS = """
+    SELECT s.Stop_ID, s.Station_ID, st.Station_Name, s.Stop_Name, s.Direction, s.ADA,
+           s.Latitude, s.Longitude, sd.Line_ID
+    FROM Stops s
+    LEFT JOIN Stations st ON s.Station_ID = st.Station_ID
+    LEFT JOIN StopDetails sd ON s.Stop_ID = sd.Stop_ID
+"""
+
+#row count and highest rowid of each table the topology reads, saved
+#with the change count so a file copied over the database misses too
+QUERY_FINGERPRINT = """
+    SELECT
+        (SELECT COUNT(*) || ':' || IFNULL(MAX(rowid), 0) FROM Lines),
+        (SELECT COUNT(*) || ':' || IFNULL(MAX(rowid), 0) FROM Stops),
+        (SELECT COUNT(*) || ':' || IFNULL(MAX(rowid), 0) FROM StopDetails),
+        (SELECT COUNT(*) || ':' || IFNULL(MAX(rowid), 0) FROM Stations)
+"""
+
+#the coordinate that grows in each direction of travel, and its sign
+TRAVEL_ORDER = {'N': (6, 1), 'S': (6, -1), 'E': (7, 1), 'W': (7, -1)}
+
+@dataclass(frozen=True, slots=True)
+class TopologyStop:
+    stop_id: int
+    station: 'queries.Station'
+    stop_name: str
+    direction: str
+    ada: bool
+    latitude: float
+    longitude: float
+
+@dataclass(frozen=True, slots=True)
+class TransferStation:
+    station: 'queries.Station'
+    colors: tuple
+
+#sort key putting a line's stops in travel order for a direction,
+#stops without coordinates last
+def _travel_key(direction):
+    column, sign = TRAVEL_ORDER.get(direction.upper(), (6, 1))
+    def key(row):
+        value = row[column]
+        return (value is None, sign * value if value is not None else 0, row[3])
+    return key
+
+##################################################################
+#
+# TransitTopology
+#
+# Built from QUERY_LINES and QUERY_STOPS rows.
+#
+class TransitTopology:
+    def __init__(self, lineRows, stopRows):
+        self.lineRows = [tuple(row) for row in lineRows]
+        self.stopRows = [tuple(row) for row in stopRows]
+
+        #lower-case color -> Line_ID, Line_ID -> color
+        self.line_ids = {color.lower(): lineID for lineID, color in self.lineRows}
+        self.colors = {lineID: color for lineID, color in self.lineRows}
+
+        stopIDs = set()
+        byLine = {}
+        lineColors = {}
+        for row in self.stopRows:
+            stopID, stationID, stationName, _, direction, _, _, _, lineID = row
+            stopIDs.add(stopID)
+            if lineID is None or lineID not in self.colors:
+                continue
+            byLine.setdefault((lineID, direction.upper()), []).append(row)
+            lineColors.setdefault((stationID, stationName), set()).add(self.colors[lineID])
+
+        self.total_stops = len(stopIDs)
+
+        #(Line_ID, direction) -> stops by stop name, and in travel order
+        self._byName = {}
+        self._inOrder = {}
+        for (lineID, direction), rows in byLine.items():
+            self._byName[(lineID, direction)] = tuple(self._stop(row) for row in sorted(rows, key=lambda row: row[3]))
+            self._inOrder[(lineID, direction)] = tuple(self._stop(row) for row in sorted(rows, key=_travel_key(direction)))
+
+        self._colorCounts = tuple(queries.ColorCount(self.colors[lineID], direction, len(stops))
+                                  for (lineID, direction), stops in sorted(
+                                      self._byName.items(), key=lambda item: (self.colors[item[0][0]], item[0][1])))
+
+        byStationName = sorted(lineColors.items(), key=lambda item: (item[0][1] or '', item[0][0]))
+        self._transfers = tuple(TransferStation(queries.Station(stationID, stationName), tuple(sorted(colors)))
+                                for (stationID, stationName), colors in byStationName
+                                if len(colors) > 1)
+
+    def _stop(self, row):
+        stopID, stationID, stationName, stopName, direction, ada, lat, lon, _ = row
+        return TopologyStop(stopID, queries.Station(stationID, stationName), stopName, direction, ada == 1, lat, lon)
+
+    #Line_ID of a color, case-insensitive, or None
+    def line_id(self, color):
+        return self.line_ids.get(color.strip().lower())
+
+    #LineStops of a line going in a direction, by stop name
+    def line_stops(self, lineID, direction):
+        return tuple(queries.LineStop(stop.stop_name, stop.direction, stop.ada)
+                     for stop in self._byName.get((lineID, direction.upper()), ()))
+
+    #ColorCounts of every color and direction, by color then direction
+    def stops_per_color(self):
+        return self._colorCounts
+
+    #stations served by more than one line, by station name
+    def transfer_stations(self):
+        return self._transfers
+
+    ##################################################################
+    #
+    # stops_between
+    #
+    # TopologyStops of a line in a direction from the stop at station
+    # fromID through the stop at station toID, in travel order. Empty
+    # if the line doesn't reach one of them or runs the other way.
+    #
+    def stops_between(self, lineID, direction, fromID, toID):
+        stops = self._inOrder.get((lineID, direction.upper()), ())
+        positions = {stop.station.station_id: index for index, stop in enumerate(stops)}
+        if fromID not in positions or toID not in positions or positions[fromID] > positions[toID]:
+            return ()
+        return stops[positions[fromID]:positions[toID] + 1]
+
+#path of the JSON copy of the topology rows next to the database
+def _cache_path(dbConn):
+    for _, name, path in dbConn.execute("PRAGMA database_list"):
+        if name == 'main' and path and os.path.exists(path):
+            return os.path.splitext(path)[0] + '.topology.json'
+    return None
+
+##################################################################
+#
+# load_topology
+#
+# Builds the topology from the JSON copy if it was saved at the
+# current Data_Version change count, otherwise from the tables (saving
+# a new copy). Without Data_Version, where an UPDATE would go unseen,
+# the copy is neither used nor written.
+#
+def load_topology(dbConn):
+    version = stats_cache.change_count(dbConn)
+    fingerprint = "/".join(dbConn.execute(QUERY_FINGERPRINT).fetchone())
+    path = _cache_path(dbConn) if version is not None else None
+
+    if path:
+        try:
+            with open(path) as saved:
+                data = json.load(saved)
+            if data.get('version') == version and data.get('fingerprint') == fingerprint:
+                return TransitTopology(data['lines'], data['stops'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    lineRows = dbConn.execute(QUERY_LINES).fetchall()
+    stopRows = dbConn.execute(QUERY_STOPS).fetchall()
+    topology = TransitTopology(lineRows, stopRows)
+
+    if path:
+        try:
+            with open(path, 'w') as saved:
+                json.dump({'version': version, 'fingerprint': fingerprint, 'lines': lineRows, 'stops': stopRows}, saved)
+        except OSError:
+            pass
+
+    return topology
+
+#(stats_cache.data_key, TransitTopology) of the last database loaded
+_topology = (None, None)
+
+##################################################################
+#
+# get_topology
+#
+# Returns the shared TransitTopology, loading it on first use and
+# again whenever the database or its data changes.
+#
+def get_topology(dbConn):
+    global _topology
+    key = stats_cache.data_key(dbConn)
+    loadedKey, loaded = _topology
+    if loaded is None or loadedKey != key:
+        loaded = load_topology(dbConn)
+        _topology = (key, loaded)
+    return loaded
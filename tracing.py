@@ -0,0 +1,304 @@
+##################################################################
+# tracing.py
+#
+# Overview: Query tracing and the slow-query log for the CTA L analysis app
+#   TracingConnection is a sqlite3 connection whose cursors time every
+#   statement from execute until its rows are read, counting the rows.
+#   Each trace is filed under the REPL command that ran it (see
+#   command()), and the REPL's stats command prints per-command latency
+#   histograms and the costliest queries. Statements slower than the
+#   threshold are appended to a slow-query log, with their EXPLAIN
+#   QUERY PLAN when plans are enabled. PRAGMA and EXPLAIN statements
+#   the app issues for itself are not traced.
+##################################################################
+
+import contextlib
+import sqlite3
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import indexes
+
+#upper bounds, in milliseconds, of the histogram buckets
+HISTOGRAM_BUCKETS_MS = (1, 5, 20, 100, 500)
+
+#traces kept for the stats report
+MAX_TRACES = 10_000
+
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG = 'slow_queries.log'
+
+@dataclass(slots=True)
+class QueryTrace:
+    command: str
+    sql: str
+    params: tuple
+    seconds: float
+    rows: int
+    plan: tuple = ()
+
+    @property
+    def ms(self):
+        return self.seconds * 1000
+
+#one line of SQL text, for reports and the log
+def _one_line(sql):
+    return " ".join(sql.split())
+
+##################################################################
+#
+# Tracer
+#
+# Collects finished traces and writes the slow ones to the log.
+#
+class Tracer:
+    def __init__(self, slowMs=SLOW_QUERY_MS, slowLog=SLOW_QUERY_LOG, explain=False):
+        self.slowMs = slowMs
+        self.slowLog = slowLog
+        self.explain = explain
+        self.traces = deque(maxlen=MAX_TRACES)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    #REPL command the current thread is running
+    @property
+    def command(self):
+        return getattr(self._local, 'command', 'other')
+
+    @command.setter
+    def command(self, name):
+        self._local.command = name
+
+    def record(self, dbConn, trace):
+        slow = self.slowMs is not None and trace.ms >= self.slowMs
+        if slow and self.explain:
+            try:
+                trace.plan = tuple(indexes.explain_query(dbConn, trace.sql, trace.params))
+            except sqlite3.Error:
+                pass
+
+        with self._lock:
+            self.traces.append(trace)
+            if slow and self.slowLog:
+                with open(self.slowLog, 'a') as log:
+                    log.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{trace.command}] {trace.ms:.1f} ms, "
+                              f"{trace.rows} rows: {_one_line(trace.sql)} params={trace.params!r}\n")
+                    for detail in trace.plan:
+                        log.write(f"    {detail}\n")
+
+    def clear(self):
+        with self._lock:
+            self.traces.clear()
+
+    ##################################################################
+    #
+    # summary
+    #
+    # {command: {'queries', 'total_ms', 'p50_ms', 'p95_ms', 'max_ms',
+    # 'histogram'}} where histogram counts queries per bucket of
+    # HISTOGRAM_BUCKETS_MS plus one for anything slower.
+    #
+    def summary(self):
+        with self._lock:
+            traces = list(self.traces)
+
+        byCommand = {}
+        for trace in traces:
+            byCommand.setdefault(trace.command, []).append(trace.ms)
+
+        found = {}
+        for command, times in sorted(byCommand.items()):
+            times.sort()
+            histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+            for ms in times:
+                bucket = 0
+                while bucket < len(HISTOGRAM_BUCKETS_MS) and ms >= HISTOGRAM_BUCKETS_MS[bucket]:
+                    bucket += 1
+                histogram[bucket] += 1
+            found[command] = {
+                'queries': len(times),
+                'total_ms': sum(times),
+                'p50_ms': times[(len(times) - 1) // 2],
+                'p95_ms': times[min(len(times) - 1, int(len(times) * 0.95))],
+                'max_ms': times[-1],
+                'histogram': histogram,
+            }
+        return found
+
+    #[(sql, calls, total ms, rows)] of the costliest statements
+    def top_queries(self, limit=5):
+        with self._lock:
+            traces = list(self.traces)
+
+        grouped = {}
+        for trace in traces:
+            calls, totalMs, rows = grouped.get(trace.sql, (0, 0.0, 0))
+            grouped[trace.sql] = (calls + 1, totalMs + trace.ms, rows + trace.rows)
+
+        ranked = sorted(grouped.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [(sql, calls, totalMs, rows) for sql, (calls, totalMs, rows) in ranked]
+
+_tracer = Tracer()
+
+def get_tracer():
+    return _tracer
+
+##################################################################
+#
+# configure
+#
+# Sets the slow-query threshold (None turns the log off), the log
+# file, and whether slow queries get their plan logged.
+#
+def configure(slowMs=SLOW_QUERY_MS, slowLog=SLOW_QUERY_LOG, explain=False):
+    _tracer.slowMs = slowMs
+    _tracer.slowLog = slowLog
+    _tracer.explain = explain
+
+##################################################################
+#
+# command
+#
+# Files the queries run inside the with block under name.
+#
+@contextlib.contextmanager
+def command(name):
+    previous = _tracer.command
+    _tracer.command = name
+    try:
+        yield
+    finally:
+        _tracer.command = previous
+
+#statements the app runs for itself, not worth tracing
+def _untraced(sql):
+    return sql.lstrip()[:7].upper() in ('PRAGMA ', 'EXPLAIN')
+
+##################################################################
+#
+# TracingCursor
+#
+# Times a statement from execute until its last row is read (or the
+# cursor moves on), since SQLite does most of the work while rows are
+# fetched.
+#
+class TracingCursor(sqlite3.Cursor):
+    _trace = None
+    _started = 0.0
+
+    def execute(self, sql, params=()):
+        self._finish()
+        if _untraced(sql):
+            return super().execute(sql, params)
+
+        self._trace = QueryTrace(_tracer.command, sql, tuple(params), 0.0, 0)
+        self._started = time.perf_counter()
+        try:
+            result = super().execute(sql, params)
+        except sqlite3.Error:
+            self._trace = None
+            raise
+        self._pause()
+        return result
+
+    #adds the time since _started to the current trace
+    def _pause(self):
+        if self._trace is not None:
+            self._trace.seconds += time.perf_counter() - self._started
+
+    def _finish(self):
+        trace, self._trace = self._trace, None
+        if trace is not None:
+            _tracer.record(self.connection, trace)
+
+    def _fetched(self, rows, done):
+        if self._trace is not None:
+            self._pause()
+            self._trace.rows += rows
+            if done:
+                self._finish()
+
+    def fetchone(self):
+        self._started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        self._started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        self._started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(len(rows), True)
+        return rows
+
+    def __next__(self):
+        self._started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(0, True)
+            raise
+        self._fetched(1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+##################################################################
+#
+# TracingConnection
+#
+# Connection factory (sqlite3.connect(..., factory=TracingConnection))
+# whose cursors, including those behind Connection.execute, trace.
+#
+class TracingConnection(sqlite3.Connection):
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+##################################################################
+#
+# print_trace_report
+#
+# The REPL's stats command: query latency per command as percentiles
+# and a histogram, then the statements that took the most time.
+#
+def print_trace_report():
+    summary = _tracer.summary()
+    if not summary:
+        print("**No queries traced yet...")
+        print()
+        return
+
+    labels = [f"<{bound}ms" for bound in HISTOGRAM_BUCKETS_MS] + [f">={HISTOGRAM_BUCKETS_MS[-1]}ms"]
+
+    print("Query Latency by Command")
+    for command, stats in summary.items():
+        print(f"{command} : {stats['queries']} queries, {stats['total_ms']:.1f} ms total, "
+              f"p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, max {stats['max_ms']:.2f} ms")
+        widest = max(stats['histogram'])
+        for label, count in zip(labels, stats['histogram']):
+            bar = '#' * round(20 * count / widest) if widest else ''
+            print(f"  {label:>8} {count:>6} {bar}")
+    print()
+
+    print("Most Expensive Queries")
+    for sql, calls, totalMs, rows in _tracer.top_queries():
+        text = _one_line(sql)
+        print(f"{totalMs:9.1f} ms {calls:>5} calls {rows:>8} rows  {text[:90]}{'...' if len(text) > 90 else ''}")
+    if _tracer.slowMs is not None and _tracer.slowLog:
+        print(f"Queries over {_tracer.slowMs} ms are logged to {_tracer.slowLog}")
+    print()